@@ -0,0 +1,636 @@
+import argparse
+import asyncio
+import builtins
+from collections import deque
+import dataclasses
+import importlib.util
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import mcfly
+
+corpus = {
+  'short arithmetic': ['3+3-3*3/3', '3+#pi*2', '7/2', '-4*2.5'],
+  'long chains': ['+'.join(['1'] * 200), '*'.join(['1.5'] * 200), '+'.join(['2*3'] * 100)],
+  'nested parentheses': ['(' * 40 + '2.5' + ')' * 40, '(' * 20 + '1+' * 20 + '1' + ')' * 20],
+  'boolean chains': ['True and False', 'not True', 'True or False', 'True xor False', '3.0===3', '(#pi*2) > 6'],
+  'strings': ['"Hello World!"', '"' + 'x' * 200 + '"', 'str? "McFly"'],
+  'math functions': ['sq 4 + sqrt 16', 'ceil 2.5 avg 4.5 - floor 7.25 * 3 avg 2', 'abs -3.5 + sqrt 2 avg ceil #e'],
+}
+
+# Revisions from before mcfly.py could be imported start the prompt at import
+# time. Refusing input stops that loop after every class has been defined.
+class StopPrompt(Exception):
+  pass
+
+def refuse_input(prompt=''):
+  raise StopPrompt()
+
+def load_module(source):
+  temporary = not os.path.isfile(source)
+  if temporary:
+    text = subprocess.run(['git', 'show', f'{source}:mcfly.py'], capture_output=True, text=True, check=True).stdout
+    handle, path = tempfile.mkstemp(suffix='.py', prefix='mcfly_')
+    with os.fdopen(handle, 'w') as file:
+      file.write(text)
+  else:
+    path = source
+
+  spec = importlib.util.spec_from_file_location(f'mcfly_{abs(hash(source))}', path)
+  module = importlib.util.module_from_spec(spec)
+  original_input = builtins.input
+  builtins.input = refuse_input
+  try:
+    spec.loader.exec_module(module)
+  except StopPrompt:
+    pass
+  finally:
+    builtins.input = original_input
+    if temporary:
+      os.remove(path)
+  return module
+
+def stages(module):
+  lexer = getattr(module, 'FastLexer', module.Lexer)
+  parser = getattr(module, 'PrattParser', module.Parser)
+
+  def lex(text):
+    return lambda: list(lexer(text).generate_tokens())
+
+  def parse(text):
+    tokens = list(lexer(text).generate_tokens())
+    return lambda: parser(iter(tokens)).parse()
+
+  def interpret(text):
+    tree = parser(lexer(text).generate_tokens()).parse()
+    return lambda: module.Interpreter().visit(tree)
+
+  found = {'lex': lex, 'parse': parse, 'interpret': interpret}
+
+  def evaluate(text):
+    try:
+      return module.compile(text, optimizer=None).evaluate
+    except TypeError:
+      return module.compile(text).evaluate
+
+  if hasattr(module, 'compile'):
+    found['evaluate'] = evaluate
+
+  return found
+
+def measure(function, number):
+  latencies = []
+  for _ in range(number):
+    start = time.perf_counter_ns()
+    function()
+    latencies.append(time.perf_counter_ns() - start)
+  latencies.sort()
+
+  tracemalloc.start()
+  function()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  def percentile(fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] / 1000
+
+  return {
+    'per_second': number / (sum(latencies) / 1000000000),
+    'p50': percentile(0.50),
+    'p99': percentile(0.99),
+    'peak_kib': peak / 1024,
+  }
+
+# Expressions a stage can not run are left out of its timing and reported
+# with the first error, so a faster stage that quietly skips work is seen.
+def run_suite(module, number):
+  results = {}
+  failures = {}
+  for stage_name, prepare in stages(module).items():
+    for category, texts in corpus.items():
+      functions = []
+      for text in texts:
+        try:
+          function = prepare(text)
+          function()
+          functions.append(function)
+        except Exception as error:
+          failures.setdefault((category, stage_name), []).append((text, error))
+      if functions:
+        results[(category, stage_name)] = measure(lambda: [function() for function in functions], number)
+  return results, failures
+
+def report_failures(label, failures):
+  for (category, stage_name), failed in failures.items():
+    text, error = failed[0]
+    shown = text if len(text) <= 40 else text[:37] + '...'
+    print(f"{label}: {category} {stage_name}: {len(failed)} of {len(corpus[category])} expressions failed, first {shown!r}: {type(error).__name__}: {error}")
+
+def bench_suite(number=200, against=None):
+  current, current_failures = run_suite(mcfly, number)
+  other, other_failures = run_suite(load_module(against), number) if against else ({}, {})
+
+  header = f"{'category':20} {'stage':10} {'ops/s':>10} {'p50 us':>10} {'p99 us':>10} {'peak KiB':>9}"
+  if against:
+    header += f" {'other ops/s':>12} {'speedup':>8}"
+  print(header)
+
+  for (category, stage_name), stats in current.items():
+    line = f"{category:20} {stage_name:10} {stats['per_second']:10.0f} {stats['p50']:10.1f} {stats['p99']:10.1f} {stats['peak_kib']:9.1f}"
+    if (category, stage_name) in other:
+      other_per_second = other[(category, stage_name)]['per_second']
+      line += f" {other_per_second:12.0f} {stats['per_second'] / other_per_second:7.2f}x"
+    print(line)
+
+  if current_failures or other_failures:
+    print()
+  report_failures('current', current_failures)
+  report_failures(against, other_failures)
+
+def count_nodes(tree):
+  count = 0
+  pending = [tree]
+  while pending:
+    node = pending.pop()
+    count += 1
+    for node_field in dataclasses.fields(node):
+      child = getattr(node, node_field.name)
+      if dataclasses.is_dataclass(child):
+        pending.append(child)
+  return count
+
+def traced_bytes(build):
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  kept = build()
+  used = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  return kept, used
+
+def memory_per_item(module, copies):
+  lexer = getattr(module, 'FastLexer', module.Lexer)
+  parser = getattr(module, 'PrattParser', module.Parser)
+  texts = [text for texts in corpus.values() for text in texts]
+
+  tokens, token_bytes = traced_bytes(lambda: [list(lexer(text).generate_tokens()) for text in texts for _ in range(copies)])
+  token_count = sum(len(token_list) for token_list in tokens)
+
+  token_lists = [list(lexer(text).generate_tokens()) for text in texts]
+  trees, tree_bytes = traced_bytes(lambda: [parser(iter(token_list)).parse() for token_list in token_lists for _ in range(copies)])
+  node_count = sum(count_nodes(tree) for tree in trees)
+
+  return token_bytes / token_count, tree_bytes / node_count
+
+def bench_memory(copies=100, against=None):
+  modules = [('current', mcfly)]
+  if against:
+    modules.append((against, load_module(against)))
+
+  print(f"{'revision':20} {'bytes/token':>12} {'bytes/node':>12}")
+  for name, module in modules:
+    token_bytes, node_bytes = memory_per_item(module, copies)
+    print(f'{name:20} {token_bytes:12.1f} {node_bytes:12.1f}')
+
+def time_per_call(function, number):
+  return timeit.timeit(function, number=number) / number * 1000000
+
+def bench_compiler(number=2000):
+  print(f"{'expression':40} {'interpreter':>12} {'compiled':>12} {'speedup':>8}")
+
+  for texts in corpus.values():
+    for text in texts:
+      expression = mcfly.compile(text, optimizer=None)
+      if expression.evaluate() != expression.interpret():
+        raise Exception(f'Compiled result differs from the Interpreter for {text}')
+
+      interpreter_us = time_per_call(expression.interpret, number)
+      compiled_us = time_per_call(expression.evaluate, number)
+      print(f'{text[:40]:40} {interpreter_us:10.2f}us {compiled_us:10.2f}us {interpreter_us / compiled_us:7.1f}x')
+
+def bench_vm(number=2000):
+  print(f"{'expression':40} {'interpreter':>12} {'closures':>12} {'bytecode':>12} {'speedup':>8}")
+
+  for texts in corpus.values():
+    for text in texts:
+      expression = mcfly.compile(text, optimizer=None)
+      bytecode = mcfly.compile_bytecode(text)
+      if bytecode.evaluate() != expression.interpret():
+        raise Exception(f'Bytecode result differs from the Interpreter for {text}')
+
+      interpreter_us = time_per_call(expression.interpret, number)
+      closures_us = time_per_call(expression.evaluate, number)
+      bytecode_us = time_per_call(bytecode.evaluate, number)
+      print(f'{text[:40]:40} {interpreter_us:10.2f}us {closures_us:10.2f}us {bytecode_us:10.2f}us {interpreter_us / bytecode_us:7.1f}x')
+
+  # Long enough that the recursive tree walkers run out of stack.
+  text = '+'.join(['1'] * 20000)
+  bytecode = mcfly.compile_bytecode(text)
+  bytecode_us = time_per_call(bytecode.evaluate, max(1, number // 100))
+  try:
+    mcfly.compile(text, optimizer=None).interpret()
+    walker = 'ok'
+  except RecursionError:
+    walker = 'RecursionError'
+  print(f"{'1+1+... (20000 terms)':40} {walker:>12} {walker:>12} {bytecode_us:10.2f}us")
+
+formula_templates = [
+  '{index} + #x * 2', 'sq #x + {index} / 3', '(#x avg {index}) - floor {index}.5',
+  'abs (#x - {index}) * #pi', 'ceil ({index} / 7) + sqrt (#x * {index})'
+]
+
+def generate_formulas(count):
+  return [formula_templates[index % len(formula_templates)].format(index=index) for index in range(count)]
+
+def bench_catalog(count=100000):
+  texts = generate_formulas(count)
+  handle, path = tempfile.mkstemp(suffix='.mcb', prefix='mcfly_')
+  os.close(handle)
+
+  try:
+    start = time.perf_counter()
+    mcfly.write_catalog(path, texts)
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    catalog = mcfly.BytecodeCatalog(path)
+    open_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bytecodes = [catalog[index] for index in range(len(catalog))]
+    decode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expressions = [mcfly.compile(text, optimizer=None) for text in texts]
+    parse_seconds = time.perf_counter() - start
+
+    for index in range(0, count, max(1, count // 1000)):
+      if bytecodes[index].evaluate({'#x': 3}) != expressions[index].evaluate({'#x': 3}):
+        raise Exception(f'Catalog result differs from compile for {texts[index]}')
+
+    catalog.close()
+    print(f'{count} formulas, {os.path.getsize(path) / 1024:.0f} KiB catalog')
+    print(f"{'lex, parse and compile':28} {parse_seconds * 1000:10.1f}ms")
+    print(f"{'write catalog':28} {write_seconds * 1000:10.1f}ms")
+    print(f"{'open catalog':28} {open_seconds * 1000:10.3f}ms")
+    print(f"{'decode every entry':28} {decode_seconds * 1000:10.1f}ms")
+  finally:
+    os.remove(path)
+
+deep_inputs = {
+  'operator chain': lambda size: ('+'.join(['1'] * size), size),
+  'nested parentheses': lambda size: ('(' * size + '2.5' + ')' * size, 2.5),
+  'prefix chain': lambda size: ('- ' * (size * 2) + '3', 3),
+  'right nested sums': lambda size: ('(' * size + '1' + '+1)' * size, size + 1),
+  'nested variables': lambda size: ('(' * size + '#x' + ' * 1)' * size, 7),
+}
+
+def bench_deep(largest=100000):
+  sizes = [size for size in (1000, 10000, 100000, 1000000) if size < largest] + [largest]
+  print(f"{'input':20} {'size':>8} {'nodes':>8} {'depth':>8} {'seconds':>9} {'us/char':>8}")
+
+  for name, generate in deep_inputs.items():
+    for size in sizes:
+      text, expected = generate(size)
+      start = time.perf_counter()
+      expression = mcfly.compile(text)
+      result = expression.evaluate({'#x': 7})
+      seconds = time.perf_counter() - start
+
+      if result != expected:
+        raise Exception(f'{name} of size {size} returned {result} instead of {expected}')
+
+      nodes = count_nodes(expression.tree)
+      print(f'{name:20} {size:8} {nodes:8} {mcfly.tree_depth(expression.tree):8} {seconds:9.3f} {seconds / len(text) * 1000000:8.2f}')
+
+def open_server_connection(address):
+  if '/' in address:
+    return asyncio.open_unix_connection(address)
+  host, _, port = address.rpartition(':')
+  return asyncio.open_connection(host or '127.0.0.1', int(port))
+
+# Keeps up to window requests in flight on one connection and records the
+# time from sending each request to reading its response line.
+async def load_connection(address, texts, count, window, latencies):
+  reader, writer = await open_server_connection(address)
+  sent = deque()
+  slots = asyncio.Semaphore(window)
+
+  async def send():
+    for index in range(count):
+      await slots.acquire()
+      sent.append(time.perf_counter())
+      writer.write(f'{texts[index % len(texts)]}\n'.encode())
+      await writer.drain()
+
+  sender = asyncio.create_task(send())
+  for _ in range(count):
+    if not await reader.readline():
+      raise Exception('Server closed the connection')
+    latencies.append(time.perf_counter() - sent.popleft())
+    slots.release()
+
+  await sender
+  writer.close()
+
+async def load_server(address, requests, connections, window):
+  texts = [text for texts in corpus.values() for text in texts]
+  latencies = []
+  per_connection = requests // connections
+
+  start = time.perf_counter()
+  await asyncio.gather(*[load_connection(address, texts, per_connection, window, latencies) for _ in range(connections)])
+  seconds = time.perf_counter() - start
+
+  latencies.sort()
+  print(f'{len(latencies)} requests over {connections} connections, {window} in flight each')
+  print(f'{len(latencies) / seconds:.0f} requests/s, p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms')
+
+def bench_server(requests=100000, address=None, connections=8, window=64):
+  if address != None:
+    asyncio.run(load_server(address, requests, connections, window))
+    return
+
+  with tempfile.TemporaryDirectory() as directory:
+    address = os.path.join(directory, 'mcfly.sock')
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcfly.py'), '--unix', address], stderr=subprocess.PIPE)
+    try:
+      server.stderr.readline()
+      asyncio.run(load_server(address, requests, connections, window))
+    finally:
+      server.terminate()
+      server.wait()
+
+def bench_incremental(number=1000):
+  text = ' + '.join(f'(#x*{index} - sq ({index} avg 2))' for index in range(200))
+  edits = []
+  for index in range(number):
+    offset = text.index(f'*{index % 200} ') + 1
+    edits.append((offset, len(str(index % 200)), str(index % 200 + 1)))
+
+  previous = mcfly.parse_incremental(text)
+  for offset, deleted, inserted in edits:
+    edited = previous.edit(offset, deleted, inserted)
+    if edited.tree != mcfly.PrattParser(mcfly.FastLexer(edited.text).generate_tokens()).parse():
+      raise Exception('Incremental parse differs from a full parse')
+  start = time.perf_counter()
+  lexed_tokens = 0
+  for offset, deleted, inserted in edits:
+    edited = previous.edit(offset, deleted, inserted)
+    lexed_tokens += edited.lexed_tokens
+  incremental_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for offset, deleted, inserted in edits:
+    edited_text = text[:offset] + inserted + text[offset + deleted:]
+    mcfly.PrattParser(mcfly.FastLexer(edited_text).generate_tokens()).parse()
+  full_seconds = time.perf_counter() - start
+
+  print(f'{number} single number edits of a {len(text)} character, {len(previous.tokens)} token formula')
+  print(f"{'full lex and parse':24} {full_seconds / number * 1000000:10.1f}us per edit")
+  print(f"{'incremental':24} {incremental_seconds / number * 1000000:10.1f}us per edit, {lexed_tokens / number:.1f} tokens lexed")
+
+def bench_numbers(number=2000):
+  backends = [('float', mcfly.float_numbers), ('fraction', mcfly.FractionNumbers()), ('decimal', mcfly.DecimalNumbers())]
+  print(f"{'expression':40}" + ''.join(f' {name:>12}' for name, _ in backends))
+
+  for texts in corpus.values():
+    for text in texts:
+      timings = []
+      for name, numbers in backends:
+        tree = mcfly.PrattParser(mcfly.FastLexer(text, numbers.parse).generate_tokens()).parse()
+
+        def interpret():
+          with numbers.context():
+            return mcfly.Interpreter(None, numbers).visit(tree)
+
+        interpret()
+        timings.append(time_per_call(interpret, number))
+      print(f'{text[:40]:40}' + ''.join(f' {timing:10.2f}us' for timing in timings))
+
+typed_formulas = [
+  '#x*#x + #y*#y - 2*#x*#y',
+  '((#x - #y) * (#x + #y)) > 100',
+  'abs (#x - 3) + ceil #y * 2',
+  '-#x * 1.5 + #y * 2.5 - #x * #y',
+]
+
+def bench_types(number=20000):
+  variables = {'#x': 7, '#y': 4}
+  types = {'#x': int, '#y': int}
+  print(f"{'expression':40} {'untyped':>12} {'typed':>12} {'speedup':>8}")
+
+  for text in typed_formulas:
+    untyped = mcfly.compile(text)
+    typed = mcfly.compile(text, types=types)
+    if typed.evaluate(variables) != untyped.evaluate(variables):
+      raise Exception(f'Typed result differs for {text}')
+
+    untyped_us = time_per_call(lambda: untyped.evaluate(variables), number)
+    typed_us = time_per_call(lambda: typed.evaluate(variables), number)
+    print(f'{text[:40]:40} {untyped_us:10.2f}us {typed_us:10.2f}us {untyped_us / typed_us:7.2f}x')
+
+rule_templates = [
+  '#temp > {a} and #temp <= {b}', '#humidity >= {a} and #humidity < {b}',
+  '#temp == {a}', '({a} <= #pressure and #pressure < {b}) and #temp > {a}',
+  '(#pressure > {b} and #pressure < {c}) or #humidity == {a}'
+]
+
+def generate_rules(count):
+  generator = random.Random(42)
+  rules = []
+  for index in range(count):
+    a = generator.randint(0, 1000)
+    b = a + generator.randint(1, 50)
+    rules.append(rule_templates[index % len(rule_templates)].format(a=a, b=b, c=b + generator.randint(1, 50)))
+  return rules
+
+def bench_rules(count=100000, events=100):
+  rules = generate_rules(count)
+  generator = random.Random(7)
+  samples = [{name: generator.randint(0, 1050) for name in ('#temp', '#humidity', '#pressure')} for _ in range(events)]
+
+  start = time.perf_counter()
+  index = mcfly.RuleIndex(rules)
+  index.build()
+  build_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  matches = [index.match(sample) for sample in samples]
+  match_seconds = time.perf_counter() - start
+
+  expressions = [mcfly.compile(text) for text in rules]
+  checked = samples[:10]
+  start = time.perf_counter()
+  for sample, matched in zip(checked, matches):
+    if {rule_id for rule_id, expression in enumerate(expressions) if expression.evaluate(sample) is True} != matched:
+      raise Exception(f'Rule index matches differ from evaluating every rule for {sample}')
+  evaluate_seconds = (time.perf_counter() - start) / len(checked)
+
+  print(f"{count} rules, {index.stats()['fallback']} not indexed, {sum(map(len, matches)) / events:.0f} matches per event")
+  print(f"{'build index':24} {build_seconds * 1000:10.1f}ms")
+  print(f"{'evaluate every rule':24} {evaluate_seconds * 1000:10.3f}ms per event")
+  print(f"{'rule index':24} {match_seconds / events * 1000:10.3f}ms per event")
+
+# Rows of an input #p, two formulas over it, a sum of every block of 100 rows
+# and one total of all block sums.
+def generate_sheet(cells):
+  rows = max(100, cells // 3 // 100 * 100)
+  values = {f'#p{row}': row % 97 for row in range(rows)}
+  formulas = {}
+  for row in range(rows):
+    formulas[f'#q{row}'] = f'#p{row} * 1.5 + 2'
+    formulas[f'#r{row}'] = f'#q{row} - #p{row} avg 3'
+  for block in range(rows // 100):
+    formulas[f'#s{block}'] = ' + '.join(f'#r{row}' for row in range(block * 100, block * 100 + 100))
+  formulas['#total'] = ' + '.join(f'#s{block}' for block in range(rows // 100))
+  return formulas, values
+
+def bench_sheet(cells=1000000, updates=1000):
+  formulas, values = generate_sheet(cells)
+  rows = len(values)
+
+  start = time.perf_counter()
+  sheet = mcfly.FormulaSheet(formulas, values)
+  build_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  sheet.recalculate()
+  recalculate_seconds = time.perf_counter() - start
+
+  generator = random.Random(5)
+  evaluations = sheet.evaluations
+  start = time.perf_counter()
+  for _ in range(updates):
+    sheet.set_value(f'#p{generator.randrange(rows)}', generator.randint(0, 1000))
+  update_seconds = (time.perf_counter() - start) / updates
+  evaluations = (sheet.evaluations - evaluations) / updates
+
+  incremental = dict(sheet.values)
+  sheet.recalculate()
+  if sheet.values != incremental:
+    raise Exception('Incremental values differ from a full recalculation')
+
+  print(f'{len(formulas) + len(values)} cells, {len(formulas)} formulas, {len(sheet.shapes)} formula shapes')
+  print(f"{'build and calculate':24} {build_seconds * 1000:10.1f}ms")
+  print(f"{'full recalculation':24} {recalculate_seconds * 1000:10.1f}ms")
+  print(f"{'single cell update':24} {update_seconds * 1000:10.3f}ms, {evaluations:.0f} formulas evaluated")
+
+def bench_functions(number=20000):
+  body = 'sqrt (sq #a + sq #b) + abs (#a - #b) / 2'
+  mcfly.define_function('helper', ['#a', '#b'], body)
+  inline_node_limit = mcfly.inline_node_limit
+  mcfly.inline_node_limit = 0
+  try:
+    mcfly.define_function('called', ['#a', '#b'], body)
+  finally:
+    mcfly.inline_node_limit = inline_node_limit
+  memoized = mcfly.define_function('memoized', ['#a', '#b'], body, memo_size=1024)
+
+  written = mcfly.compile(f"({body.replace('#a', '#x').replace('#b', '#y')}) > ({body.replace('#a', '#y').replace('#b', '#x')})")
+  variants = [('written out', written)]
+  for name in ('helper', 'called', 'memoized'):
+    variants.append((name, mcfly.compile(f'fun {name} #x #y > fun {name} #y #x')))
+
+  bindings = [{'#x': x, '#y': y} for x in range(10) for y in range(10)]
+  print(f'{number} evaluations over {len(bindings)} different bindings')
+  for name, expression in variants:
+    if [expression.evaluate(variables) for variables in bindings] != [written.evaluate(variables) for variables in bindings]:
+      raise Exception(f'{name} differs from the written out formula')
+
+    seconds = timeit.timeit(lambda: [expression.evaluate(variables) for variables in bindings], number=max(1, number // len(bindings)))
+    print(f'{name:24} {seconds / number * 1000000:10.2f}us per evaluation')
+
+  print(f"memo {memoized.stats()}")
+
+def bench_tiers(cold=20000, cold_calls=3, hot=5, hot_calls=100000):
+  texts = generate_formulas(cold + hot)
+  workload = [(text, cold_calls) for text in texts[:cold]] + [(text, hot_calls) for text in texts[cold:]]
+  variables = {'#x': 3}
+  strategies = [
+    ('interpret everything', lambda: mcfly.ExpressionCache(cold + hot, threshold=sys.maxsize)),
+    ('compile everything', lambda: mcfly.ExpressionCache(cold + hot)),
+    (f'tiered ({mcfly.tier_threshold})', lambda: mcfly.ExpressionCache(cold + hot, threshold=mcfly.tier_threshold))
+  ]
+
+  print(f'{cold} formulas called {cold_calls} times and {hot} called {hot_calls} times')
+  for name, make_cache in strategies:
+    cache = make_cache()
+    start = time.perf_counter()
+    for text, calls in workload:
+      expression = cache.get(text)
+      for _ in range(calls):
+        expression.evaluate(variables)
+    seconds = time.perf_counter() - start
+    compiled = sum(1 for expression in cache.expressions.values() if not isinstance(expression, mcfly.TieredExpression) or expression.tier == 'compiled')
+    print(f'{name:24} {seconds * 1000:10.1f}ms, {compiled} formulas compiled')
+
+def bench_stream(count=20000, copies=100):
+  unique = [text.replace('#x', '3') for text in generate_formulas(count)]
+  files = [('no repeated lines', unique), (f'{copies} copies of each line', unique[:count // copies] * copies)]
+  strategies = [
+    ('compile every line', lambda: mcfly.ExpressionCache().evaluate),
+    (f'stream ({mcfly.stream_tier_threshold})', lambda: None)
+  ]
+
+  print(f'{count} lines through evaluate_stream')
+  for file_name, lines in files:
+    outputs = []
+    for name, make_evaluate in strategies:
+      output = io.StringIO()
+      evaluate_text = make_evaluate()
+      start = time.perf_counter()
+      mcfly.evaluate_stream([line + '\n' for line in lines], output, evaluate_text=evaluate_text)
+      seconds = time.perf_counter() - start
+      outputs.append(output.getvalue())
+      print(f'{file_name:24} {name:24} {seconds * 1000:10.1f}ms')
+
+    if any(output != outputs[0] for output in outputs):
+      raise Exception(f'The strategies print different results for {file_name}')
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser(description='McFly benchmarks')
+  arg_parser.add_argument('benchmark', nargs='?', default='suite', choices=['suite', 'compiler', 'memory', 'vm', 'catalog', 'deep', 'server', 'incremental', 'numbers', 'types', 'rules', 'sheet', 'functions', 'tiers', 'stream'])
+  arg_parser.add_argument('--number', type=int, help='iterations per measurement')
+  arg_parser.add_argument('--against', help='git revision or path of another mcfly.py to compare with')
+  arg_parser.add_argument('--address', help='[HOST:]PORT or Unix socket path of a running server to load')
+  arg_parser.add_argument('--connections', type=int, default=8, help='server connections to open')
+  arg_parser.add_argument('--window', type=int, default=64, help='pipelined requests in flight per connection')
+  options = arg_parser.parse_args()
+
+  if options.benchmark == 'suite':
+    bench_suite(options.number or 200, options.against)
+  elif options.benchmark == 'compiler':
+    bench_compiler(options.number or 2000)
+  elif options.benchmark == 'memory':
+    bench_memory(options.number or 100, options.against)
+  elif options.benchmark == 'vm':
+    bench_vm(options.number or 2000)
+  elif options.benchmark == 'catalog':
+    bench_catalog(options.number or 100000)
+  elif options.benchmark == 'deep':
+    bench_deep(options.number or 100000)
+  elif options.benchmark == 'server':
+    bench_server(options.number or 100000, options.address, options.connections, options.window)
+  elif options.benchmark == 'incremental':
+    bench_incremental(options.number or 1000)
+  elif options.benchmark == 'numbers':
+    bench_numbers(options.number or 2000)
+  elif options.benchmark == 'types':
+    bench_types(options.number or 20000)
+  elif options.benchmark == 'rules':
+    bench_rules(options.number or 100000)
+  elif options.benchmark == 'sheet':
+    bench_sheet(options.number or 1000000)
+  elif options.benchmark == 'functions':
+    bench_functions(options.number or 20000)
+  elif options.benchmark == 'tiers':
+    bench_tiers(options.number or 20000)
+  elif options.benchmark == 'stream':
+    bench_stream(options.number or 20000)
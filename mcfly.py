@@ -1,6 +1,27 @@
-from enum import Enum
+import argparse
+from array import array
+import asyncio
+from bisect import bisect_left
+from enum import Enum, IntEnum
+from functools import partial
+from itertools import islice
+import json
+from math import isqrt
+import mmap
+import operator
+import os
+import re
 import string
-from dataclasses import dataclass, field, replace
+import struct
+import sys
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from decimal import Context, Decimal, localcontext
+from fractions import Fraction
 
 # Important Characters #
 
@@ -18,8 +39,8 @@ important_numbers = {
 }
 
 important_words = {
-  'fun': 'Coming Soon: The word fun is reserved for creating custom functions.',
-  'if': 'Coming Soon: The word if is reserved for conditionals.',
+  'fun': 'The word fun calls a function made with define_function: fun <name> <arguments>.',
+  'if': 'The word if starts a conditional: if <condition> <value if True> <value if False>.',
   'sum': 'Coming Soon: The word sum is reserved for adding all the numbers in a set together.',
   'avg': 'Coming Soon: The term avg is reserved for calculating the average of a set numbers.'
 }
@@ -76,12 +97,15 @@ class TokenType(Enum):
   FLOOR          = 41
   ABSOLUTE_VALUE = 42
   ERROR_WORDS    = 43
+  GROUP          = 44
+  NAME           = 45
 
 # Lexer #
 
 class Lexer:
-  def __init__(self, text):
+  def __init__(self, text, float_number=float):
     self.text = iter(text)
+    self.float_number = float_number
     self.advance()
 
   def advance(self):
@@ -158,7 +182,10 @@ class Lexer:
       elif self.current_char == 'F':
         yield self.generate_false()
       elif self.current_char == 'f':
-        yield self.generate_f_keywords()
+        token = self.generate_f_keywords()
+        yield token
+        if token.type == TokenType.FUNCTION:
+          yield from self.generate_function_name()
       elif self.current_char == 'i':
         yield self.generate_i_keywords()
       elif self.current_char == 's':
@@ -192,7 +219,7 @@ class Lexer:
     if decimal_point_count == 0:
       return Token(TokenType.INTEGER, int(number_str))
     else:
-      return Token(TokenType.FLOAT, float(number_str))
+      return Token(TokenType.FLOAT, self.float_number(number_str))
 
   def generate_string(self):
     string_str = self.current_char
@@ -411,6 +438,18 @@ class Lexer:
     else:
       return Token(TokenType.ERROR_WORDS, self.show_error_words('f'))
 
+  # The word after fun is the name of a function, even when it is a keyword.
+  def generate_function_name(self):
+    while self.current_char != None and self.current_char in WHITESPACE:
+      self.advance()
+
+    if self.current_char != None and self.current_char in LETTERS:
+      name = ''
+      while self.current_char != None and self.current_char in LETTERS:
+        name += self.current_char
+        self.advance()
+      yield Token(TokenType.NAME, name)
+
   def generate_i_keywords(self):
     self.advance()
     if self.current_char == 'f':
@@ -480,38 +519,234 @@ class Lexer:
   def generate_error_words(self):
     return Token(TokenType.ERROR_WORDS, self.show_error_words(''))
 
+# Fast Lexer #
+
+keyword_tokens = {
+  'and': TokenType.AND_BOOLEAN,
+  'avg': TokenType.AVERAGE,
+  'abs': TokenType.ABSOLUTE_VALUE,
+  'or': TokenType.OR_BOOLEAN,
+  'odd?': TokenType.ODD_CHECK,
+  'xor': TokenType.XOR_BOOLEAN,
+  'not': TokenType.NOT_BOOLEAN,
+  'nor': TokenType.NOR_BOOLEAN,
+  'nand': TokenType.NAND_BOOLEAN,
+  'num?': TokenType.NUMBER_TYPE,
+  'True': TokenType.TRUE,
+  'False': TokenType.FALSE,
+  'fun': TokenType.FUNCTION,
+  'float?': TokenType.FLOAT_TYPE,
+  'floor': TokenType.FLOOR,
+  'if': TokenType.CONDITIONAL,
+  'int?': TokenType.INTEGER_TYPE,
+  'sum': TokenType.SUM,
+  'sq': TokenType.SQUARE,
+  'sqrt': TokenType.SQUARE_ROOT,
+  'str?': TokenType.STRING_TYPE,
+  'even?': TokenType.EVEN_CHECK,
+  'ceil': TokenType.CEIL
+}
+
+symbol_tokens = {
+  '+': TokenType.PLUS,
+  '-': TokenType.MINUS,
+  '*': TokenType.MULTIPLY,
+  '/': TokenType.DIVIDE,
+  '(': TokenType.LPAREN,
+  ')': TokenType.RPAREN,
+  '===': TokenType.TYPE_EQUAL,
+  '==': TokenType.MATH_EQUALS,
+  '>=': TokenType.GTE,
+  '>': TokenType.GT,
+  '<=': TokenType.LTE,
+  '<': TokenType.LT,
+  '!==': TokenType.TNE,
+  '!=': TokenType.NE
+}
+
+fixed_tokens = {**symbol_tokens, **keyword_tokens}
+
+# The legacy Lexer reads one more character after these keywords and fails
+# when the text ends right after them.
+end_check_keywords = {
+  'and', 'avg', 'abs', 'or', 'odd?', 'xor', 'not', 'nor', 'nand', 'num?',
+  'float?', 'floor', 'int?', 'even?', 'ceil'
+}
+
+sign_var_tokens = {
+  '#': TokenType.NUMBER_VAR,
+  '$': TokenType.STRING_VAR,
+  '@': TokenType.ARRAY_VAR
+}
+
+# Words directly followed by a letter and unknown characters only match the
+# single character catch-all. Those, unknown words
+# and unterminated strings hand the rest of the text to the legacy Lexer.
+TOKEN_PATTERN = re.compile(r'''[ \n\t]*(
+    [0-9]+(?:\.[0-9]*)?
+  | ===|!==|==|!=|>=|<=|[-+*/()<>]
+  | [A-Za-z]+\??(?![A-Za-z])
+  | [#$@][A-Za-z0-9_]*
+  | ".*
+  | .
+  |
+)''', re.VERBOSE | re.DOTALL)
+
+class FastLexer:
+  def __init__(self, text, float_number=float):
+    self.text = text
+    self.float_number = float_number
+
+  def generate_tokens(self):
+    lexemes = TOKEN_PATTERN.findall(self.text)
+    last_index = len(lexemes) - 2
+    after_function = False
+
+    for index, lexeme in enumerate(lexemes):
+      if after_function:
+        after_function = False
+        if lexeme != '' and lexeme[0] in LETTERS:
+          if not lexeme.isalpha():
+            yield from self.function_name_tokens(self.legacy_tokens(index - 1))
+            return
+          yield Token(TokenType.NAME, lexeme)
+          continue
+
+      token_type = fixed_tokens.get(lexeme)
+
+      if token_type != None:
+        if index == last_index and lexeme in end_check_keywords and self.text.endswith(lexeme):
+          yield from self.legacy_tokens(index)
+          return
+        yield Token(token_type)
+        after_function = token_type == TokenType.FUNCTION
+        continue
+
+      first_char = lexeme[:1]
+
+      if first_char == '':
+        return
+      elif first_char in DIGITS:
+        if '.' in lexeme:
+          yield Token(TokenType.FLOAT, self.float_number(lexeme))
+        else:
+          yield Token(TokenType.INTEGER, int(lexeme))
+      elif first_char in sign_var_tokens:
+        yield Token(sign_var_tokens[first_char], lexeme)
+      elif first_char == '"' and lexeme.endswith('"'):
+        yield Token(TokenType.STRING, lexeme)
+      else:
+        yield from self.legacy_tokens(index)
+        return
+
+  def legacy_tokens(self, index):
+    found = next(islice(TOKEN_PATTERN.finditer(self.text), index, None))
+    return Lexer(self.text[found.start(1):], self.float_number).generate_tokens()
+
+  # The legacy Lexer only reads a function name right after fun, so it starts
+  # at the fun that was already given out.
+  def function_name_tokens(self, tokens):
+    next(tokens)
+    return tokens
+
+# Gives every token its start and end offset in the text and can start at
+# any offset where a previous token ended. Tokens handed over to the legacy
+# Lexer all span from where it took over to the end of the text.
+class PositionLexer(FastLexer):
+  def generate_tokens(self, position=0):
+    text = self.text
+    function_start = None
+
+    for found in TOKEN_PATTERN.finditer(text, position):
+      lexeme = found.group(1)
+      start, end = found.span(1)
+
+      if function_start != None:
+        if lexeme != '' and lexeme[0] in LETTERS:
+          if not lexeme.isalpha():
+            yield from self.function_name_tokens(self.legacy_tokens_from(function_start))
+            return
+          yield Token(TokenType.NAME, lexeme, start, end)
+          function_start = None
+          continue
+        function_start = None
+
+      token_type = fixed_tokens.get(lexeme)
+
+      if token_type != None:
+        if end == len(text) and lexeme in end_check_keywords:
+          yield from self.legacy_tokens_from(start)
+          return
+        yield Token(token_type, None, start, end)
+        if token_type == TokenType.FUNCTION:
+          function_start = start
+        continue
+
+      first_char = lexeme[:1]
+
+      if first_char == '':
+        return
+      elif first_char in DIGITS:
+        if '.' in lexeme:
+          yield Token(TokenType.FLOAT, self.float_number(lexeme), start, end)
+        else:
+          yield Token(TokenType.INTEGER, int(lexeme), start, end)
+      elif first_char in sign_var_tokens:
+        yield Token(sign_var_tokens[first_char], lexeme, start, end)
+      elif first_char == '"' and lexeme.endswith('"'):
+        yield Token(TokenType.STRING, lexeme, start, end)
+      else:
+        yield from self.legacy_tokens_from(start)
+        return
+
+  # The legacy Lexer gives None for words like no, and the parsers stop at
+  # the first None, so the tokens stop there too. The rest of the text is
+  # still lexed, for the errors lexing all of it would raise.
+  def legacy_tokens_from(self, start):
+    tokens = Lexer(self.text[start:], self.float_number).generate_tokens()
+    for token in tokens:
+      if token == None:
+        for _ in tokens:
+          pass
+        return
+      token.start = start
+      token.end = len(self.text)
+      yield token
+
 # Nodes #
 
-@dataclass
+@dataclass(slots=True)
 class Token:
   type: TokenType
   value: any = None
+  start: int = field(default=None, compare=False)
+  end: int = field(default=None, compare=False)
 
   def __repr__(self):
     return self.type.name + ((f":{self.value}") if self.value != None else "")
 
-@dataclass
+@dataclass(slots=True)
 class IntNode:
   value: int
 
   def __repr__(self):
     return f"{self.value}"
 
-@dataclass
+@dataclass(slots=True)
 class FloatNode:
   value: float
 
   def __repr__(self):
     return f"{self.value}"
 
-@dataclass
+@dataclass(slots=True)
 class StringNode:
   value: str
 
   def __repr__(self):
     return f"{self.value}"
 
-@dataclass
+@dataclass(slots=True)
 class AddNode:
   node_a: any
   node_b: any
@@ -519,7 +754,7 @@ class AddNode:
   def __repr__(self):
     return f"({self.node_a}+{self.node_b})"
 
-@dataclass
+@dataclass(slots=True)
 class SubtractNode:
   node_a: any
   node_b: any
@@ -527,7 +762,7 @@ class SubtractNode:
   def __repr__(self):
     return f"({self.node_a}-{self.node_b})"
 
-@dataclass
+@dataclass(slots=True)
 class MultiplyNode:
   node_a: any
   node_b: any
@@ -535,7 +770,7 @@ class MultiplyNode:
   def __repr__(self):
     return f"({self.node_a}*{self.node_b})"
 
-@dataclass
+@dataclass(slots=True)
 class DivideNode:
   node_a: any
   node_b: any
@@ -543,21 +778,21 @@ class DivideNode:
   def __repr__(self):
     return f"({self.node_a}/{self.node_b})"
 
-@dataclass
+@dataclass(slots=True)
 class PlusNode:
   node: any
 
   def __repr__(self):
     return f"(+{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class MinusNode:
   node: any
 
   def __repr__(self):
     return f"(-{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class NumberSignNode:
   value: str
   StartValuePi = important_numbers['#pi']
@@ -567,21 +802,21 @@ class NumberSignNode:
   def __repr__(self):
     return f"{self.value}"
 
-@dataclass
+@dataclass(slots=True)
 class StringSignNode:
   value: str
 
   def __repr__(self):
     return f"{self.value}"
 
-@dataclass
+@dataclass(slots=True)
 class ArraySignNode:
   value: str
 
   def __repr__(self):
     return f"{self.value}"
 
-@dataclass
+@dataclass(slots=True)
 class TypeEqualNode:
   node_x: any
   node_y: any
@@ -589,7 +824,7 @@ class TypeEqualNode:
   def __repr__(self): 
     return f"({self.node_x}==={self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class MathEqualNode:
   node_x: any
   node_y: any
@@ -597,7 +832,7 @@ class MathEqualNode:
   def __repr__(self):
     return f"({self.node_x}=={self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class GreaterThanNode:
   node_x: any
   node_y: any
@@ -605,7 +840,7 @@ class GreaterThanNode:
   def __repr__(self):
     return f"({self.node_x}>{self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class LessThanNode:
   node_x: any
   node_y: any
@@ -613,7 +848,7 @@ class LessThanNode:
   def __repr__(self):
     return f"({self.node_x}<{self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class GreaterThanEqualNode:
   node_x: any
   node_y: any
@@ -621,7 +856,7 @@ class GreaterThanEqualNode:
   def __repr__(self):
     return f"({self.node_x}>={self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class LessThanEqualNode:
   node_x: any
   node_y: any
@@ -629,7 +864,7 @@ class LessThanEqualNode:
   def __repr__(self):
     return f"({self.node_x}<={self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class NotEqualNode:
   node_x: any
   node_y: any
@@ -637,7 +872,7 @@ class NotEqualNode:
   def __repr__(self):
     return f"({self.node_x}!={self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class TypeNotEqualNode:
   node_x: any
   node_y: any
@@ -645,49 +880,49 @@ class TypeNotEqualNode:
   def __repr__(self):
     return f"({self.node_x}!=={self.node_y})"
 
-@dataclass
+@dataclass(slots=True)
 class NumberTypeNode:
   node: any
 
   def __repr__(self):
     return f"(num?{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class IntegerTypeNode:
   node: any
 
   def __repr__(self):
     return f"(int?{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class FloatTypeNode:
   node: any
 
   def __repr__(self):
     return f"(float?{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class EvenCheckNode:
   node: any
 
   def __repr__(self):
     return f"(even?{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class OddCheckNode:
   node: any
 
   def __repr__(self):
     return f"(odd?{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class StringTypeNode:
   node: any
 
   def __repr__(self):
     return f"(str?{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class AndBooleanNode:
   node_x: any
   node_y: any
@@ -695,7 +930,7 @@ class AndBooleanNode:
   def __repr__(self):
     return f"{self.node_x} and {self.node_y}"
 
-@dataclass
+@dataclass(slots=True)
 class NandBooleanNode:
   node_x: any
   node_y: any
@@ -703,7 +938,7 @@ class NandBooleanNode:
   def __repr__(self):
     return f"{self.node_x} nand {self.node_y}"
 
-@dataclass
+@dataclass(slots=True)
 class OrBooleanNode:
   node_x: any
   node_y: any
@@ -711,7 +946,7 @@ class OrBooleanNode:
   def __repr__(self):
     return f"{self.node_x} or {self.node_y}"
 
-@dataclass
+@dataclass(slots=True)
 class XorBooleanNode:
   node_x: any
   node_y: any
@@ -719,7 +954,7 @@ class XorBooleanNode:
   def __repr__(self):
     return f"{self.node_x} xor {self.node_y}"
 
-@dataclass
+@dataclass(slots=True)
 class NorBooleanNode:
   node_x: any
   node_y: any
@@ -727,28 +962,28 @@ class NorBooleanNode:
   def __repr__(self):
     return f"{self.node_x} nor {self.node_y}"
 
-@dataclass
+@dataclass(slots=True)
 class NotBooleanNode:
   node: any
 
   def __repr__(self):
     return f"not {self.node}"
 
-@dataclass
+@dataclass(slots=True)
 class TrueNode:
   node: any
 
   def __repr__(self):
     return f"True"
 
-@dataclass
+@dataclass(slots=True)
 class FalseNode:
   node: any
 
   def __repr__(self):
     return f"False"
 
-@dataclass
+@dataclass(slots=True)
 class FunctionNode:
   value: str
   WordFun = important_words['fun']
@@ -758,17 +993,33 @@ class FunctionNode:
       return f"{self.value}"
     return 'fun'
 
-@dataclass
+@dataclass(slots=True)
 class ConditionalNode:
   value: str
+  condition: any = None
+  node_true: any = None
+  node_false: any = None
   WordIf = important_words['if']
 
   def __repr__(self):
+    if self.condition != None:
+      return f"(if {self.condition} {self.node_true} {self.node_false})"
     if self.value:
       return f"{self.value}"
     return 'if'
 
-@dataclass
+# A call of a function made with define_function. The function is looked up
+# once, when the call is parsed.
+@dataclass(slots=True)
+class CallNode:
+  function: any
+  arguments: tuple = ()
+
+  def __repr__(self):
+    arguments = ''.join(f' {argument}' for argument in self.arguments)
+    return f"(fun {self.function.name}{arguments})"
+
+@dataclass(slots=True)
 class SumNode:
   value: str
   WordSum = important_words['sum']
@@ -778,7 +1029,7 @@ class SumNode:
       return f"{self.value}"
     return 'sum'
 
-@dataclass
+@dataclass(slots=True)
 class AverageNode:
   node_a: any
   node_b: any
@@ -786,42 +1037,42 @@ class AverageNode:
   def __repr__(self):
     return f"(({self.node_a}+{self.node_b})/2)"
 
-@dataclass
+@dataclass(slots=True)
 class SquareNode:
   node: any
 
   def __repr__(self):
     return f"sq {self.node}"
 
-@dataclass
+@dataclass(slots=True)
 class SquareRootNode:
   node: any
 
   def __repr__(self):
     return f"sqrt {self.node}"
   
-@dataclass
+@dataclass(slots=True)
 class AbsoluteValueNode:
   node: any
 
   def __repr__(self):
     return f"abs {self.node}"
 
-@dataclass
+@dataclass(slots=True)
 class CeilNode:
   node: any
 
   def __repr__(self):
     return f"(ceil{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class FloorNode:
   node: any
 
   def __repr__(self):
     return f"(floor{self.node})"
 
-@dataclass
+@dataclass(slots=True)
 class ErrorWordsNode:
   value: str
   ErrorAnd = error_words['and']
@@ -830,6 +1081,15 @@ class ErrorWordsNode:
   def __repr__(self):
     return f"{self.value}"
 
+# Children of a node, including the arguments of a call.
+def child_nodes(node):
+  for name in node.__slots__:
+    child = getattr(node, name)
+    if is_dataclass(child):
+      yield child
+    elif type(child) == tuple:
+      yield from child
+
 # Parser #
 
 class Parser:
@@ -846,6 +1106,22 @@ class Parser:
     except StopIteration:
       self.current_token = None
 
+  # A bare 'if' is a literal word, 'if' followed by operands is a conditional
+  def starts_operand(self):
+    return self.current_token != None and self.current_token.type in operand_tokens
+
+  # A bare 'fun' is a literal word, 'fun' followed by a name calls a function
+  def calls_function(self):
+    return self.current_token != None and self.current_token.type == TokenType.NAME
+
+  def user_function(self):
+    name = self.current_token.value
+    function = user_functions.get(name)
+    if function == None:
+      raise Exception(f"Unknown function {name}")
+    self.advance()
+    return function
+
   def parse(self):
     if self.current_token == None:
       return None
@@ -871,15 +1147,15 @@ class Parser:
     return result
 
   def term(self):
-    result = self.typeEqualCheck()
+    result = self.andCheck()
 
     while self.current_token != None and self.current_token.type in (TokenType.MULTIPLY, TokenType.DIVIDE):
       if self.current_token.type == TokenType.MULTIPLY:
         self.advance()
-        result = MultiplyNode(result, self.typeEqualCheck())
+        result = MultiplyNode(result, self.andCheck())
       elif self.current_token.type == TokenType.DIVIDE:
         self.advance()
-        result = DivideNode(result, self.typeEqualCheck())
+        result = DivideNode(result, self.andCheck())
 
     return result
 
@@ -954,12 +1230,12 @@ class Parser:
     return result
 
   def mathEqualCheck(self):
-    result = self.andCheck()
+    result = self.avgCheck()
 
     while self.current_token != None and self.current_token.type in (TokenType.MATH_EQUALS, TokenType.MATH_EQUALS):
       if self.current_token.type == TokenType.MATH_EQUALS:
         self.advance()
-        result = MathEqualNode(result, self.andCheck())
+        result = MathEqualNode(result, self.avgCheck())
 
     return result
 
@@ -1004,12 +1280,12 @@ class Parser:
     return result  
 
   def norCheck(self):
-    result = self.avgCheck()
+    result = self.typeEqualCheck()
 
     while self.current_token != None and self.current_token.type in (TokenType.NOR_BOOLEAN, TokenType.NOR_BOOLEAN):
       if self.current_token.type == TokenType.NOR_BOOLEAN:
         self.advance()
-        result = NorBooleanNode(result, self.avgCheck())
+        result = NorBooleanNode(result, self.typeEqualCheck())
 
     return result
 
@@ -1088,9 +1364,14 @@ class Parser:
       return FalseNode(token.value)
     elif token.type == TokenType.FUNCTION:
       self.advance()
+      if self.calls_function():
+        function = self.user_function()
+        return CallNode(function, tuple(self.factor() for _ in function.parameters))
       return FunctionNode(token.value)
     elif token.type == TokenType.CONDITIONAL:
       self.advance()
+      if self.starts_operand():
+        return ConditionalNode(token.value, self.factor(), self.factor(), self.factor())
       return ConditionalNode(token.value)
     elif token.type == TokenType.SUM:
       self.advance()
@@ -1115,37 +1396,566 @@ class Parser:
       return ErrorWordsNode(token.value)
     self.raise_error()
 
+# Pratt Parser #
+
+# Binding powers follow the order of the Parser precedence chain, from expr
+# (loosest) down to avgCheck (tightest). Every level is left associative.
+# Boolean operators bind looser than comparisons so rules like
+# #x > 5 and #y < 3 compare first.
+binary_operators = {
+  TokenType.PLUS: (1, AddNode),
+  TokenType.MINUS: (1, SubtractNode),
+  TokenType.MULTIPLY: (2, MultiplyNode),
+  TokenType.DIVIDE: (2, DivideNode),
+  TokenType.AND_BOOLEAN: (3, AndBooleanNode),
+  TokenType.OR_BOOLEAN: (4, OrBooleanNode),
+  TokenType.XOR_BOOLEAN: (5, XorBooleanNode),
+  TokenType.NAND_BOOLEAN: (6, NandBooleanNode),
+  TokenType.NOR_BOOLEAN: (7, NorBooleanNode),
+  TokenType.TYPE_EQUAL: (8, TypeEqualNode),
+  TokenType.GT: (9, GreaterThanNode),
+  TokenType.LT: (10, LessThanNode),
+  TokenType.GTE: (11, GreaterThanEqualNode),
+  TokenType.LTE: (12, LessThanEqualNode),
+  TokenType.NE: (13, NotEqualNode),
+  TokenType.TNE: (14, TypeNotEqualNode),
+  TokenType.MATH_EQUALS: (15, MathEqualNode),
+  TokenType.AVERAGE: (16, AverageNode)
+}
+
+prefix_operators = {
+  TokenType.PLUS: PlusNode,
+  TokenType.MINUS: MinusNode,
+  TokenType.NUMBER_TYPE: NumberTypeNode,
+  TokenType.INTEGER_TYPE: IntegerTypeNode,
+  TokenType.FLOAT_TYPE: FloatTypeNode,
+  TokenType.EVEN_CHECK: EvenCheckNode,
+  TokenType.ODD_CHECK: OddCheckNode,
+  TokenType.STRING_TYPE: StringTypeNode,
+  TokenType.NOT_BOOLEAN: NotBooleanNode,
+  TokenType.SQUARE: SquareNode,
+  TokenType.SQUARE_ROOT: SquareRootNode,
+  TokenType.ABSOLUTE_VALUE: AbsoluteValueNode,
+  TokenType.CEIL: CeilNode,
+  TokenType.FLOOR: FloorNode
+}
+
+literal_nodes = {
+  TokenType.INTEGER: IntNode,
+  TokenType.FLOAT: FloatNode,
+  TokenType.STRING: StringNode,
+  TokenType.NUMBER_VAR: NumberSignNode,
+  TokenType.STRING_VAR: StringSignNode,
+  TokenType.ARRAY_VAR: ArraySignNode,
+  TokenType.TRUE: TrueNode,
+  TokenType.FALSE: FalseNode,
+  TokenType.FUNCTION: FunctionNode,
+  TokenType.CONDITIONAL: ConditionalNode,
+  TokenType.SUM: SumNode,
+  TokenType.ERROR_WORDS: ErrorWordsNode,
+  TokenType.GROUP: lambda tree: tree
+}
+
+operand_tokens = {*literal_nodes, *prefix_operators, TokenType.LPAREN}
+
+# Operands waiting for the rest of the input are kept on an explicit stack
+# instead of the Python call stack, so nesting depth is only bounded by
+# memory. Each frame is a prefix operator, an open parenthesis, the left
+# operand of a binary operator with the binding power to restore or the
+# operands collected so far by an 'if' or a function call.
+prefix_frame = 0
+paren_frame = 1
+binary_frame = 2
+operands_frame = 3
+
+class PrattParser(Parser):
+  def expr(self, min_power=1):
+    frames = []
+
+    while True:
+      token = self.current_token
+
+      if token == None:
+        self.raise_error()
+
+      node_class = literal_nodes.get(token.type)
+      if node_class == None:
+        node_class = prefix_operators.get(token.type)
+        if node_class != None:
+          frames.append((prefix_frame, node_class))
+        elif token.type == TokenType.LPAREN:
+          frames.append((paren_frame, min_power))
+          min_power = 1
+        else:
+          self.raise_error()
+        self.advance()
+        continue
+
+      self.advance()
+      if token.type == TokenType.CONDITIONAL and self.starts_operand():
+        frames.append((operands_frame, 3, lambda *operands, value=token.value: ConditionalNode(value, *operands), []))
+        continue
+      elif token.type == TokenType.FUNCTION and self.calls_function():
+        function = self.user_function()
+        if function.parameters:
+          frames.append((operands_frame, len(function.parameters), lambda *operands, function=function: CallNode(function, operands), []))
+          continue
+        result = CallNode(function)
+      else:
+        result = node_class(token.value)
+
+      while True:
+        while frames and frames[-1][0] == prefix_frame:
+          result = frames.pop()[1](result)
+
+        if frames and frames[-1][0] == operands_frame:
+          _, count, build, operands = frames[-1]
+          operands.append(result)
+          if len(operands) < count:
+            break
+          frames.pop()
+          result = build(*operands)
+          continue
+
+        operator = binary_operators.get(self.current_token.type) if self.current_token != None else None
+        if operator != None and operator[0] >= min_power:
+          frames.append((binary_frame, operator[1], result, min_power))
+          min_power = operator[0] + 1
+          self.advance()
+          break
+
+        if not frames:
+          return result
+
+        kind, *frame = frames.pop()
+        if kind == binary_frame:
+          node_class, left, min_power = frame
+          result = node_class(left, result)
+          continue
+
+        if self.current_token == None or self.current_token.type != TokenType.RPAREN:
+          self.raise_error()
+        self.advance()
+        min_power = frame[0]
+
+# Incremental Parsing #
+
+# A parenthesized group parses the same wherever it appears, so every group
+# is parsed on its own, innermost first, and stands in its parent as a single
+# GROUP token holding its tree. After an edit only the tokens around the
+# edited text are lexed again and every group whose tokens did not change
+# keeps its tree.
+def parse_group(tokens):
+  parser = PrattParser(tokens)
+  result = parser.expr()
+
+  if parser.current_token != None:
+    parser.raise_error()
+
+  return result
+
+def parse_groups(tokens, reusable):
+  groups = dict(reusable)
+  levels = [[]]
+  starts = []
+  index = 0
+  reused_groups = 0
+
+  while index < len(tokens):
+    token = tokens[index]
+
+    if token.type == TokenType.LPAREN:
+      reused = reusable.get(index)
+      if reused != None:
+        levels[-1].append(Token(TokenType.GROUP, reused[1]))
+        index = reused[0]
+        reused_groups += 1
+        continue
+      starts.append(index)
+      levels.append([])
+    elif token.type == TokenType.RPAREN and starts:
+      start = starts.pop()
+      tree = parse_group(levels.pop())
+      groups[start] = (index + 1, tree)
+      levels[-1].append(Token(TokenType.GROUP, tree))
+    else:
+      levels[-1].append(token)
+
+    index += 1
+
+  if starts:
+    raise Exception("Invalid Syntax")
+
+  return PrattParser(levels[0]).parse(), groups, reused_groups
+
+@dataclass
+class IncrementalParse:
+  text: str
+  tokens: list = None
+  groups: dict = field(default_factory=dict)
+  tree: any = None
+  error: Exception = None
+  lexed_tokens: int = 0
+  reused_groups: int = 0
+
+  def expression(self):
+    if self.error != None:
+      raise self.error
+    return compile_tree(self.tree, self.text)
+
+  def edit(self, offset, deleted, inserted):
+    text = self.text[:offset] + inserted + self.text[offset + deleted:]
+    if self.tokens == None:
+      return parse_incremental(text)
+
+    old_tokens = self.tokens
+    # The word after fun is lexed as a function name, so lexing never starts
+    # or stops right after a fun.
+    keep = bisect_left(old_tokens, offset, key=lambda token: token.end)
+    if keep and old_tokens[keep - 1].type == TokenType.FUNCTION:
+      keep -= 1
+    tokens = old_tokens[:keep]
+    delta = len(inserted) - deleted
+    edit_end = offset + deleted
+    tail = len(old_tokens)
+
+    try:
+      for token in PositionLexer(text).generate_tokens(old_tokens[keep - 1].end if keep else 0):
+        tokens.append(token)
+        if token.end - delta >= edit_end and token.end < len(text) and token.type != TokenType.FUNCTION:
+          match = bisect_left(old_tokens, token.end - delta, keep, key=lambda old_token: old_token.end)
+          if match < len(old_tokens) and old_tokens[match].end == token.end - delta and old_tokens[match].type != TokenType.FUNCTION:
+            tail = match + 1
+            break
+    except Exception as error:
+      return IncrementalParse(text, error=error)
+
+    lexed_tokens = len(tokens) - keep
+    index_delta = len(tokens) - tail
+    if delta == 0:
+      tokens.extend(old_tokens[tail:])
+    else:
+      tokens.extend(Token(token.type, token.value, token.start + delta, token.end + delta) for token in old_tokens[tail:])
+
+    reusable = {}
+    for start, (end, tree) in self.groups.items():
+      if end <= keep:
+        reusable[start] = (end, tree)
+      elif start >= tail:
+        reusable[start + index_delta] = (end + index_delta, tree)
+
+    return parse_tokens(text, tokens, reusable, lexed_tokens)
+
+# Groups are parsed innermost first, so a failed parse takes its error from
+# parsing all tokens at once, which stops at the first wrong one like a full
+# parse does.
+def parse_error(tokens, error):
+  try:
+    PrattParser(tokens).parse()
+  except Exception as first_error:
+    return first_error
+  return error
+
+def parse_tokens(text, tokens, reusable, lexed_tokens):
+  try:
+    tree, groups, reused_groups = parse_groups(tokens, reusable)
+  except Exception as error:
+    return IncrementalParse(text, tokens, reusable, error=parse_error(tokens, error), lexed_tokens=lexed_tokens)
+  return IncrementalParse(text, tokens, groups, tree, None, lexed_tokens, reused_groups)
+
+def parse_incremental(text):
+  try:
+    tokens = list(PositionLexer(text).generate_tokens())
+  except Exception as error:
+    return IncrementalParse(text, error=error)
+  return parse_tokens(text, tokens, {}, len(tokens))
+
+# Numbers #
+
+# A numbers backend decides what FLOAT tokens, the constants and every
+# non-integer result of the Interpreter are. FloatNumbers is what McFly has
+# always done; the others trade speed for exact or wider results.
+class FloatNumbers:
+  real = float
+
+  def parse(self, text):
+    return float(text)
+
+  def constant(self, name):
+    return important_numbers[name]
+
+  def convert(self, value):
+    return value
+
+  def divide(self, num_a, num_b):
+    return num_a / num_b
+
+  def square_root(self, num):
+    return num**(1/2)
+
+  def is_integral(self, num):
+    return (num % 1) == 0
+
+  def context(self):
+    return nullcontext()
+
+def decimal_constants(precision):
+  with localcontext(Context(prec=precision + 5)):
+    three = Decimal(3)
+    last_total, term, total, numerator, numerator_step, denominator, denominator_step = 0, three, three, 1, 0, 0, 24
+    while total != last_total:
+      last_total = total
+      numerator, numerator_step = numerator + numerator_step, numerator_step + 8
+      denominator, denominator_step = denominator + denominator_step, denominator_step + 32
+      term = (term * numerator) / denominator
+      total += term
+
+    rounding = Context(prec=precision)
+    return {'#pi': rounding.plus(total), '#tau': rounding.plus(total * 2), '#e': rounding.plus(Decimal(1).exp())}
+
+class DecimalNumbers(FloatNumbers):
+  real = Decimal
+
+  def __init__(self, precision=28):
+    self.precision = precision
+    self.decimal_context = Context(prec=precision)
+    self.constants = decimal_constants(precision)
+
+  def parse(self, text):
+    return self.decimal_context.create_decimal(text)
+
+  def constant(self, name):
+    return self.constants[name]
+
+  def convert(self, value):
+    if isinstance(value, float):
+      return self.decimal_context.create_decimal(repr(value))
+    return value
+
+  def divide(self, num_a, num_b):
+    return self.decimal_context.divide(num_a, num_b)
+
+  def square_root(self, num):
+    return self.decimal_context.sqrt(num)
+
+  # num % 1 raises DivisionImpossible once num has more digits than the
+  # precision.
+  def is_integral(self, num):
+    return num.is_finite() and num == num.to_integral_value()
+
+  def context(self):
+    return localcontext(self.decimal_context)
+
+# Fractions are exact for everything except the constants and square roots
+# of non squares, which are rounded to precision significant digits.
+class FractionNumbers(FloatNumbers):
+  real = Fraction
+
+  def __init__(self, precision=50):
+    self.precision = precision
+    self.decimals = DecimalNumbers(precision)
+    self.constants = {name: Fraction(value) for name, value in self.decimals.constants.items()}
+
+  def parse(self, text):
+    return Fraction(text)
+
+  def constant(self, name):
+    return self.constants[name]
+
+  def convert(self, value):
+    if isinstance(value, float):
+      return Fraction(repr(value))
+    return value
+
+  def divide(self, num_a, num_b):
+    return Fraction(num_a) / num_b
+
+  def square_root(self, num):
+    num = Fraction(num)
+    if num >= 0:
+      numerator = isqrt(num.numerator)
+      denominator = isqrt(num.denominator)
+      if numerator * numerator == num.numerator and denominator * denominator == num.denominator:
+        return Fraction(numerator, denominator)
+    return Fraction(self.decimals.square_root(self.decimals.divide(num.numerator, num.denominator)))
+
+  def is_integral(self, num):
+    return Fraction(num).denominator == 1
+
+float_numbers = FloatNumbers()
+
 # Interpreter #
 
+# Raised by every way of evaluating where a value is needed from a part of
+# the expression that has none, like an operation on the wrong types or a
+# comparison, which only gives True or False.
+class NoValueError(Exception):
+  def __init__(self, message='Part of the expression has no value to use'):
+    super().__init__(message)
+
+# Booleans come back as TrueNode/FalseNode objects, 'True'/'False' strings
+# from comparisons or variables holding True or False. Anything else is None.
+def boolean_value(result):
+  if isinstance(result, TrueNode) or result == 'True':
+    return True
+  elif isinstance(result, FalseNode) or result == 'False':
+    return False
+  elif hasattr(result, 'value') and type(result.value) == bool:
+    return result.value
+
+def boolean_result(value):
+  return 'True' if value else 'False'
+
+# Levels the Interpreter visits by recursing before it continues on a stack
+# of pending nodes, and again for each node it takes from that stack.
+interpreter_depth_limit = 50
+
+# Raised by visit during a walk for a node below the depth limit. It is not
+# an Exception, so visit_* methods that catch errors let it through.
+class PendingVisit(BaseException):
+  def __init__(self, node):
+    self.node = node
+
+# A node that raised, kept until its parent asks for it again.
+@dataclass(slots=True)
+class FailedVisit:
+  error: Exception
+
+# The child each visit_* method asks for before anything else. A walk visits
+# these first, as recursion would, instead of finding them one at a time.
+first_children = {
+  **dict.fromkeys((AddNode, SubtractNode, MultiplyNode, DivideNode, AverageNode), 'node_a'),
+  **dict.fromkeys((TypeEqualNode, MathEqualNode, GreaterThanNode, LessThanNode,
+    GreaterThanEqualNode, LessThanEqualNode, NotEqualNode, TypeNotEqualNode,
+    AndBooleanNode, NandBooleanNode, OrBooleanNode, XorBooleanNode, NorBooleanNode), 'node_x'),
+  **dict.fromkeys((PlusNode, MinusNode, NumberTypeNode, IntegerTypeNode, FloatTypeNode,
+    EvenCheckNode, OddCheckNode, StringTypeNode, NotBooleanNode, SquareNode,
+    SquareRootNode, AbsoluteValueNode, CeilNode, FloorNode), 'node'),
+  ConditionalNode: 'condition'
+}
+
+# Shallow trees are visited by plain recursion. Below the depth limit a tree
+# is walked: visit remembers the result of every node, and a node too deep
+# to recurse into is pushed on a stack and visited first, after which the
+# visit_* methods that asked for it run again and find its result. Every
+# node is still visited when, and only if, a visit_* method asks for it, so
+# results and errors are the same as with recursion.
 class Interpreter:
+  def __init__(self, variables=None, numbers=float_numbers):
+    self.variables = variables if variables != None else {}
+    self.numbers = numbers
+    self.real = numbers.real
+    if numbers.real != float:
+      self.variables = {name: numbers.convert(value) for name, value in self.variables.items()}
+    self.depth = 0
+    self.results = None
+
   def visit(self, node):
+    if self.results != None:
+      return self.walked(node)
+    depth = self.depth
+    if depth >= interpreter_depth_limit:
+      return self.walk(node)
+
+    self.depth = depth + 1
+    try:
+      return getattr(self, f'visit_{type(node).__name__}')(node)
+    finally:
+      self.depth = depth
+
+  def walked(self, node):
+    results = self.results
+    if id(node) in results:
+      result = results[id(node)]
+      if type(result) is FailedVisit:
+        raise result.error
+      return result
+    depth = self.depth
+    if depth >= interpreter_depth_limit:
+      raise PendingVisit(node)
+
+    self.depth = depth + 1
+    try:
+      result = self.dispatch(node)
+    finally:
+      self.depth = depth
+    results[id(node)] = result
+    return result
+
+  def dispatch(self, node):
     method_name = f'visit_{type(node).__name__}'
     method = getattr(self, method_name)
     return method(node)
 
+  # Every node the walk visits is part of the tree under root, so their ids
+  # stay unique until the walk is done.
+  def walk(self, root):
+    results = self.results = {}
+    depth = self.depth
+    pending = []
+    self.push_pending(pending, root)
+
+    try:
+      while pending:
+        node = pending[-1]
+        self.depth = 0
+        try:
+          result = self.dispatch(node)
+        except PendingVisit as waiting:
+          self.push_pending(pending, waiting.node)
+          continue
+        except Exception as error:
+          result = FailedVisit(error)
+        results[id(node)] = result
+        pending.pop()
+    finally:
+      self.results = None
+      self.depth = depth
+
+    result = results[id(root)]
+    if type(result) is FailedVisit:
+      raise result.error
+    return result
+
+  def push_pending(self, pending, node):
+    while node != None and id(node) not in self.results:
+      pending.append(node)
+      child = first_children.get(type(node))
+      if child == None:
+        break
+      node = getattr(node, child)
+
+  def boolean(self, node):
+    return boolean_value(self.visit(node))
+
+  # Nodes without a value, None and the 'True'/'False' strings of
+  # comparisons have no .value to read.
+  def value(self, node):
+    result = self.visit(node)
+    try:
+      return result.value
+    except AttributeError:
+      raise NoValueError() from None
+
   def visit_IntNode(self, node):
     if (isinstance(node.value, int)):
       return IntNode(node.value)
 
   def visit_FloatNode(self, node):
-    if (isinstance(node.value, float)):
+    if (isinstance(node.value, self.real)):
       return FloatNode(node.value)
 
   def visit_NumberSignNode(self, node):
-    if node.value == '#pi':
-      return NumberSignNode(node.StartValuePi)
-    elif node.value == '#tau':
-      return NumberSignNode(node.StartValueTau)
-    elif node.value == '#e':
-      return NumberSignNode(node.StartValueE)
+    if node.value in important_numbers:
+      return NumberSignNode(self.numbers.constant(node.value))
     else:
-      return NumberSignNode(node.value)
+      return NumberSignNode(self.variables.get(node.value, node.value))
 
   def visit_StringSignNode(self, node):
-    return StringSignNode(node.value)
+    return StringSignNode(self.variables.get(node.value, node.value))
 
   def visit_ArraySignNode(self, node):
-    return ArraySignNode(node.value)
+    return ArraySignNode(self.variables.get(node.value, node.value))
 
   def visit_StringNode(self, node):
     NV = node.value
@@ -1157,84 +1967,103 @@ class Interpreter:
       return FunctionNode(node.WordFun)
 
   def visit_ConditionalNode(self, node):
+    if node.condition == None:
       return ConditionalNode(node.WordIf)
 
+    condition = self.boolean(node.condition)
+    if condition is True:
+      return self.visit(node.node_true)
+    elif condition is False:
+      return self.visit(node.node_false)
+
+  # Arguments are evaluated first, from left to right, and the body runs with
+  # their values as its variables.
+  def visit_CallNode(self, node):
+    arguments = []
+    for argument in node.arguments:
+      value = result_value(self.visit(argument))
+      if value == None:
+        raise NoValueError()
+      arguments.append(value)
+
+    return node.function.interpret(arguments, self.numbers)
+
   def visit_SumNode(self, node):
       return SumNode(node.WordSum)
 
   def visit_AverageNode(self, node):
-    check_num_a = self.visit(node.node_a).value
-    check_num_b = self.visit(node.node_b).value
+    check_num_a = self.value(node.node_a)
+    check_num_b = self.value(node.node_b)
     
     if isinstance(check_num_a, int) and isinstance(check_num_b, int): 
       total = check_num_a + check_num_b
       if ((total % 2) == 0):
-       return IntNode(int(total/2))
+       return IntNode(int(self.numbers.divide(total, 2)))
       else:
-        return FloatNode(total/2)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, float):
+        return FloatNode(self.numbers.divide(total, 2))
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, self.real):
       total = check_num_a + check_num_b
-      return FloatNode(total/2)
-    elif isinstance(check_num_a, int) and isinstance(check_num_b, float):
+      return FloatNode(self.numbers.divide(total, 2))
+    elif isinstance(check_num_a, int) and isinstance(check_num_b, self.real):
       total = check_num_a + check_num_b
-      return FloatNode(total/2)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, int):
+      return FloatNode(self.numbers.divide(total, 2))
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, int):
       total = check_num_a + check_num_b
-      return FloatNode(total/2)
+      return FloatNode(self.numbers.divide(total, 2))
 
   def visit_SquareNode(self, node):
-    check_num = self.visit(node.node).value
+    check_num = self.value(node.node)
 
     if isinstance(check_num, int):
       return IntNode(check_num * check_num)
-    elif isinstance(check_num, float):
+    elif isinstance(check_num, self.real):
       return FloatNode(check_num * check_num) 
 
   def visit_SquareRootNode(self, node):
-    check_num = self.visit(node.node).value
+    check_num = self.value(node.node)
 
     if isinstance(check_num, int):
-      answer = (check_num**(1/2))
-      if ((answer % 1) == 0):
+      answer = self.numbers.square_root(check_num)
+      if self.numbers.is_integral(answer):
         return IntNode(int(answer))
       else:
         return FloatNode(answer)
-    elif isinstance(check_num, float):
-      answer = (check_num**(1/2))
+    elif isinstance(check_num, self.real):
+      answer = self.numbers.square_root(check_num)
       return FloatNode(answer)   
 
   def visit_AbsoluteValueNode(self, node):
-    check_num = self.visit(node.node).value
+    check_num = self.value(node.node)
 
     if isinstance(check_num, int):
       if (check_num < 0):
         return IntNode(check_num*-1)
       else:
         return IntNode(check_num)
-    elif isinstance(check_num, float):
+    elif isinstance(check_num, self.real):
       if (check_num < 0):
         return FloatNode(check_num*-1)
       else:
         return FloatNode(check_num)
 
   def visit_CeilNode(self, node):
-    check_num = self.visit(node.node).value
+    check_num = self.value(node.node)
 
     if isinstance(check_num, int):
       return IntNode(check_num)
-    elif isinstance(check_num, float):
-      if (((check_num % 1) == 0) or (check_num < 0)):
+    elif isinstance(check_num, self.real):
+      if (self.numbers.is_integral(check_num) or (check_num < 0)):
         return IntNode(int(check_num))
       elif (check_num > 0):
         return IntNode(int(check_num)+1)
 
   def visit_FloorNode(self, node):
-    check_num = self.visit(node.node).value
+    check_num = self.value(node.node)
 
     if isinstance(check_num, int):
      return IntNode(check_num)
-    elif isinstance(check_num, float):
-      if (((check_num % 1) == 0) or (check_num > 0)):
+    elif isinstance(check_num, self.real):
+      if (self.numbers.is_integral(check_num) or (check_num > 0)):
         return IntNode(int(check_num))
       elif (check_num < 0):
         return IntNode((int(check_num)-1))
@@ -1249,181 +2078,181 @@ class Interpreter:
       return 'Error: Not a Keyword'
 
   def visit_TypeEqualNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) and isinstance(check_y, int)) or (isinstance(check_x, float) and isinstance(check_y, float)):
+    if (isinstance(check_x, int) and isinstance(check_y, int)) or (isinstance(check_x, self.real) and isinstance(check_y, self.real)):
       if check_x == check_y:
         return 'True'
       else:
         return 'False'
-    elif (isinstance(check_x, int) and isinstance(check_y, float)) or (isinstance(check_x, float) and isinstance(check_y, int)):
+    elif (isinstance(check_x, int) and isinstance(check_y, self.real)) or (isinstance(check_x, self.real) and isinstance(check_y, int)):
       return 'False'
 
   def visit_MathEqualNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) or isinstance(check_x, float)) and (isinstance(check_y, int) or isinstance(check_y, float)):
+    if (isinstance(check_x, int) or isinstance(check_x, self.real)) and (isinstance(check_y, int) or isinstance(check_y, self.real)):
       if check_x == check_y:
         return 'True'
       elif check_x != check_y:
         return 'False'
 
   def visit_GreaterThanNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) or isinstance(check_x, float)) and (isinstance(check_y, int) or isinstance(check_y, float)):
+    if (isinstance(check_x, int) or isinstance(check_x, self.real)) and (isinstance(check_y, int) or isinstance(check_y, self.real)):
       if (check_x > check_y):
         return 'True'
       elif (check_x < check_y) or (check_x == check_y):
         return 'False'
 
   def visit_LessThanNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) or isinstance(check_x, float)) and (isinstance(check_y, int) or isinstance(check_y, float)):
+    if (isinstance(check_x, int) or isinstance(check_x, self.real)) and (isinstance(check_y, int) or isinstance(check_y, self.real)):
       if (check_x > check_y) or (check_x == check_y):
         return 'False'
       elif (check_x < check_y):
         return 'True'
 
   def visit_GreaterThanEqualNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) or isinstance(check_x, float)) and (isinstance(check_y, int) or isinstance(check_y, float)):
+    if (isinstance(check_x, int) or isinstance(check_x, self.real)) and (isinstance(check_y, int) or isinstance(check_y, self.real)):
       if (check_x > check_y) or (check_x == check_y):
         return 'True'
       elif (check_x < check_y):
         return 'False'
 
   def visit_LessThanEqualNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) or isinstance(check_x, float)) and (isinstance(check_y, int) or isinstance(check_y, float)):
+    if (isinstance(check_x, int) or isinstance(check_x, self.real)) and (isinstance(check_y, int) or isinstance(check_y, self.real)):
       if (check_x > check_y):
         return 'False'
       elif (check_x < check_y) or (check_x == check_y):
         return 'True'
 
   def visit_NotEqualNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) or isinstance(check_x, float)) and (isinstance(check_y, int) or isinstance(check_y, float)):
+    if (isinstance(check_x, int) or isinstance(check_x, self.real)) and (isinstance(check_y, int) or isinstance(check_y, self.real)):
       if check_x != check_y:
         return 'True'
       elif check_x == check_y:
         return 'False'
 
   def visit_TypeNotEqualNode(self, node):
-    check_x = self.visit(node.node_x).value
-    check_y = self.visit(node.node_y).value
+    check_x = self.value(node.node_x)
+    check_y = self.value(node.node_y)
 
-    if (isinstance(check_x, int) and isinstance(check_y, int)) or (isinstance(check_x, float) and isinstance(check_y, float)):
+    if (isinstance(check_x, int) and isinstance(check_y, int)) or (isinstance(check_x, self.real) and isinstance(check_y, self.real)):
       if check_x == check_y:
         return 'False'
       else:
         return 'True'
-    elif (isinstance(check_x, int) and isinstance(check_y, float)) or (isinstance(check_x, float) and isinstance(check_y, int)):
+    elif (isinstance(check_x, int) and isinstance(check_y, self.real)) or (isinstance(check_x, self.real) and isinstance(check_y, int)):
         return 'True'
 
   def visit_AddNode(self, node):
-    check_num_a = self.visit(node.node_a).value
-    check_num_b = self.visit(node.node_b).value
+    check_num_a = self.value(node.node_a)
+    check_num_b = self.value(node.node_b)
 
     if isinstance(check_num_a, int) and isinstance(check_num_b, int):
       return IntNode(check_num_a + check_num_b)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, float):
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, self.real):
       return FloatNode(check_num_a + check_num_b)
-    elif isinstance(check_num_a, int) and isinstance(check_num_b, float):
+    elif isinstance(check_num_a, int) and isinstance(check_num_b, self.real):
       return FloatNode(check_num_a + check_num_b)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, int):
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, int):
       return FloatNode(check_num_a + check_num_b)
 
   def visit_SubtractNode(self, node):
-    check_num_a = self.visit(node.node_a).value
-    check_num_b = self.visit(node.node_b).value
+    check_num_a = self.value(node.node_a)
+    check_num_b = self.value(node.node_b)
 
     if isinstance(check_num_a, int) and isinstance(check_num_b, int):
       return IntNode(check_num_a - check_num_b)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, float):
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, self.real):
       return FloatNode(check_num_a - check_num_b)
-    elif isinstance(check_num_a, int) and isinstance(check_num_b, float):
+    elif isinstance(check_num_a, int) and isinstance(check_num_b, self.real):
       return FloatNode(check_num_a - check_num_b)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, int):
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, int):
       return FloatNode(check_num_a - check_num_b)
 
   def visit_MultiplyNode(self, node):
-    check_num_a = self.visit(node.node_a).value
-    check_num_b = self.visit(node.node_b).value
+    check_num_a = self.value(node.node_a)
+    check_num_b = self.value(node.node_b)
 
     if isinstance(check_num_a, int) and isinstance(check_num_b, int):
       return IntNode(check_num_a * check_num_b)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, float):
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, self.real):
       return FloatNode(check_num_a * check_num_b)
-    elif isinstance(check_num_a, int) and isinstance(check_num_b, float):
+    elif isinstance(check_num_a, int) and isinstance(check_num_b, self.real):
       return FloatNode(check_num_a * check_num_b)
-    elif isinstance(check_num_a, float) and isinstance(check_num_b, int):
+    elif isinstance(check_num_a, self.real) and isinstance(check_num_b, int):
       return FloatNode(check_num_a * check_num_b)
 
   def visit_DivideNode(self, node):
     try:
-      check_num_a = self.visit(node.node_a).value
-      check_num_b = self.visit(node.node_b).value
+      check_num_a = self.value(node.node_a)
+      check_num_b = self.value(node.node_b)
 
       if isinstance(check_num_a, int) and isinstance(check_num_b, int):
-        quotient = check_num_a / check_num_b
-        if ((quotient % 1) == 0):
+        quotient = self.numbers.divide(check_num_a, check_num_b)
+        if self.numbers.is_integral(quotient):
           return IntNode(int(quotient))
         else:
           return FloatNode(quotient)
-      elif isinstance(check_num_a, float) and isinstance(check_num_b, float):
-        quotient = check_num_a / check_num_b
-        if ((quotient % 1) == 0):
+      elif isinstance(check_num_a, self.real) and isinstance(check_num_b, self.real):
+        quotient = self.numbers.divide(check_num_a, check_num_b)
+        if self.numbers.is_integral(quotient):
           return IntNode(int(quotient))
         else:
           return FloatNode(quotient)
-      elif isinstance(check_num_a, int) and isinstance(check_num_b, float):
-        quotient = check_num_a / check_num_b
-        if ((quotient % 1) == 0):
+      elif isinstance(check_num_a, int) and isinstance(check_num_b, self.real):
+        quotient = self.numbers.divide(check_num_a, check_num_b)
+        if self.numbers.is_integral(quotient):
           return IntNode(int(quotient))
         else:
           return FloatNode(quotient)
-      elif isinstance(check_num_a, float) and isinstance(check_num_b, int):
-        quotient = check_num_a / check_num_b
-        if ((quotient % 1) == 0):
+      elif isinstance(check_num_a, self.real) and isinstance(check_num_b, int):
+        quotient = self.numbers.divide(check_num_a, check_num_b)
+        if self.numbers.is_integral(quotient):
           return IntNode(int(quotient))
         else:
           return FloatNode(quotient)
-    except:
+    except Exception:
       raise Exception("Runtime math error")
   
   def visit_PlusNode(self, node):
     return self.visit(node.node)
   
   def visit_MinusNode(self, node):
-    check_num = self.visit(node.node).value
+    check_num = self.value(node.node)
 
     if isinstance(check_num, int):
       return IntNode(-check_num)
-    elif isinstance(check_num, float):
+    elif isinstance(check_num, self.real):
       return FloatNode(-check_num)
   
   def visit_NumberTypeNode(self, node):
-    check_text = self.visit(node.node).value
+    check_text = self.value(node.node)
     
-    if isinstance(check_text, int) or isinstance(check_text, float):
+    if isinstance(check_text, int) or isinstance(check_text, self.real):
       return TrueNode(node.node)
     elif isinstance(check_text, str):
       return FalseNode(node.node)
 
   def visit_IntegerTypeNode(self, node):
-    check_text = self.visit(node.node).value
+    check_text = self.value(node.node)
     
     if isinstance(check_text, int):
       return TrueNode(node.node)
@@ -1431,15 +2260,15 @@ class Interpreter:
       return FalseNode(node.node)
 
   def visit_FloatTypeNode(self, node):
-    check_text = self.visit(node.node).value
+    check_text = self.value(node.node)
     
-    if isinstance(check_text, float):
+    if isinstance(check_text, self.real):
       return TrueNode(node.node)
     else:
       return FalseNode(node.node)
 
   def visit_EvenCheckNode(self, node):
-    check_text = self.visit(node.node).value
+    check_text = self.value(node.node)
     
     if ((check_text % 2) == 0):
       return TrueNode(node.node)
@@ -1447,7 +2276,7 @@ class Interpreter:
       return FalseNode(node.node)
   
   def visit_OddCheckNode(self, node):
-    check_text = self.visit(node.node).value
+    check_text = self.value(node.node)
     
     if ((check_text % 2) == 0):
       return FalseNode(node.node)
@@ -1455,47 +2284,47 @@ class Interpreter:
       return TrueNode(node.node)
 
   def visit_StringTypeNode(self, node):
-    check_text = self.visit(node.node).value
+    check_text = self.value(node.node)
     
     if isinstance(check_text, str):
       return TrueNode(node.node)
-    elif isinstance(check_text, int) or isinstance(check_text, float):
+    elif isinstance(check_text, int) or isinstance(check_text, self.real):
       return FalseNode(node.node)
 
+  # Operands are evaluated left to right and the right one only when the left
+  # one does not decide the result already.
+  def visit_short_circuit(self, node, short_value, short_result, negate):
+    check_x = self.boolean(node.node_x)
+    if check_x is short_value:
+      return boolean_result(short_result)
+    elif check_x is not None:
+      check_y = self.boolean(node.node_y)
+      if check_y is not None:
+        return boolean_result(check_y != negate)
+
   def visit_AndBooleanNode(self, node):
-    if (isinstance(node.node_x, TrueNode)) and (isinstance(node.node_y, TrueNode)):
-      return 'True'
-    elif ((isinstance(node.node_x, TrueNode)) or (isinstance(node.node_x, FalseNode))) and ((isinstance(node.node_y, TrueNode)) or (isinstance(node.node_y, FalseNode))):
-      return 'False'
+    return self.visit_short_circuit(node, False, False, False)
 
   def visit_NandBooleanNode(self, node):
-    if (isinstance(node.node_x, TrueNode)) and (isinstance(node.node_y, TrueNode)):
-      return 'False'
-    elif ((isinstance(node.node_x, TrueNode)) or (isinstance(node.node_x, FalseNode))) and ((isinstance(node.node_y, TrueNode)) or (isinstance(node.node_y, FalseNode))):
-      return 'True'
+    return self.visit_short_circuit(node, False, True, True)
 
   def visit_OrBooleanNode(self, node):
-    if (isinstance(node.node_x, FalseNode)) and (isinstance(node.node_y, FalseNode)):
-      return 'False'
-    elif ((isinstance(node.node_x, TrueNode)) or (isinstance(node.node_x, FalseNode))) and ((isinstance(node.node_y, TrueNode)) or (isinstance(node.node_y, FalseNode))):
-      return 'True'
+    return self.visit_short_circuit(node, True, True, False)
 
   def visit_XorBooleanNode(self, node):
-    if ((isinstance(node.node_x, TrueNode)) and (isinstance(node.node_y, TrueNode))) or ((isinstance(node.node_x, FalseNode)) and (isinstance(node.node_y, FalseNode))):
-      return 'False'
-    elif ((isinstance(node.node_x, TrueNode)) and (isinstance(node.node_y, FalseNode))) or ((isinstance(node.node_x, FalseNode)) and (isinstance(node.node_y, TrueNode))):
-      return 'True'
+    check_x = self.boolean(node.node_x)
+    check_y = self.boolean(node.node_y)
+    if check_x is not None and check_y is not None:
+      return boolean_result(check_x != check_y)
 
   def visit_NorBooleanNode(self, node):
-    if (isinstance(node.node_x, FalseNode)) and (isinstance(node.node_y, FalseNode)):
-      return 'True'
-    elif ((isinstance(node.node_x, TrueNode)) or (isinstance(node.node_x, FalseNode))) and ((isinstance(node.node_y, TrueNode)) or (isinstance(node.node_y, FalseNode))):
-      return 'False'
+    return self.visit_short_circuit(node, True, False, True)
 
   def visit_NotBooleanNode(self, node):
-    if isinstance(node.node, TrueNode):
+    check = self.boolean(node.node)
+    if check is True:
       return FalseNode(node.node)
-    elif isinstance(node.node, FalseNode):
+    elif check is False:
       return TrueNode(node.node)
 
   def visit_TrueNode(self, node):
@@ -1504,16 +2333,2954 @@ class Interpreter:
   def visit_FalseNode(self, node):
     return FalseNode(node.node)
 
+# Type Inference #
+
+# Types are 'int', 'float', 'number' (int or float, known only at run time),
+# 'str' and 'bool', or None where nothing is known, like for variables
+# without a declared type or square roots, which are complex for negative
+# numbers. A node whose visit_* method is sure to return None at run time
+# gets a type error and no type.
+numeric_types = ('int', 'float', 'number')
+
+arithmetic_nodes = (AddNode, SubtractNode, MultiplyNode)
+
+comparison_nodes = (
+  MathEqualNode, NotEqualNode, GreaterThanNode, LessThanNode,
+  GreaterThanEqualNode, LessThanEqualNode, TypeEqualNode, TypeNotEqualNode
+)
+
+# These give nothing when an operand is NaN, so only int operands make
+# them sure to be True or False.
+ordering_nodes = (GreaterThanNode, LessThanNode, GreaterThanEqualNode, LessThanEqualNode)
+
+same_type_nodes = (PlusNode, MinusNode, SquareNode, AbsoluteValueNode)
+
+literal_types = {
+  IntNode: 'int',
+  FloatNode: 'float',
+  StringNode: 'str',
+  TrueNode: 'bool',
+  FalseNode: 'bool',
+  FunctionNode: 'str',
+  ConditionalNode: 'str',
+  SumNode: 'str',
+  ErrorWordsNode: 'str'
+}
+
+def combined_number_type(type_a, type_b):
+  if type_a == 'int' and type_b == 'int':
+    return 'int'
+  elif type_a == 'float' or type_b == 'float':
+    return 'float'
+  return 'number'
+
+# Reprs recurse through the whole tree, so nodes nested deeper than the
+# stack allows are named by their class.
+def node_text(node):
+  try:
+    return repr(node)
+  except RecursionError:
+    return f'{type(node).__name__} nested too deep to show'
+
+class TypeInference:
+  def __init__(self, variable_types=None):
+    self.variable_types = {name: declared.__name__ for name, declared in (variable_types or {}).items()}
+    self.types = {}
+    self.errors = []
+
+  def infer(self, tree):
+    if tree == None:
+      return None
+
+    pending = [(tree, False)]
+    while pending:
+      node, children_done = pending.pop()
+      if children_done:
+        self.types[id(node)] = self.node_type(node)
+        continue
+
+      pending.append((node, True))
+      for child in child_nodes(node):
+        pending.append((child, False))
+
+    return self.types[id(tree)]
+
+  def error(self, node, message):
+    self.errors.append(f'Type error in {node_text(node)}: {message}')
+
+  def value_type(self, node, parent):
+    inner = node
+    while isinstance(inner, PlusNode):
+      inner = inner.node
+
+    if isinstance(inner, no_value_nodes):
+      self.error(parent, f'{node_text(inner)} has no value to use')
+      return 'missing'
+    return self.types[id(node)]
+
+  def operand_types(self, node, *operands):
+    types = [self.value_type(operand, node) for operand in operands]
+    if 'missing' in types:
+      return None
+
+    wrong = [operand_type for operand_type in types if operand_type != None and operand_type not in numeric_types]
+    if wrong:
+      self.error(node, f"{' and '.join(operand_type or 'unknown' for operand_type in types)} operands")
+      return None
+
+    if None in types:
+      return None
+    return types
+
+  # Operands of boolean operators and conditions are evaluated, not read as
+  # values, so they only need to produce True or False.
+  def boolean_types(self, node, *operands):
+    types = [self.types[id(operand)] for operand in operands]
+    if any(operand_type != None and operand_type != 'bool' for operand_type in types):
+      self.error(node, 'operands must be True or False')
+      return None
+    elif None in types:
+      return None
+    return 'bool'
+
+  def branch_type(self, node):
+    if self.types[id(node.condition)] != 'bool':
+      return None
+
+    type_true = self.types[id(node.node_true)]
+    type_false = self.types[id(node.node_false)]
+    if type_true == type_false:
+      return type_true
+    elif type_true in numeric_types and type_false in numeric_types:
+      return 'number'
+    return None
+
+  def node_type(self, node):
+    node_class = type(node)
+
+    if isinstance(node, ConditionalNode) and node.condition != None:
+      self.boolean_types(node, node.condition)
+      return self.branch_type(node)
+    elif isinstance(node, CallNode):
+      return node.function.result_type
+    elif node_class in literal_types:
+      return literal_types[node_class]
+    elif isinstance(node, (NumberSignNode, StringSignNode, ArraySignNode)):
+      if node.value in important_numbers:
+        return 'float'
+      return self.variable_types.get(node.value)
+    elif isinstance(node, boolean_operator_nodes):
+      operands = [node.node] if isinstance(node, NotBooleanNode) else [node.node_x, node.node_y]
+      return self.boolean_types(node, *operands)
+    elif isinstance(node, PlusNode):
+      return self.types[id(node.node)]
+    elif isinstance(node, (IntegerTypeNode, FloatTypeNode)):
+      self.value_type(node.node, node)
+      return 'bool'
+    elif isinstance(node, (NumberTypeNode, StringTypeNode)):
+      operand_type = self.value_type(node.node, node)
+      return 'bool' if operand_type in numeric_types or operand_type == 'str' else None
+
+    operands = [getattr(node, name) for name in node.__slots__]
+    types = self.operand_types(node, *operands)
+    if types == None:
+      return None
+
+    if isinstance(node, arithmetic_nodes):
+      return combined_number_type(*types)
+    elif isinstance(node, DivideNode):
+      return 'number'
+    elif isinstance(node, AverageNode):
+      return 'float' if 'float' in types else 'number'
+    elif isinstance(node, same_type_nodes):
+      return types[0]
+    elif isinstance(node, SquareRootNode):
+      return None
+    elif isinstance(node, (CeilNode, FloorNode)):
+      return 'int'
+    elif isinstance(node, ordering_nodes) and types != ['int', 'int']:
+      return None
+    return 'bool'
+
+# Compiler #
+
+# Interpreter results of these nodes are TrueNode/FalseNode objects or plain
+# strings, so reading .value from them fails like it does in the Interpreter.
+no_value_nodes = (
+  TypeEqualNode, MathEqualNode, GreaterThanNode, LessThanNode,
+  GreaterThanEqualNode, LessThanEqualNode, NotEqualNode, TypeNotEqualNode,
+  NumberTypeNode, IntegerTypeNode, FloatTypeNode, EvenCheckNode, OddCheckNode,
+  StringTypeNode, AndBooleanNode, NandBooleanNode, OrBooleanNode,
+  XorBooleanNode, NorBooleanNode, NotBooleanNode, TrueNode, FalseNode,
+  ErrorWordsNode
+)
+
+def constant(value):
+  return lambda values: value
+
+def no_result():
+  return None
+
+def missing_result():
+  raise NoValueError()
+
+# Turns a tree into nested closures over raw int/float/str/bool values. Every
+# closure takes the list of variable values, in the order of self.slots. The
+# missing callback decides what a closure does where the matching visit_*
+# method returns None: the root returns None, operands raise NoValueError
+# like the Interpreter does when it reads the value of nothing.
+class Compiler:
+  def __init__(self, types=None):
+    self.slots = {}
+    self.types = types if types != None else {}
+
+  # Operands that TypeInference proved to be numbers need no isinstance checks.
+  def known_numbers(self, *nodes):
+    return all(self.types.get(id(node)) in numeric_types for node in nodes)
+
+  def compile(self, node, missing=no_result):
+    if node == None:
+      return constant(None)
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name)
+    return method(node, missing)
+
+  def compile_value(self, node):
+    inner = node
+    while isinstance(inner, PlusNode):
+      inner = inner.node
+
+    compiled = self.compile(node, missing_result)
+
+    if isinstance(inner, no_value_nodes):
+      def no_value(values):
+        compiled(values)
+        raise NoValueError()
+      return no_value
+
+    return compiled
+
+  def compile_IntNode(self, node, missing):
+    return constant(node.value)
+
+  def compile_FloatNode(self, node, missing):
+    return constant(node.value)
+
+  def compile_variable(self, node):
+    index = self.slots.setdefault(node.value, len(self.slots))
+    return lambda values: values[index]
+
+  def compile_NumberSignNode(self, node, missing):
+    if node.value in important_numbers:
+      return constant(important_numbers[node.value])
+    return self.compile_variable(node)
+
+  def compile_StringSignNode(self, node, missing):
+    return self.compile_variable(node)
+
+  def compile_ArraySignNode(self, node, missing):
+    return self.compile_variable(node)
+
+  def compile_StringNode(self, node, missing):
+    return constant(node.value[1:-1])
+
+  def compile_FunctionNode(self, node, missing):
+    return constant(node.WordFun)
+
+  def compile_ConditionalNode(self, node, missing):
+    if node.condition == None:
+      return constant(node.WordIf)
+
+    condition = self.compile(node.condition)
+    if missing is missing_result:
+      node_true = self.compile_value(node.node_true)
+      node_false = self.compile_value(node.node_false)
+    else:
+      node_true = self.compile(node.node_true, missing)
+      node_false = self.compile(node.node_false, missing)
+
+    def conditional(values):
+      check = condition(values)
+
+      if check is True:
+        return node_true(values)
+      elif check is False:
+        return node_false(values)
+      return missing()
+
+    return conditional
+
+  # The body was compiled once by define_function, read as a value or not.
+  def compile_CallNode(self, node, missing):
+    body = node.function.functions[1 if missing is missing_result else 0]
+    arguments = [self.compile_argument(argument) for argument in node.arguments]
+
+    def call(values):
+      return body([argument(values) for argument in arguments])
+
+    return call
+
+  def compile_argument(self, node):
+    compiled = self.compile(node)
+
+    def argument(values):
+      value = compiled(values)
+      if value == None:
+        missing_result()
+      return value
+
+    return argument
+
+  def compile_SumNode(self, node, missing):
+    return constant(node.WordSum)
+
+  def compile_ErrorWordsNode(self, node, missing):
+    if node.value == 'and':
+      return constant(node.ErrorAnd)
+    elif node.value == 'or':
+      return constant(node.ErrorOr)
+    return constant('Error: Not a Keyword')
+
+  def compile_TrueNode(self, node, missing):
+    return constant(True)
+
+  def compile_FalseNode(self, node, missing):
+    return constant(False)
+
+  def compile_AverageNode(self, node, missing):
+    a = self.compile_value(node.node_a)
+    b = self.compile_value(node.node_b)
+
+    def average(values):
+      num_a = a(values)
+      num_b = b(values)
+
+      if isinstance(num_a, int) and isinstance(num_b, int):
+        total = num_a + num_b
+        if ((total % 2) == 0):
+          return int(total/2)
+        return total/2
+      elif isinstance(num_a, (int, float)) and isinstance(num_b, (int, float)):
+        return (num_a + num_b)/2
+      return missing()
+
+    return average
+
+  def compile_SquareNode(self, node, missing):
+    a = self.compile_value(node.node)
+
+    if self.known_numbers(node.node):
+      def known_square(values):
+        num = a(values)
+        return num * num
+
+      return known_square
+
+    def square(values):
+      num = a(values)
+
+      if isinstance(num, (int, float)):
+        return num * num
+      return missing()
+
+    return square
+
+  def compile_SquareRootNode(self, node, missing):
+    a = self.compile_value(node.node)
+
+    def square_root(values):
+      num = a(values)
+
+      if isinstance(num, int):
+        answer = (num**(1/2))
+        if ((answer % 1) == 0):
+          return int(answer)
+        return answer
+      elif isinstance(num, float):
+        return (num**(1/2))
+      return missing()
+
+    return square_root
+
+  def compile_AbsoluteValueNode(self, node, missing):
+    a = self.compile_value(node.node)
+
+    if self.known_numbers(node.node):
+      def known_absolute_value(values):
+        num = a(values)
+        return num*-1 if num < 0 else num
+
+      return known_absolute_value
+
+    def absolute_value(values):
+      num = a(values)
+
+      if isinstance(num, (int, float)):
+        if (num < 0):
+          return num*-1
+        return num
+      return missing()
+
+    return absolute_value
+
+  def compile_CeilNode(self, node, missing):
+    a = self.compile_value(node.node)
+
+    if self.types.get(id(node.node)) == 'int':
+      return a
+
+    def ceil(values):
+      num = a(values)
+
+      if isinstance(num, int):
+        return num
+      elif isinstance(num, float):
+        if (((num % 1) == 0) or (num < 0)):
+          return int(num)
+        elif (num > 0):
+          return int(num)+1
+        return missing()
+      return missing()
+
+    return ceil
+
+  def compile_FloorNode(self, node, missing):
+    a = self.compile_value(node.node)
+
+    if self.types.get(id(node.node)) == 'int':
+      return a
+
+    def floor(values):
+      num = a(values)
+
+      if isinstance(num, int):
+        return num
+      elif isinstance(num, float):
+        if (((num % 1) == 0) or (num > 0)):
+          return int(num)
+        elif (num < 0):
+          return int(num)-1
+        return missing()
+      return missing()
+
+    return floor
+
+  # NaN is neither greater, less nor equal to anything, so ordering
+  # comparisons give nothing for it, like the Interpreter does.
+  def compile_comparison(self, node, missing, compare, ordering=False):
+    x = self.compile_value(node.node_x)
+    y = self.compile_value(node.node_y)
+
+    if self.known_numbers(node.node_x, node.node_y):
+      if not ordering or (self.types.get(id(node.node_x)) == 'int' and self.types.get(id(node.node_y)) == 'int'):
+        return lambda values: compare(x(values), y(values))
+
+      def ordered_comparison(values):
+        check_x = x(values)
+        check_y = y(values)
+
+        if compare(check_x, check_y):
+          return True
+        elif check_x != check_x or check_y != check_y:
+          return missing()
+        return False
+
+      return ordered_comparison
+
+    def comparison(values):
+      check_x = x(values)
+      check_y = y(values)
+
+      if isinstance(check_x, (int, float)) and isinstance(check_y, (int, float)):
+        if compare(check_x, check_y):
+          return True
+        elif ordering and (check_x != check_x or check_y != check_y):
+          return missing()
+        return False
+      return missing()
+
+    return comparison
+
+  def compile_type_comparison(self, node, missing, same_type_result, mixed_type_result):
+    x = self.compile_value(node.node_x)
+    y = self.compile_value(node.node_y)
+
+    type_x = self.types.get(id(node.node_x))
+    if type_x in ('int', 'float') and type_x == self.types.get(id(node.node_y)):
+      return lambda values: (x(values) == y(values)) == same_type_result
+
+    def type_comparison(values):
+      check_x = x(values)
+      check_y = y(values)
+
+      if (isinstance(check_x, int) and isinstance(check_y, int)) or (isinstance(check_x, float) and isinstance(check_y, float)):
+        return (check_x == check_y) == same_type_result
+      elif isinstance(check_x, (int, float)) and isinstance(check_y, (int, float)):
+        return mixed_type_result
+      return missing()
+
+    return type_comparison
+
+  def compile_TypeEqualNode(self, node, missing):
+    return self.compile_type_comparison(node, missing, True, False)
+
+  def compile_TypeNotEqualNode(self, node, missing):
+    return self.compile_type_comparison(node, missing, False, True)
+
+  def compile_MathEqualNode(self, node, missing):
+    return self.compile_comparison(node, missing, operator.eq)
+
+  def compile_NotEqualNode(self, node, missing):
+    return self.compile_comparison(node, missing, operator.ne)
+
+  def compile_GreaterThanNode(self, node, missing):
+    return self.compile_comparison(node, missing, operator.gt, True)
+
+  def compile_LessThanNode(self, node, missing):
+    return self.compile_comparison(node, missing, operator.lt, True)
+
+  def compile_GreaterThanEqualNode(self, node, missing):
+    return self.compile_comparison(node, missing, operator.ge, True)
+
+  def compile_LessThanEqualNode(self, node, missing):
+    return self.compile_comparison(node, missing, operator.le, True)
+
+  def compile_arithmetic(self, node, missing, calculate):
+    a = self.compile_value(node.node_a)
+    b = self.compile_value(node.node_b)
+
+    if self.known_numbers(node.node_a, node.node_b):
+      return lambda values: calculate(a(values), b(values))
+
+    def arithmetic(values):
+      num_a = a(values)
+      num_b = b(values)
+
+      if isinstance(num_a, (int, float)) and isinstance(num_b, (int, float)):
+        return calculate(num_a, num_b)
+      return missing()
+
+    return arithmetic
+
+  def compile_AddNode(self, node, missing):
+    return self.compile_arithmetic(node, missing, operator.add)
+
+  def compile_SubtractNode(self, node, missing):
+    return self.compile_arithmetic(node, missing, operator.sub)
+
+  def compile_MultiplyNode(self, node, missing):
+    return self.compile_arithmetic(node, missing, operator.mul)
+
+  def compile_DivideNode(self, node, missing):
+    a = self.compile_value(node.node_a)
+    b = self.compile_value(node.node_b)
+
+    def divide(values):
+      try:
+        num_a = a(values)
+        num_b = b(values)
+
+        if isinstance(num_a, (int, float)) and isinstance(num_b, (int, float)):
+          quotient = num_a / num_b
+          if ((quotient % 1) == 0):
+            return int(quotient)
+          return quotient
+      except:
+        raise Exception("Runtime math error")
+      return missing()
+
+    return divide
+
+  def compile_PlusNode(self, node, missing):
+    return self.compile(node.node, missing)
+
+  def compile_MinusNode(self, node, missing):
+    a = self.compile_value(node.node)
+
+    if self.known_numbers(node.node):
+      return lambda values: -a(values)
+
+    def minus(values):
+      num = a(values)
+
+      if isinstance(num, (int, float)):
+        return -num
+      return missing()
+
+    return minus
+
+  def compile_type_check(self, node, check):
+    a = self.compile_value(node.node)
+    return lambda values: check(a(values))
+
+  def compile_NumberTypeNode(self, node, missing):
+    def number_type(value):
+      if isinstance(value, (int, float)):
+        return True
+      elif isinstance(value, str):
+        return False
+      return missing()
+
+    return self.compile_type_check(node, number_type)
+
+  def compile_IntegerTypeNode(self, node, missing):
+    return self.compile_type_check(node, lambda value: isinstance(value, int))
+
+  def compile_FloatTypeNode(self, node, missing):
+    return self.compile_type_check(node, lambda value: isinstance(value, float))
+
+  def compile_EvenCheckNode(self, node, missing):
+    return self.compile_type_check(node, lambda value: ((value % 2) == 0))
+
+  def compile_OddCheckNode(self, node, missing):
+    return self.compile_type_check(node, lambda value: ((value % 2) != 0))
+
+  def compile_StringTypeNode(self, node, missing):
+    def string_type(value):
+      if isinstance(value, str):
+        return True
+      elif isinstance(value, (int, float)):
+        return False
+      return missing()
+
+    return self.compile_type_check(node, string_type)
+
+  # Like Interpreter.visit_short_circuit, y only runs when x is not short_value.
+  def compile_short_circuit(self, node, missing, short_value, short_result, negate):
+    x = self.compile(node.node_x)
+    y = self.compile(node.node_y)
+    other_value = not short_value
+
+    def short_circuit(values):
+      check_x = x(values)
+
+      if check_x is short_value:
+        return short_result
+      elif check_x is other_value:
+        check_y = y(values)
+        if check_y is True or check_y is False:
+          return check_y != negate
+      return missing()
+
+    return short_circuit
+
+  def compile_AndBooleanNode(self, node, missing):
+    return self.compile_short_circuit(node, missing, False, False, False)
+
+  def compile_NandBooleanNode(self, node, missing):
+    return self.compile_short_circuit(node, missing, False, True, True)
+
+  def compile_OrBooleanNode(self, node, missing):
+    return self.compile_short_circuit(node, missing, True, True, False)
+
+  def compile_XorBooleanNode(self, node, missing):
+    x = self.compile(node.node_x)
+    y = self.compile(node.node_y)
+
+    def xor_boolean(values):
+      check_x = x(values)
+      check_y = y(values)
+
+      if (check_x is True or check_x is False) and (check_y is True or check_y is False):
+        return check_x != check_y
+      return missing()
+
+    return xor_boolean
+
+  def compile_NorBooleanNode(self, node, missing):
+    return self.compile_short_circuit(node, missing, True, False, True)
+
+  def compile_NotBooleanNode(self, node, missing):
+    a = self.compile(node.node)
+
+    def not_boolean(values):
+      check = a(values)
+
+      if check is True or check is False:
+        return not check
+      return missing()
+
+    return not_boolean
+
+# Optimizer #
+
+constant_nodes = (IntNode, FloatNode, StringNode, TrueNode, FalseNode)
+
+boolean_operator_nodes = (
+  AndBooleanNode, NandBooleanNode, OrBooleanNode, XorBooleanNode,
+  NorBooleanNode, NotBooleanNode
+)
+
+inline_argument_nodes = (IntNode, FloatNode, StringNode, NumberSignNode, StringSignNode, ArraySignNode)
+
+# Left operands that decide the result of a boolean operator on their own.
+short_circuit_results = {
+  (AndBooleanNode, FalseNode): FalseNode,
+  (NandBooleanNode, FalseNode): TrueNode,
+  (OrBooleanNode, TrueNode): TrueNode,
+  (NorBooleanNode, TrueNode): FalseNode
+}
+
+class Optimizer:
+  def optimize(self, node):
+    if node == None:
+      return None
+
+    if isinstance(node, PlusNode):
+      return self.optimize(node.node)
+
+    if isinstance(node, NumberSignNode) and node.value in important_numbers:
+      return FloatNode(important_numbers[node.value])
+
+    if isinstance(node, CallNode):
+      return self.optimize_call(node)
+
+    changes = {}
+
+    for node_field in fields(node):
+      child = getattr(node, node_field.name)
+      if is_dataclass(child):
+        changes[node_field.name] = self.optimize(child)
+
+    if not changes:
+      return node
+
+    node = replace(node, **changes)
+
+    if isinstance(node, ConditionalNode) and isinstance(node.condition, (TrueNode, FalseNode)):
+      return node.node_true if isinstance(node.condition, TrueNode) else node.node_false
+
+    if isinstance(node, boolean_operator_nodes) and not isinstance(node, NotBooleanNode):
+      short_circuit = short_circuit_results.get((type(node), type(node.node_x)))
+      if short_circuit != None:
+        return short_circuit(None)
+
+    if all(isinstance(child, constant_nodes) for child in changes.values()):
+      return self.fold(node)
+
+    return node
+
+  # Small functions are inlined where every argument is a literal number or
+  # string or a variable, which the body reads exactly like its parameters.
+  # Calls with literal number or string arguments are folded like operators.
+  def optimize_call(self, node):
+    arguments = tuple(self.optimize(argument) for argument in node.arguments)
+    function = node.function
+
+    if function.inline_tree != None and all(isinstance(argument, inline_argument_nodes) for argument in arguments):
+      return self.optimize(self.substitute(function.inline_tree, dict(zip(function.parameters, arguments))))
+
+    node = CallNode(function, arguments)
+    if all(isinstance(argument, (IntNode, FloatNode, StringNode)) for argument in arguments):
+      return self.fold(node)
+    return node
+
+  def substitute(self, node, bindings):
+    if isinstance(node, (NumberSignNode, StringSignNode, ArraySignNode)) and node.value in bindings:
+      return bindings[node.value]
+    elif isinstance(node, CallNode):
+      return CallNode(node.function, tuple(self.substitute(argument, bindings) for argument in node.arguments))
+
+    changes = {}
+    for node_field in fields(node):
+      child = getattr(node, node_field.name)
+      if is_dataclass(child):
+        changes[node_field.name] = self.substitute(child, bindings)
+
+    return replace(node, **changes) if changes else node
+
+  def fold(self, node):
+    try:
+      value = result_value(Interpreter().visit(node))
+    except Exception:
+      return node
+
+    if type(value) == int:
+      return IntNode(value)
+    elif type(value) == float:
+      return FloatNode(value)
+    elif type(value) == bool:
+      return TrueNode(None) if value else FalseNode(None)
+
+    return node
+
+# Bytecode #
+
+class Opcode(IntEnum):
+  LOAD_CONST     = 0
+  LOAD_VAR       = 1
+  NO_VALUE       = 2
+  ADD            = 3
+  SUBTRACT       = 4
+  MULTIPLY       = 5
+  DIVIDE         = 6
+  MINUS          = 7
+  AVERAGE        = 8
+  SQUARE         = 9
+  SQUARE_ROOT    = 10
+  ABSOLUTE_VALUE = 11
+  CEIL           = 12
+  FLOOR          = 13
+  MATH_EQUAL     = 14
+  NOT_EQUAL      = 15
+  GREATER        = 16
+  LESS           = 17
+  GREATER_EQUAL  = 18
+  LESS_EQUAL     = 19
+  TYPE_EQUAL     = 20
+  TYPE_NOT_EQUAL = 21
+  NUMBER_TYPE    = 22
+  INTEGER_TYPE   = 23
+  FLOAT_TYPE     = 24
+  STRING_TYPE    = 25
+  EVEN_CHECK     = 26
+  ODD_CHECK      = 27
+  XOR_BOOLEAN    = 28
+  NOT_BOOLEAN    = 29
+  TO_BOOLEAN     = 30
+  ARGUMENT       = 31
+  CALL           = 32
+  JUMP           = 33
+  JUMP_IF_FALSE  = 34
+  JUMP_IF_NOT_BOOL = 35
+  AND_BOOLEAN    = 36
+  OR_BOOLEAN     = 37
+
+node_opcodes = {
+  AddNode: Opcode.ADD,
+  SubtractNode: Opcode.SUBTRACT,
+  MultiplyNode: Opcode.MULTIPLY,
+  DivideNode: Opcode.DIVIDE,
+  MinusNode: Opcode.MINUS,
+  AverageNode: Opcode.AVERAGE,
+  SquareNode: Opcode.SQUARE,
+  SquareRootNode: Opcode.SQUARE_ROOT,
+  AbsoluteValueNode: Opcode.ABSOLUTE_VALUE,
+  CeilNode: Opcode.CEIL,
+  FloorNode: Opcode.FLOOR,
+  MathEqualNode: Opcode.MATH_EQUAL,
+  NotEqualNode: Opcode.NOT_EQUAL,
+  GreaterThanNode: Opcode.GREATER,
+  LessThanNode: Opcode.LESS,
+  GreaterThanEqualNode: Opcode.GREATER_EQUAL,
+  LessThanEqualNode: Opcode.LESS_EQUAL,
+  TypeEqualNode: Opcode.TYPE_EQUAL,
+  TypeNotEqualNode: Opcode.TYPE_NOT_EQUAL,
+  NumberTypeNode: Opcode.NUMBER_TYPE,
+  IntegerTypeNode: Opcode.INTEGER_TYPE,
+  FloatTypeNode: Opcode.FLOAT_TYPE,
+  StringTypeNode: Opcode.STRING_TYPE,
+  EvenCheckNode: Opcode.EVEN_CHECK,
+  OddCheckNode: Opcode.ODD_CHECK
+}
+
+# Opcodes from JUMP on take the program counter and return the next one. Their
+# argument is the position in code to jump to.
+first_jump = Opcode.JUMP
+
+# Boolean operators jump over the right operand when the left one decides the
+# result, nand and nor negate the result of and and or.
+short_circuit_opcodes = {
+  AndBooleanNode: (Opcode.AND_BOOLEAN, False),
+  NandBooleanNode: (Opcode.AND_BOOLEAN, True),
+  OrBooleanNode: (Opcode.OR_BOOLEAN, False),
+  NorBooleanNode: (Opcode.OR_BOOLEAN, True)
+}
+
+# Leaves whose value is known at compile time, like Compiler.compile_* does.
+def leaf_constant(node):
+  if isinstance(node, (IntNode, FloatNode)):
+    return node.value
+  elif isinstance(node, StringNode):
+    return node.value[1:-1]
+  elif isinstance(node, TrueNode):
+    return True
+  elif isinstance(node, FalseNode):
+    return False
+  elif isinstance(node, FunctionNode):
+    return node.WordFun
+  elif isinstance(node, ConditionalNode):
+    return node.WordIf
+  elif isinstance(node, SumNode):
+    return node.WordSum
+  elif isinstance(node, ErrorWordsNode):
+    if node.value == 'and':
+      return node.ErrorAnd
+    elif node.value == 'or':
+      return node.ErrorOr
+    return 'Error: Not a Keyword'
+  return important_numbers[node.value]
+
+# Compiles a tree into a flat list of (opcode, argument) pairs without
+# recursion. The argument of an operation is 1 where its result is read as a
+# value, so it raises instead of producing None like Compiler's missing
+# callback. Operand code of every division is recorded so errors raised there
+# become "Runtime math error" like they do inside visit_DivideNode. Jumps are
+# emitted before their target is known, a label collects the positions of
+# their arguments and fills them in once it is placed.
+class BytecodeCompiler:
+  def __init__(self):
+    self.code = array('i')
+    self.constants = []
+    self.constant_indexes = {}
+    self.slots = {}
+    self.math_error_ranges = []
+
+  def emit(self, opcode, argument=0):
+    self.code.append(opcode)
+    self.code.append(argument)
+
+  def constant(self, value):
+    key = (type(value), repr(value))
+    if key not in self.constant_indexes:
+      self.constant_indexes[key] = len(self.constants)
+      self.constants.append(value)
+    return self.constant_indexes[key]
+
+  def compile(self, tree, text='', context=0):
+    if tree == None:
+      self.emit(Opcode.LOAD_CONST, self.constant(None))
+    else:
+      work = [(self.visit_value if context else self.visit, tree, context)]
+      while work:
+        action, *arguments = work.pop()
+        action(work, *arguments)
+
+    return Bytecode(self.code, tuple(self.constants), tuple(self.slots), tuple(self.math_error_ranges), text)
+
+  def emit_action(self, work, opcode, argument):
+    self.emit(opcode, argument)
+
+  def emit_jump(self, work, opcode, label):
+    label.append(len(self.code) + 1)
+    self.emit(opcode)
+
+  def place_label(self, work, label):
+    for position in label:
+      self.code[position] = len(self.code)
+
+  def start_range(self, work, start):
+    start.append(len(self.code))
+
+  def end_range(self, work, start):
+    self.math_error_ranges.append((start[0], len(self.code)))
+
+  def visit_value(self, work, node, context):
+    inner = node
+    while isinstance(inner, PlusNode):
+      inner = inner.node
+
+    if isinstance(inner, no_value_nodes):
+      work.append((self.emit_action, Opcode.NO_VALUE, self.constant(type(inner).__name__)))
+    work.append((self.visit, node, 1))
+
+  # The actions are pushed in reverse, so they run from the bottom up.
+  def visit_short_circuit(self, work, node, context):
+    opcode, negate = short_circuit_opcodes[type(node)]
+    end = []
+
+    if negate:
+      work.append((self.emit_action, Opcode.NOT_BOOLEAN, context))
+    work.append((self.place_label, end))
+    work.append((self.emit_action, Opcode.TO_BOOLEAN, 0))
+    work.append((self.visit, node.node_y, 0))
+    work.append((self.emit_jump, opcode, end))
+    work.append((self.visit, node.node_x, 0))
+
+  def visit_conditional(self, work, node, context):
+    branch = self.visit_value if context else self.visit
+    node_false = []
+    fail = []
+    end = []
+
+    work.append((self.place_label, end))
+    if context:
+      work.append((self.emit_action, Opcode.NO_VALUE, self.constant('NoneType')))
+    else:
+      work.append((self.emit_action, Opcode.LOAD_CONST, self.constant(None)))
+    work.append((self.place_label, fail))
+    work.append((self.emit_jump, Opcode.JUMP, end))
+    work.append((branch, node.node_false, context))
+    work.append((self.place_label, node_false))
+    work.append((self.emit_jump, Opcode.JUMP, end))
+    work.append((branch, node.node_true, context))
+    work.append((self.emit_jump, Opcode.JUMP_IF_FALSE, node_false))
+    work.append((self.emit_jump, Opcode.JUMP_IF_NOT_BOOL, fail))
+    work.append((self.visit, node.condition, 0))
+
+  def visit(self, work, node, context):
+    opcode = node_opcodes.get(type(node))
+
+    if opcode == None:
+      if isinstance(node, PlusNode):
+        work.append((self.visit, node.node, context))
+      elif isinstance(node, (NumberSignNode, StringSignNode, ArraySignNode)) and node.value not in important_numbers:
+        self.emit(Opcode.LOAD_VAR, self.slots.setdefault(node.value, len(self.slots)))
+      elif type(node) in short_circuit_opcodes:
+        self.visit_short_circuit(work, node, context)
+      elif isinstance(node, XorBooleanNode):
+        work.append((self.emit_action, Opcode.XOR_BOOLEAN, context))
+        work.append((self.visit, node.node_y, 0))
+        work.append((self.visit, node.node_x, 0))
+      elif isinstance(node, NotBooleanNode):
+        work.append((self.emit_action, Opcode.NOT_BOOLEAN, context))
+        work.append((self.visit, node.node, 0))
+      elif isinstance(node, ConditionalNode) and node.condition != None:
+        self.visit_conditional(work, node, context)
+      elif isinstance(node, CallNode):
+        work.append((self.emit_action, Opcode.CALL, context))
+        work.append((self.emit_action, Opcode.LOAD_CONST, self.constant(node.function)))
+        for argument in reversed(node.arguments):
+          work.append((self.emit_action, Opcode.ARGUMENT, 1))
+          work.append((self.visit, argument, 0))
+      else:
+        self.emit(Opcode.LOAD_CONST, self.constant(leaf_constant(node)))
+    else:
+      work.append((self.emit_action, opcode, context))
+
+      if opcode == Opcode.DIVIDE:
+        start = []
+        work.append((self.end_range, start))
+        for name in reversed(node.__slots__):
+          work.append((self.visit_value, getattr(node, name), 1))
+        work.append((self.start_range, start))
+      else:
+        for name in reversed(node.__slots__):
+          work.append((self.visit_value, getattr(node, name), 1))
+
+def fallthrough(context):
+  if context:
+    raise NoValueError()
+  return None
+
+def is_number(value):
+  return isinstance(value, (int, float))
+
+def arithmetic_operation(calculate):
+  def operation(stack, context):
+    num_b = stack.pop()
+    num_a = stack[-1]
+    if is_number(num_a) and is_number(num_b):
+      stack[-1] = calculate(num_a, num_b)
+    else:
+      stack[-1] = fallthrough(context)
+  return operation
+
+def comparison_operation(compare, ordering=False):
+  def operation(stack, context):
+    check_y = stack.pop()
+    check_x = stack[-1]
+    if is_number(check_x) and is_number(check_y):
+      if compare(check_x, check_y):
+        stack[-1] = True
+      elif ordering and (check_x != check_x or check_y != check_y):
+        stack[-1] = fallthrough(context)
+      else:
+        stack[-1] = False
+    else:
+      stack[-1] = fallthrough(context)
+  return operation
+
+def type_comparison_operation(same_type_result, mixed_type_result):
+  def operation(stack, context):
+    check_y = stack.pop()
+    check_x = stack[-1]
+    if (isinstance(check_x, int) and isinstance(check_y, int)) or (isinstance(check_x, float) and isinstance(check_y, float)):
+      stack[-1] = (check_x == check_y) == same_type_result
+    elif is_number(check_x) and is_number(check_y):
+      stack[-1] = mixed_type_result
+    else:
+      stack[-1] = fallthrough(context)
+  return operation
+
+def unary_operation(calculate):
+  def operation(stack, context):
+    result = calculate(stack[-1])
+    stack[-1] = fallthrough(context) if result == None else result
+  return operation
+
+def is_boolean(value):
+  return value is True or value is False
+
+def xor_operation(stack, context):
+  check_y = stack.pop()
+  check_x = stack[-1]
+  if is_boolean(check_x) and is_boolean(check_y):
+    stack[-1] = check_x != check_y
+  else:
+    stack[-1] = fallthrough(context)
+
+def jump_operation(stack, target, pc):
+  return target
+
+def jump_if_false_operation(stack, target, pc):
+  return target if stack.pop() is False else pc
+
+def jump_if_not_boolean_operation(stack, target, pc):
+  if is_boolean(stack[-1]):
+    return pc
+  stack.pop()
+  return target
+
+# Keeps a left operand equal to short_value as the result and jumps over the
+# right operand, drops the other boolean to evaluate the right operand.
+def short_circuit_operation(short_value):
+  def operation(stack, target, pc):
+    check_x = stack[-1]
+    if check_x is short_value:
+      return target
+    elif is_boolean(check_x):
+      stack.pop()
+      return pc
+    stack[-1] = None
+    return target
+  return operation
+
+def divide_operation(stack, context):
+  num_b = stack.pop()
+  num_a = stack[-1]
+  if is_number(num_a) and is_number(num_b):
+    try:
+      quotient = num_a / num_b
+      stack[-1] = int(quotient) if ((quotient % 1) == 0) else quotient
+    except:
+      raise Exception("Runtime math error")
+  else:
+    stack[-1] = fallthrough(context)
+
+def no_value_operation(stack, context):
+  raise NoValueError()
+
+def argument_operation(stack, context):
+  if stack[-1] == None:
+    no_value_operation(stack, context)
+
+# The function is on top of the stack, its arguments below it.
+def call_operation(stack, context):
+  function = stack.pop()
+  start = len(stack) - len(function.parameters)
+  arguments = stack[start:]
+  del stack[start:]
+  stack.append(function.functions[context](arguments))
+
+def average_values(num_a, num_b):
+  if isinstance(num_a, int) and isinstance(num_b, int):
+    total = num_a + num_b
+    return int(total/2) if ((total % 2) == 0) else total/2
+  return (num_a + num_b)/2
+
+def average_operation(stack, context):
+  num_b = stack.pop()
+  num_a = stack[-1]
+  if is_number(num_a) and is_number(num_b):
+    stack[-1] = average_values(num_a, num_b)
+  else:
+    stack[-1] = fallthrough(context)
+
+def square_root_value(num):
+  if isinstance(num, int):
+    answer = (num**(1/2))
+    return int(answer) if ((answer % 1) == 0) else answer
+  elif isinstance(num, float):
+    return (num**(1/2))
+
+def ceil_value(num):
+  if isinstance(num, int):
+    return num
+  elif isinstance(num, float):
+    if (((num % 1) == 0) or (num < 0)):
+      return int(num)
+    elif (num > 0):
+      return int(num)+1
+
+def floor_value(num):
+  if isinstance(num, int):
+    return num
+  elif isinstance(num, float):
+    if (((num % 1) == 0) or (num > 0)):
+      return int(num)
+    elif (num < 0):
+      return int(num)-1
+
+def number_type_value(value):
+  if is_number(value):
+    return True
+  elif isinstance(value, str):
+    return False
+
+def string_type_value(value):
+  if isinstance(value, str):
+    return True
+  elif is_number(value):
+    return False
+
+opcode_operations = [None] * len(Opcode)
+opcode_operations[Opcode.NO_VALUE] = no_value_operation
+opcode_operations[Opcode.ADD] = arithmetic_operation(operator.add)
+opcode_operations[Opcode.SUBTRACT] = arithmetic_operation(operator.sub)
+opcode_operations[Opcode.MULTIPLY] = arithmetic_operation(operator.mul)
+opcode_operations[Opcode.DIVIDE] = divide_operation
+opcode_operations[Opcode.MINUS] = unary_operation(lambda num: -num if is_number(num) else None)
+opcode_operations[Opcode.AVERAGE] = average_operation
+opcode_operations[Opcode.SQUARE] = unary_operation(lambda num: num * num if is_number(num) else None)
+opcode_operations[Opcode.SQUARE_ROOT] = unary_operation(square_root_value)
+opcode_operations[Opcode.ABSOLUTE_VALUE] = unary_operation(lambda num: (num*-1 if num < 0 else num) if is_number(num) else None)
+opcode_operations[Opcode.CEIL] = unary_operation(ceil_value)
+opcode_operations[Opcode.FLOOR] = unary_operation(floor_value)
+opcode_operations[Opcode.MATH_EQUAL] = comparison_operation(operator.eq)
+opcode_operations[Opcode.NOT_EQUAL] = comparison_operation(operator.ne)
+opcode_operations[Opcode.GREATER] = comparison_operation(operator.gt, True)
+opcode_operations[Opcode.LESS] = comparison_operation(operator.lt, True)
+opcode_operations[Opcode.GREATER_EQUAL] = comparison_operation(operator.ge, True)
+opcode_operations[Opcode.LESS_EQUAL] = comparison_operation(operator.le, True)
+opcode_operations[Opcode.TYPE_EQUAL] = type_comparison_operation(True, False)
+opcode_operations[Opcode.TYPE_NOT_EQUAL] = type_comparison_operation(False, True)
+opcode_operations[Opcode.NUMBER_TYPE] = unary_operation(number_type_value)
+opcode_operations[Opcode.INTEGER_TYPE] = unary_operation(lambda value: isinstance(value, int))
+opcode_operations[Opcode.FLOAT_TYPE] = unary_operation(lambda value: isinstance(value, float))
+opcode_operations[Opcode.STRING_TYPE] = unary_operation(string_type_value)
+opcode_operations[Opcode.EVEN_CHECK] = unary_operation(lambda value: ((value % 2) == 0))
+opcode_operations[Opcode.ODD_CHECK] = unary_operation(lambda value: ((value % 2) != 0))
+opcode_operations[Opcode.XOR_BOOLEAN] = xor_operation
+opcode_operations[Opcode.NOT_BOOLEAN] = unary_operation(lambda value: not value if is_boolean(value) else None)
+opcode_operations[Opcode.TO_BOOLEAN] = unary_operation(lambda value: value if is_boolean(value) else None)
+opcode_operations[Opcode.ARGUMENT] = argument_operation
+opcode_operations[Opcode.CALL] = call_operation
+opcode_operations[Opcode.JUMP] = jump_operation
+opcode_operations[Opcode.JUMP_IF_FALSE] = jump_if_false_operation
+opcode_operations[Opcode.JUMP_IF_NOT_BOOL] = jump_if_not_boolean_operation
+opcode_operations[Opcode.AND_BOOLEAN] = short_circuit_operation(False)
+opcode_operations[Opcode.OR_BOOLEAN] = short_circuit_operation(True)
+
+@dataclass
+class Bytecode:
+  code: array
+  constants: tuple
+  variable_names: tuple
+  math_error_ranges: tuple
+  text: str = ''
+
+  def bind(self, variables=None):
+    if variables == None:
+      return self.variable_names
+    return [variables.get(name, name) for name in self.variable_names]
+
+  def evaluate(self, variables=None):
+    return self.run(self.bind(variables))
+
+  def run(self, values):
+    code = self.code
+    constants = self.constants
+    operations = opcode_operations
+    load_const = Opcode.LOAD_CONST
+    load_var = Opcode.LOAD_VAR
+    jump = first_jump
+    stack = []
+    pc = 0
+    end = len(code)
+
+    try:
+      while pc < end:
+        opcode = code[pc]
+        argument = code[pc + 1]
+        pc += 2
+        if opcode == load_const:
+          stack.append(constants[argument])
+        elif opcode == load_var:
+          stack.append(values[argument])
+        elif opcode < jump:
+          operations[opcode](stack, argument)
+        else:
+          pc = operations[opcode](stack, argument, pc)
+    except Exception:
+      failed = pc - 2
+      for start, stop in self.math_error_ranges:
+        if start <= failed < stop:
+          raise Exception("Runtime math error")
+      raise
+
+    return stack[-1]
+
+  def disassemble(self):
+    lines = []
+    for pc in range(0, len(self.code), 2):
+      opcode = Opcode(self.code[pc])
+      argument = self.code[pc + 1]
+      if opcode == Opcode.LOAD_CONST or opcode == Opcode.NO_VALUE:
+        lines.append(f'{pc // 2:>5} {opcode.name:<16}{argument:>4} ({self.constants[argument]!r})')
+      elif opcode == Opcode.LOAD_VAR:
+        lines.append(f'{pc // 2:>5} {opcode.name:<16}{argument:>4} ({self.variable_names[argument]})')
+      elif opcode >= first_jump:
+        lines.append(f'{pc // 2:>5} {opcode.name:<16}{argument:>4} (to {argument // 2})')
+      else:
+        lines.append(f'{pc // 2:>5} {opcode.name:<16}{argument:>4}')
+    return '\n'.join(lines)
+
+# API #
+
+def result_value(result):
+  if isinstance(result, TrueNode):
+    return True
+  elif isinstance(result, FalseNode):
+    return False
+  elif result == 'True':
+    return True
+  elif result == 'False':
+    return False
+  elif hasattr(result, 'value'):
+    return result.value
+  return result
+
+@dataclass
+class Expression:
+  text: str
+  tree: any
+  function: any
+  variable_names: tuple = ()
+  variable_types: tuple = ()
+  type_errors: tuple = ()
+
+  def bind(self, variables=None):
+    if variables == None:
+      values = self.variable_names
+    else:
+      values = [variables.get(name, name) for name in self.variable_names]
+
+    if self.variable_types:
+      for name, value, declared in zip(self.variable_names, values, self.variable_types):
+        if declared != None and type(value) != declared:
+          raise Exception(f"{name} must be {declared.__name__}, not {type(value).__name__}")
+
+    return values
+
+  def evaluate(self, variables=None):
+    return self.function(self.bind(variables))
+
+  def interpret(self, variables=None):
+    if self.tree == None:
+      return None
+    return result_value(Interpreter(variables).visit(self.tree))
+
+# Deeper trees would overflow the Python stack in the recursive Optimizer,
+# Compiler and nested closures, so they run on the bytecode machine instead.
+closure_depth_limit = 200
+
+def tree_depth(tree):
+  depth = 0
+  pending = [(tree, 1)] if tree != None else []
+
+  while pending:
+    node, node_depth = pending.pop()
+    depth = max(depth, node_depth)
+    for child in child_nodes(node):
+      pending.append((child, node_depth + 1))
+
+  return depth
+
+def compile_tree(tree, text='', types=None):
+  inference = TypeInference(types)
+  inference.infer(tree)
+  types = types or {}
+
+  if tree_depth(tree) > closure_depth_limit:
+    bytecode = BytecodeCompiler().compile(tree, text)
+    variable_types = tuple(types.get(name) for name in bytecode.variable_names) if types else ()
+    return Expression(text, tree, bytecode.run, bytecode.variable_names, variable_types, tuple(inference.errors))
+
+  compiler = Compiler(inference.types)
+  function = compiler.compile(tree)
+  variable_types = tuple(types.get(name) for name in compiler.slots) if types else ()
+  return Expression(text, tree, function, tuple(compiler.slots), variable_types, tuple(inference.errors))
+
+def compile(text, lexer=FastLexer, parser=PrattParser, optimizer=Optimizer, types=None):
+  tokens = lexer(text).generate_tokens()
+  tree = parser(tokens).parse()
+  if optimizer != None and tree_depth(tree) <= closure_depth_limit:
+    tree = optimizer().optimize(tree)
+  return compile_tree(tree, text, types)
+
+def interpret(text, variables=None, numbers=float_numbers, lexer=FastLexer, parser=PrattParser):
+  tokens = lexer(text, numbers.parse).generate_tokens()
+  tree = parser(tokens).parse()
+  if tree == None:
+    return None
+  with numbers.context():
+    return result_value(Interpreter(variables, numbers).visit(tree))
+
+def compile_bytecode(text, lexer=FastLexer, parser=PrattParser):
+  tokens = lexer(text).generate_tokens()
+  tree = parser(tokens).parse()
+  return BytecodeCompiler().compile(tree, text)
+
+# Bytecode Catalog #
+
+# A catalog file starts with the magic bytes, the format version, a checksum
+# of the opcode names and the number of entries, followed by one offset per
+# entry and the entries themselves. Every number is little endian.
+catalog_magic = b'MCFLYBC\0'
+catalog_version = 4
+catalog_header = struct.Struct('<8sHII')
+catalog_offset = struct.Struct('<Q')
+catalog_length = struct.Struct('<I')
+catalog_float = struct.Struct('<d')
+
+def opcode_checksum():
+  return zlib.crc32(','.join(opcode.name for opcode in Opcode).encode())
+
+# Calls take as many stack slots as the function has parameters, so a
+# function is only loaded back when its definition has not changed.
+def function_checksum(function):
+  return zlib.crc32('\0'.join(function.parameters + (function.text,)).encode())
+
+def encode_text(text):
+  data = text.encode('utf-8')
+  return catalog_length.pack(len(data)) + data
+
+def encode_integers(values):
+  data = array('i', values)
+  if sys.byteorder == 'big':
+    data.byteswap()
+  return catalog_length.pack(len(data)) + data.tobytes()
+
+def encode_constant(value):
+  if value == None:
+    return b'N'
+  elif value is True:
+    return b'T'
+  elif value is False:
+    return b'F'
+  elif isinstance(value, int):
+    return b'i' + encode_text(str(value))
+  elif isinstance(value, float):
+    return b'f' + catalog_float.pack(value)
+  elif isinstance(value, UserFunction):
+    return b'u' + encode_text(value.name) + catalog_length.pack(function_checksum(value))
+  return b's' + encode_text(value)
+
+def encode_bytecode(bytecode):
+  parts = [encode_text(bytecode.text), encode_integers(bytecode.code)]
+  parts.append(catalog_length.pack(len(bytecode.constants)))
+  parts.extend(encode_constant(value) for value in bytecode.constants)
+  parts.append(catalog_length.pack(len(bytecode.variable_names)))
+  parts.extend(encode_text(name) for name in bytecode.variable_names)
+  parts.append(encode_integers([position for math_range in bytecode.math_error_ranges for position in math_range]))
+  return b''.join(parts)
+
+class CatalogReader:
+  def __init__(self, buffer, position):
+    self.buffer = buffer
+    self.position = position
+
+  def length(self):
+    length = catalog_length.unpack_from(self.buffer, self.position)[0]
+    self.position += catalog_length.size
+    return length
+
+  def text(self):
+    length = self.length()
+    start = self.position
+    self.position += length
+    return str(self.buffer[start:self.position], 'utf-8')
+
+  def integers(self):
+    length = self.length() * 4
+    data = array('i')
+    data.frombytes(self.buffer[self.position:self.position + length])
+    if sys.byteorder == 'big':
+      data.byteswap()
+    self.position += length
+    return data
+
+  def constant(self):
+    tag = self.buffer[self.position:self.position + 1]
+    self.position += 1
+
+    if tag == b'N':
+      return None
+    elif tag == b'T':
+      return True
+    elif tag == b'F':
+      return False
+    elif tag == b'i':
+      return int(self.text())
+    elif tag == b'f':
+      value = catalog_float.unpack_from(self.buffer, self.position)[0]
+      self.position += catalog_float.size
+      return value
+    elif tag == b's':
+      return self.text()
+    elif tag == b'u':
+      name = self.text()
+      checksum = self.length()
+      if name not in user_functions:
+        raise Exception(f"Unknown function {name}")
+      if function_checksum(user_functions[name]) != checksum:
+        raise Exception(f"fun {name} was defined again, write the catalog again with write_catalog")
+      return user_functions[name]
+    raise Exception("Corrupt bytecode catalog")
+
+  def bytecode(self):
+    text = self.text()
+    code = self.integers()
+    constants = tuple(self.constant() for _ in range(self.length()))
+    variable_names = tuple(self.text() for _ in range(self.length()))
+    positions = self.integers()
+    math_error_ranges = tuple(zip(positions[0::2], positions[1::2]))
+    return Bytecode(code, constants, variable_names, math_error_ranges, text)
+
+def write_catalog(path, texts, lexer=FastLexer, parser=PrattParser):
+  entries = [encode_bytecode(compile_bytecode(text, lexer, parser)) for text in texts]
+  position = catalog_header.size + catalog_offset.size * len(entries)
+  offsets = []
+  for entry in entries:
+    offsets.append(catalog_offset.pack(position))
+    position += len(entry)
+
+  with open(path, 'wb') as file:
+    file.write(catalog_header.pack(catalog_magic, catalog_version, opcode_checksum(), len(entries)))
+    file.writelines(offsets)
+    file.writelines(entries)
+
+  return len(entries)
+
+# Maps a catalog file written by write_catalog and decodes entries only when
+# they are asked for, so opening a catalog costs the same for any size.
+class BytecodeCatalog:
+  def __init__(self, path):
+    with open(path, 'rb') as file:
+      self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size else b''
+
+    if len(self.buffer) < catalog_header.size:
+      raise Exception("Not a McFly bytecode catalog")
+    magic, version, checksum, self.count = catalog_header.unpack_from(self.buffer)
+    if magic != catalog_magic:
+      raise Exception("Not a McFly bytecode catalog")
+    if version != catalog_version or checksum != opcode_checksum():
+      raise Exception("Stale bytecode catalog format, write it again with write_catalog")
+
+    self.bytecodes = {}
+    self.indexes = None
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, index):
+    if not 0 <= index < self.count:
+      raise IndexError("catalog index out of range")
+
+    bytecode = self.bytecodes.get(index)
+    if bytecode == None:
+      position = catalog_offset.unpack_from(self.buffer, catalog_header.size + catalog_offset.size * index)[0]
+      bytecode = CatalogReader(self.buffer, position).bytecode()
+      self.bytecodes[index] = bytecode
+    return bytecode
+
+  def get(self, text):
+    if self.indexes == None:
+      self.indexes = {}
+      for index in range(self.count):
+        position = catalog_offset.unpack_from(self.buffer, catalog_header.size + catalog_offset.size * index)[0]
+        self.indexes.setdefault(CatalogReader(self.buffer, position).text(), index)
+
+    index = self.indexes.get(text)
+    return None if index == None else self[index]
+
+  def evaluate(self, text, variables=None):
+    bytecode = self.get(text)
+    if bytecode == None:
+      bytecode = compile_bytecode(text)
+    return bytecode.evaluate(variables)
+
+  def close(self):
+    self.bytecodes.clear()
+    if isinstance(self.buffer, mmap.mmap):
+      self.buffer.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+# Tiered Execution #
+
+# Calls a TieredExpression runs in the Interpreter before it is compiled.
+tier_threshold = 1000
+
+# Starts out walking the parsed tree with the Interpreter, which costs
+# nothing up front, and counts its calls. The call after the first threshold
+# ones optimizes and compiles the tree and from then on every call runs the
+# compiled Expression, which returns the same values. Trees deeper than
+# closure_depth_limit run on the bytecode machine, which is quicker than
+# walking them, so they are compiled right away.
+class TieredExpression:
+  def __init__(self, text, threshold=None, lexer=FastLexer, parser=PrattParser, optimizer=Optimizer):
+    self.text = text
+    self.threshold = tier_threshold if threshold == None else threshold
+    self.optimizer = optimizer
+    self.tree = parser(lexer(text).generate_tokens()).parse()
+    self.expression = None
+    self.interpreted_calls = 0
+    self.compiled_calls = 0
+
+    if self.threshold <= 0 or tree_depth(self.tree) > closure_depth_limit:
+      self.promote()
+
+  @property
+  def tier(self):
+    return 'interpreter' if self.expression == None else 'compiled'
+
+  @property
+  def calls(self):
+    return self.interpreted_calls + self.compiled_calls
+
+  def promote(self):
+    if self.expression == None:
+      tree = self.tree
+      if self.optimizer != None and tree_depth(tree) <= closure_depth_limit:
+        tree = self.optimizer().optimize(tree)
+      self.expression = compile_tree(tree, self.text)
+    return self.expression
+
+  def evaluate(self, variables=None):
+    if self.expression == None:
+      if self.interpreted_calls < self.threshold:
+        self.interpreted_calls += 1
+        if self.tree == None:
+          return None
+        return result_value(Interpreter(variables).visit(self.tree))
+      self.promote()
+
+    self.compiled_calls += 1
+    return self.expression.evaluate(variables)
+
+  def stats(self):
+    return {
+      'tier': self.tier,
+      'threshold': self.threshold,
+      'calls': self.calls,
+      'interpreted_calls': self.interpreted_calls,
+      'compiled_calls': self.compiled_calls
+    }
+
+# Expression Cache #
+
+# With a threshold the cache holds TieredExpressions instead of compiling
+# every text when it is first seen.
+class ExpressionCache:
+  def __init__(self, capacity=4096, lexer=FastLexer, parser=PrattParser, optimizer=Optimizer, threshold=None):
+    self.capacity = capacity
+    self.lexer = lexer
+    self.parser = parser
+    self.optimizer = optimizer
+    self.threshold = threshold
+    self.expressions = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def get(self, text):
+    expression = self.expressions.get(text)
+
+    if expression != None:
+      self.hits += 1
+      self.expressions.move_to_end(text)
+      return expression
+
+    self.misses += 1
+    if self.threshold == None:
+      expression = compile(text, self.lexer, self.parser, self.optimizer)
+    else:
+      expression = TieredExpression(text, self.threshold, self.lexer, self.parser, self.optimizer)
+    self.expressions[text] = expression
+
+    while len(self.expressions) > self.capacity:
+      self.expressions.popitem(last=False)
+      self.evictions += 1
+
+    return expression
+
+  def evaluate(self, text, variables=None):
+    return self.get(text).evaluate(variables)
+
+  def clear(self):
+    self.expressions.clear()
+
+  def tiers(self):
+    return {text: expression.stats() for text, expression in self.expressions.items() if isinstance(expression, TieredExpression)}
+
+  def stats(self):
+    return {
+      'size': len(self.expressions),
+      'capacity': self.capacity,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions
+    }
+
+expression_cache = ExpressionCache()
+
+# variables is keyword-only so evaluate(text, Lexer, Parser) keeps working.
+def evaluate(text, lexer=FastLexer, parser=PrattParser, optimizer=Optimizer, *, variables=None):
+  cache = expression_cache
+  if lexer == cache.lexer and parser == cache.parser and optimizer == cache.optimizer:
+    return cache.evaluate(text, variables)
+  return compile(text, lexer, parser, optimizer).evaluate(variables)
+
+# User Functions #
+
+user_functions = {}
+
+# Bodies with at most this many nodes are inlined by the Optimizer.
+inline_node_limit = 16
+
+# Floats, Decimals and Fractions that are equal can still give different
+# results, like 0.0 and -0.0, so they are told apart by their repr.
+def memo_key(values):
+  return tuple((type(value), value if type(value) in (int, str, bool) else repr(value)) for value in values)
+
+def tree_nodes(tree):
+  pending = [tree]
+  while pending:
+    node = pending.pop()
+    yield node
+    pending.extend(child_nodes(node))
+
+# A function body is an expression over the parameters and nothing else, so
+# a call always gives the same result for the same arguments. The body is
+# parsed and compiled once, read as a value (functions[1]) or not
+# (functions[0]). A function with a memo_size remembers the results of that
+# many calls, dropping the least recently used, and is never inlined.
+class UserFunction:
+  def __init__(self, name, parameters, text, memo_size=0, lexer=FastLexer, parser=PrattParser):
+    if not (name.isascii() and name.isalpha()):
+      raise Exception(f"Function names can only have letters, not {name!r}")
+    for parameter in parameters:
+      if parameter[:1] not in sign_var_tokens or not parameter[1:] or any(char not in LETTERS_DIGITS_US for char in parameter[1:]) or parameter in important_numbers:
+        raise Exception(f"{parameter!r} can not be a parameter of fun {name}")
+    if len(set(parameters)) != len(parameters):
+      raise Exception(f"fun {name} has the same parameter twice")
+
+    self.name = name
+    self.parameters = tuple(parameters)
+    self.text = text
+    self.memo_size = memo_size
+    self.lexer = lexer
+    self.parser = parser
+    self.memo = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    self.tree = parser(lexer(text).generate_tokens()).parse()
+    if self.tree == None:
+      raise Exception(f"fun {name} has no body")
+    for node in tree_nodes(self.tree):
+      if isinstance(node, (NumberSignNode, StringSignNode, ArraySignNode)) and node.value not in important_numbers and node.value not in self.parameters:
+        raise Exception(f"fun {name} reads {node.value}, which is not one of its parameters")
+    self.bodies = {float_numbers: self.tree}
+
+    tree = self.tree
+    if tree_depth(tree) <= closure_depth_limit:
+      tree = Optimizer().optimize(tree)
+    inference = TypeInference()
+    self.result_type = inference.infer(tree)
+    self.inline_tree = tree if memo_size == 0 and sum(1 for _ in tree_nodes(tree)) <= inline_node_limit else None
+    self.functions = tuple(self.memoized(self.compile_body(tree, inference.types, context), context) for context in (0, 1))
+
+  def __repr__(self):
+    return f'fun {self.name}'
+
+  # Compiled bodies can not be pickled, so a function is rebuilt from its
+  # text, along with the functions its body calls.
+  def __reduce__(self):
+    called = {node.function.name: node.function for node in tree_nodes(self.tree) if isinstance(node, CallNode)}
+    return rebuild_function, (self.name, self.parameters, self.text, self.memo_size, self.lexer, self.parser, tuple(called.values()))
+
+  # Arguments come in the order of the parameters.
+  def compile_body(self, tree, types, context):
+    slots = {parameter: index for index, parameter in enumerate(self.parameters)}
+    if tree_depth(tree) > closure_depth_limit:
+      compiler = BytecodeCompiler()
+      compiler.slots = slots
+      return compiler.compile(tree, self.text, context).run
+
+    compiler = Compiler(types)
+    compiler.slots = slots
+    return compiler.compile_value(tree) if context else compiler.compile(tree)
+
+  def memoized(self, function, context):
+    if self.memo_size <= 0:
+      return function
+
+    memo = self.memo
+
+    def remembered(arguments):
+      key = (context, memo_key(arguments))
+      if key in memo:
+        self.hits += 1
+        memo.move_to_end(key)
+        return memo[key]
+
+      self.misses += 1
+      result = function(arguments)
+      memo[key] = result
+      if len(memo) > self.memo_size:
+        memo.popitem(last=False)
+        self.evictions += 1
+      return result
+
+    return remembered
+
+  # Other numbers backends parse FLOAT tokens of the body their own way.
+  def body(self, numbers):
+    tree = self.bodies.get(numbers)
+    if tree == None:
+      tree = self.parser(self.lexer(self.text, numbers.parse).generate_tokens()).parse()
+      self.bodies[numbers] = tree
+    return tree
+
+  def interpret(self, arguments, numbers=float_numbers):
+    return Interpreter(dict(zip(self.parameters, arguments)), numbers).visit(self.body(numbers))
+
+  def evaluate(self, *arguments):
+    return self.functions[0](list(arguments))
+
+  def clear(self):
+    self.memo.clear()
+
+  def stats(self):
+    return {
+      'size': len(self.memo),
+      'capacity': self.memo_size,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions
+    }
+
+# The body is parsed with the functions it was first parsed with, whatever
+# user_functions holds in this process.
+def rebuild_function(name, parameters, text, memo_size, lexer, parser, called):
+  saved = dict(user_functions)
+  user_functions.update((function.name, function) for function in called)
+  try:
+    return UserFunction(name, parameters, text, memo_size, lexer, parser)
+  finally:
+    user_functions.clear()
+    user_functions.update(saved)
+
+# Makes fun <name> callable in expressions parsed from now on. Expressions
+# parsed before keep calling the function they were parsed with, so cached
+# ones are dropped when a name is defined again.
+def define_function(name, parameters, text, memo_size=0, lexer=FastLexer, parser=PrattParser):
+  function = UserFunction(name, parameters, text, memo_size, lexer, parser)
+  if name in user_functions:
+    expression_cache.clear()
+  user_functions[name] = function
+  return function
+
+# Batch Evaluation #
+
+@dataclass
+class NumberColumn:
+  values: any
+  is_int: any
+
+  def broadcast(self, shape):
+    import numpy
+    return NumberColumn(numpy.broadcast_to(self.values, shape), numpy.broadcast_to(self.is_int, shape))
+
+  def tolist(self):
+    import numpy
+    values = numpy.asarray(self.values)
+    is_int = numpy.broadcast_to(self.is_int, values.shape)
+
+    if values.ndim == 0:
+      return int(values) if is_int else float(values)
+    return [int(value) if value_is_int else float(value) for value, value_is_int in zip(values.tolist(), is_int.tolist())]
+
+@dataclass
+class BooleanColumn:
+  values: any
+
+  def broadcast(self, shape):
+    import numpy
+    return BooleanColumn(numpy.broadcast_to(self.values, shape))
+
+  def tolist(self):
+    import numpy
+    return numpy.asarray(self.values, dtype=bool).tolist()
+
+# Evaluates a tree once for whole NumPy arrays of #name values. Number
+# columns keep a per row is_int mask so int/float results follow the same
+# rules as the Interpreter.
+class VectorInterpreter:
+  def __init__(self, variables):
+    import numpy
+    self.numpy = numpy
+    self.variables = variables
+    self.shape = numpy.broadcast_shapes(*[numpy.shape(values) for values in variables.values()])
+
+  def visit(self, node):
+    method_name = f'visit_{type(node).__name__}'
+    method = getattr(self, method_name, self.visit_unsupported)
+    return method(node)
+
+  def visit_unsupported(self, node):
+    raise Exception(f'Error: {type(node).__name__} can not be evaluated in a batch.')
+
+  def visit_number(self, node):
+    column = self.visit(node)
+    if not isinstance(column, NumberColumn):
+      raise Exception(f'Error: {node} is not a number.')
+    return column
+
+  def visit_IntNode(self, node):
+    return NumberColumn(self.numpy.asarray(node.value), True)
+
+  def visit_FloatNode(self, node):
+    return NumberColumn(self.numpy.asarray(node.value), False)
+
+  def visit_TrueNode(self, node):
+    return BooleanColumn(self.numpy.asarray(True))
+
+  def visit_FalseNode(self, node):
+    return BooleanColumn(self.numpy.asarray(False))
+
+  def visit_NumberSignNode(self, node):
+    if node.value in important_numbers:
+      return NumberColumn(self.numpy.asarray(important_numbers[node.value]), False)
+
+    if node.value not in self.variables:
+      raise Exception(f'Error: No values for {node.value}.')
+
+    values = self.numpy.asarray(self.variables[node.value])
+    if values.dtype.kind in 'iub':
+      return NumberColumn(values.astype(self.numpy.int64), True)
+    return NumberColumn(values.astype(self.numpy.float64), False)
+
+  def visit_PlusNode(self, node):
+    return self.visit(node.node)
+
+  def visit_MinusNode(self, node):
+    column = self.visit_number(node.node)
+    return NumberColumn(-column.values, column.is_int)
+
+  def visit_AddNode(self, node):
+    a = self.visit_number(node.node_a)
+    b = self.visit_number(node.node_b)
+    return NumberColumn(a.values + b.values, a.is_int & b.is_int)
+
+  def visit_SubtractNode(self, node):
+    a = self.visit_number(node.node_a)
+    b = self.visit_number(node.node_b)
+    return NumberColumn(a.values - b.values, a.is_int & b.is_int)
+
+  def visit_MultiplyNode(self, node):
+    a = self.visit_number(node.node_a)
+    b = self.visit_number(node.node_b)
+    return NumberColumn(a.values * b.values, a.is_int & b.is_int)
+
+  def visit_DivideNode(self, node):
+    a = self.visit_number(node.node_a)
+    b = self.visit_number(node.node_b)
+
+    if self.numpy.any(b.values == 0):
+      raise Exception("Runtime math error")
+
+    quotient = a.values / b.values
+    return NumberColumn(quotient, (quotient % 1) == 0)
+
+  def visit_AverageNode(self, node):
+    a = self.visit_number(node.node_a)
+    b = self.visit_number(node.node_b)
+    total = a.values + b.values
+    return NumberColumn(total / 2, a.is_int & b.is_int & ((total % 2) == 0))
+
+  def visit_SquareNode(self, node):
+    column = self.visit_number(node.node)
+    return NumberColumn(column.values * column.values, column.is_int)
+
+  def visit_SquareRootNode(self, node):
+    column = self.visit_number(node.node)
+
+    if self.numpy.any(column.values < 0):
+      raise Exception('Error: sqrt of a negative number can not be evaluated in a batch.')
+
+    answer = self.numpy.power(column.values.astype(self.numpy.float64), 0.5)
+    return NumberColumn(answer, column.is_int & ((answer % 1) == 0))
+
+  def visit_AbsoluteValueNode(self, node):
+    column = self.visit_number(node.node)
+    return NumberColumn(self.numpy.abs(column.values), column.is_int)
+
+  def visit_CeilNode(self, node):
+    column = self.visit_number(node.node)
+    values = column.values
+    whole = self.numpy.trunc(values)
+    rounded = self.numpy.where(((values % 1) == 0) | (values < 0), whole, whole + 1)
+    return NumberColumn(self.numpy.where(column.is_int, values, rounded), True)
+
+  def visit_FloorNode(self, node):
+    column = self.visit_number(node.node)
+    values = column.values
+    whole = self.numpy.trunc(values)
+    rounded = self.numpy.where(((values % 1) == 0) | (values > 0), whole, whole - 1)
+    return NumberColumn(self.numpy.where(column.is_int, values, rounded), True)
+
+  # The Interpreter gives nothing for NaN in ordering comparisons, which a
+  # boolean column can not hold.
+  def visit_comparison(self, node, compare, ordering=False):
+    x = self.visit_number(node.node_x)
+    y = self.visit_number(node.node_y)
+
+    if ordering and (self.numpy.any(self.numpy.isnan(x.values)) or self.numpy.any(self.numpy.isnan(y.values))):
+      raise Exception(f'Error: NaN in {node} can not be evaluated in a batch.')
+
+    return BooleanColumn(compare(x.values, y.values))
+
+  def visit_MathEqualNode(self, node):
+    return self.visit_comparison(node, operator.eq)
+
+  def visit_NotEqualNode(self, node):
+    return self.visit_comparison(node, operator.ne)
+
+  def visit_GreaterThanNode(self, node):
+    return self.visit_comparison(node, operator.gt, True)
+
+  def visit_LessThanNode(self, node):
+    return self.visit_comparison(node, operator.lt, True)
+
+  def visit_GreaterThanEqualNode(self, node):
+    return self.visit_comparison(node, operator.ge, True)
+
+  def visit_LessThanEqualNode(self, node):
+    return self.visit_comparison(node, operator.le, True)
+
+  def visit_TypeEqualNode(self, node):
+    x = self.visit_number(node.node_x)
+    y = self.visit_number(node.node_y)
+    same_type = self.numpy.equal(x.is_int, y.is_int)
+    return BooleanColumn(same_type & (x.values == y.values))
+
+  def visit_TypeNotEqualNode(self, node):
+    x = self.visit_number(node.node_x)
+    y = self.visit_number(node.node_y)
+    same_type = self.numpy.equal(x.is_int, y.is_int)
+    return BooleanColumn(self.numpy.logical_not(same_type & (x.values == y.values)))
+
+  def visit_NumberTypeNode(self, node):
+    self.visit_number(node.node)
+    return BooleanColumn(self.numpy.asarray(True))
+
+  def visit_IntegerTypeNode(self, node):
+    column = self.visit_number(node.node)
+    return BooleanColumn(self.numpy.asarray(column.is_int))
+
+  def visit_FloatTypeNode(self, node):
+    column = self.visit_number(node.node)
+    return BooleanColumn(self.numpy.logical_not(column.is_int))
+
+  def visit_EvenCheckNode(self, node):
+    column = self.visit_number(node.node)
+    return BooleanColumn((column.values % 2) == 0)
+
+  def visit_OddCheckNode(self, node):
+    column = self.visit_number(node.node)
+    return BooleanColumn((column.values % 2) != 0)
+
+  def visit_StringTypeNode(self, node):
+    self.visit_number(node.node)
+    return BooleanColumn(self.numpy.asarray(False))
+
+  def visit_boolean(self, node):
+    column = self.visit(node)
+    if not isinstance(column, BooleanColumn):
+      raise Exception(f'Error: {node} is not True or False.')
+    return column
+
+  # Evaluates node only for the rows where mask is True, so rows that a
+  # conditional or boolean operator does not take can not fail.
+  def visit_rows(self, node, mask):
+    rows = {name: self.numpy.broadcast_to(values, self.shape)[mask] for name, values in self.variables.items()}
+    return VectorInterpreter(rows).visit(node)
+
+  def row_mask(self, column):
+    return self.numpy.broadcast_to(column.values, self.shape)
+
+  # The right operand is only evaluated for the rows the left one does not
+  # decide on its own, like the Interpreter does for a single row.
+  def visit_short_circuit(self, node, short_value, negate):
+    x = self.row_mask(self.visit_boolean(node.node_x))
+    undecided = x != short_value
+    y = self.visit_rows(node.node_y, undecided)
+    if not isinstance(y, BooleanColumn):
+      raise Exception(f'Error: {node.node_y} is not True or False.')
+
+    values = self.numpy.full(self.shape, short_value)
+    values[undecided] = y.values
+    return BooleanColumn(self.numpy.logical_not(values) if negate else values)
+
+  def visit_AndBooleanNode(self, node):
+    return self.visit_short_circuit(node, False, False)
+
+  def visit_NandBooleanNode(self, node):
+    return self.visit_short_circuit(node, False, True)
+
+  def visit_OrBooleanNode(self, node):
+    return self.visit_short_circuit(node, True, False)
+
+  def visit_XorBooleanNode(self, node):
+    x = self.visit_boolean(node.node_x)
+    y = self.visit_boolean(node.node_y)
+    return BooleanColumn(self.numpy.logical_xor(x.values, y.values))
+
+  def visit_NorBooleanNode(self, node):
+    return self.visit_short_circuit(node, True, True)
+
+  def visit_NotBooleanNode(self, node):
+    return BooleanColumn(self.numpy.logical_not(self.visit_boolean(node.node).values))
+
+  def visit_ConditionalNode(self, node):
+    if node.condition == None:
+      return self.visit_unsupported(node)
+
+    condition = self.row_mask(self.visit_boolean(node.condition))
+    otherwise = self.numpy.logical_not(condition)
+    node_true = self.visit_rows(node.node_true, condition)
+    node_false = self.visit_rows(node.node_false, otherwise)
+
+    if isinstance(node_true, NumberColumn) and isinstance(node_false, NumberColumn):
+      values = self.numpy.empty(self.shape, self.numpy.result_type(node_true.values, node_false.values))
+      values[condition] = node_true.values
+      values[otherwise] = node_false.values
+      is_int = self.numpy.empty(self.shape, bool)
+      is_int[condition] = node_true.is_int
+      is_int[otherwise] = node_false.is_int
+      return NumberColumn(values, is_int)
+    elif isinstance(node_true, BooleanColumn) and isinstance(node_false, BooleanColumn):
+      values = self.numpy.empty(self.shape, bool)
+      values[condition] = node_true.values
+      values[otherwise] = node_false.values
+      return BooleanColumn(values)
+    raise Exception(f'Error: the branches of {node} are not the same kind of value.')
+
+def evaluate_batch(text, variables):
+  import numpy
+
+  tree = expression_cache.get(text).tree
+  if tree == None:
+    return None
+
+  shape = numpy.broadcast_shapes(*[numpy.shape(values) for values in variables.values()])
+  return VectorInterpreter(variables).visit(tree).broadcast(shape)
+
+# Rule Index #
+
+# Each comparison of a variable with a number allows one interval of values,
+# kept as (low, low_closed, high, high_closed). != allows two. Infinite ends
+# are closed, since infinite values compare like any other number.
+interval_comparisons = {
+  GreaterThanNode: lambda number: [(number, False, float('inf'), True)],
+  GreaterThanEqualNode: lambda number: [(number, True, float('inf'), True)],
+  LessThanNode: lambda number: [(float('-inf'), True, number, False)],
+  LessThanEqualNode: lambda number: [(float('-inf'), True, number, True)],
+  MathEqualNode: lambda number: [(number, True, number, True)],
+  NotEqualNode: lambda number: [(float('-inf'), True, number, False), (number, False, float('inf'), True)]
+}
+
+# 5 < #x is the same as #x > 5.
+flipped_comparisons = {
+  GreaterThanNode: LessThanNode,
+  GreaterThanEqualNode: LessThanEqualNode,
+  LessThanNode: GreaterThanNode,
+  LessThanEqualNode: GreaterThanEqualNode,
+  MathEqualNode: MathEqualNode,
+  NotEqualNode: NotEqualNode
+}
+
+rule_depth_limit = 64
+rule_clause_limit = 64
+
+def is_rule_variable(node):
+  return isinstance(node, (NumberSignNode, StringSignNode, ArraySignNode)) and node.value not in important_numbers
+
+def is_rule_number(node):
+  return type(node) in (IntNode, FloatNode) and node.value == node.value
+
+def interval_contains(interval, value):
+  low, low_closed, high, high_closed = interval
+  if not is_number(value):
+    return False
+  return (low < value or (low_closed and low == value)) and (value < high or (high_closed and value == high))
+
+def intersect_intervals(a, b):
+  low = a[:2] if a[0] > b[0] or (a[0] == b[0] and not a[1]) else b[:2]
+  high = a[2:] if a[2] < b[2] or (a[2] == b[2] and not a[3]) else b[2:]
+  if low[0] < high[0] or (low[0] == high[0] and low[1] and high[1]):
+    return low + high
+
+def intersect_clauses(a, b):
+  clause = dict(a)
+  for name, interval in b.items():
+    if name in clause:
+      interval = intersect_intervals(clause[name], interval)
+      if interval == None:
+        return None
+    clause[name] = interval
+  return clause
+
+# Turns a rule built from comparisons of one variable with one number,
+# combined by and/or, into a list of clauses, each a dict of variable names
+# to intervals. The rule is True when every interval of any one clause holds.
+# Returns None for anything else.
+def rule_clauses(node, names, depth=0):
+  if depth > rule_depth_limit:
+    return None
+
+  if isinstance(node, (AndBooleanNode, OrBooleanNode)):
+    clauses_x = rule_clauses(node.node_x, names, depth + 1)
+    clauses_y = rule_clauses(node.node_y, names, depth + 1)
+    if clauses_x == None or clauses_y == None:
+      return None
+
+    if isinstance(node, OrBooleanNode):
+      clauses = clauses_x + clauses_y
+    else:
+      clauses = [clause for clause in (intersect_clauses(a, b) for a in clauses_x for b in clauses_y) if clause != None]
+    return clauses if len(clauses) <= rule_clause_limit else None
+
+  node_class = type(node)
+  if node_class not in interval_comparisons:
+    return None
+
+  if is_rule_variable(node.node_x) and is_rule_number(node.node_y):
+    name, number = node.node_x.value, node.node_y.value
+  elif is_rule_number(node.node_x) and is_rule_variable(node.node_y):
+    name, number = node.node_y.value, node.node_x.value
+    node_class = flipped_comparisons[node_class]
+  else:
+    return None
+
+  names.add(name)
+  return [{name: interval} for interval in interval_comparisons[node_class](number)]
+
+@dataclass(slots=True)
+class IntervalTreeNode:
+  center: any
+  by_low: list
+  by_high: list
+  left: any = None
+  right: any = None
+
+# A centered interval tree over (low, low_closed, high, high_closed, item)
+# entries. Every node keeps the intervals around its center sorted by both
+# ends, so a lookup walks one path and stops scanning at the first interval
+# that misses the value.
+class IntervalTree:
+  def __init__(self, entries):
+    self.root = None
+    pending = [(entries, None, None)] if entries else []
+
+    while pending:
+      entries, parent, side = pending.pop()
+      bounds = sorted(bound for entry in entries for bound in (entry[0], entry[2]) if abs(bound) != float('inf'))
+      if not bounds:
+        bounds = sorted(bound for entry in entries for bound in (entry[0], entry[2]))
+      center = bounds[len(bounds) // 2]
+      here, left, right = [], [], []
+      for entry in entries:
+        if entry[2] < center:
+          left.append(entry)
+        elif entry[0] > center:
+          right.append(entry)
+        else:
+          here.append(entry)
+
+      node = IntervalTreeNode(
+        center,
+        sorted(here, key=lambda entry: (entry[0], not entry[1])),
+        sorted(here, key=lambda entry: (-entry[2], not entry[3]))
+      )
+      if parent == None:
+        self.root = node
+      else:
+        setattr(parent, side, node)
+
+      if left:
+        pending.append((left, node, 'left'))
+      if right:
+        pending.append((right, node, 'right'))
+
+  def query(self, value, found):
+    node = self.root
+    while node != None:
+      if value < node.center:
+        for low, low_closed, high, high_closed, item in node.by_low:
+          if low > value or (low == value and not low_closed):
+            break
+          found.append(item)
+        node = node.left
+      elif value > node.center:
+        for low, low_closed, high, high_closed, item in node.by_high:
+          if high < value or (high == value and not high_closed):
+            break
+          found.append(item)
+        node = node.right
+      else:
+        for low, low_closed, high, high_closed, item in node.by_low:
+          if (low < value or low_closed) and (high > value or high_closed):
+            found.append(item)
+        break
+
+# Finds the rules that are True for one set of variables without evaluating
+# every rule. Rules over numbers and variables made only of comparisons,
+# and and or are split into clauses and every clause is put into an interval
+# tree of its first variable. Other rules are evaluated for every match. A
+# rule whose variables are not all numbers is evaluated too, since a missing
+# value makes and/or return nothing instead of False.
+class RuleIndex:
+  def __init__(self, rules=None, lexer=FastLexer, parser=PrattParser):
+    self.lexer = lexer
+    self.parser = parser
+    self.texts = {}
+    self.clauses = []
+    self.rule_variables = {}
+    self.variable_rules = {}
+    self.fallback = {}
+    self.expressions = {}
+    self.trees = None
+
+    if rules != None:
+      for rule_id, text in (rules.items() if hasattr(rules, 'items') else enumerate(rules)):
+        self.add(rule_id, text)
+
+  def __len__(self):
+    return len(self.texts)
+
+  def add(self, rule_id, text):
+    if rule_id in self.texts:
+      raise Exception(f'Rule {rule_id!r} was already added')
+
+    tree = self.parser(self.lexer(text).generate_tokens()).parse()
+    if tree_depth(tree) <= rule_depth_limit:
+      tree = Optimizer().optimize(tree)
+
+    names = set()
+    clauses = rule_clauses(tree, names)
+    self.texts[rule_id] = text
+
+    if clauses == None:
+      self.fallback[rule_id] = self.expression(rule_id)
+      return
+
+    self.rule_variables[rule_id] = tuple(names)
+    for name in names:
+      self.variable_rules.setdefault(name, set()).add(rule_id)
+    for clause in clauses:
+      self.clauses.append((rule_id, clause))
+    self.trees = None
+
+  def expression(self, rule_id):
+    expression = self.expressions.get(rule_id)
+    if expression == None:
+      expression = compile(self.texts[rule_id], self.lexer, self.parser)
+      self.expressions[rule_id] = expression
+    return expression
+
+  # A clause found in the tree of its first variable still has to check the
+  # intervals and numbers of the other variables.
+  def build(self):
+    entries = {}
+    self.checks = []
+    for index, (rule_id, clause) in enumerate(self.clauses):
+      name, interval = next(iter(clause.items()))
+      entries.setdefault(name, []).append(interval + (index,))
+      intervals = tuple((other, interval) for other, interval in clause.items() if other != name)
+      names = tuple(other for other in self.rule_variables[rule_id] if other != name)
+      self.checks.append((rule_id, intervals, names))
+    self.trees = {name: IntervalTree(variable_entries) for name, variable_entries in entries.items()}
+
+  def match(self, variables):
+    if self.trees == None:
+      self.build()
+
+    found = []
+    evaluated = set(self.fallback)
+    for name, value in variables.items():
+      tree = self.trees.get(name)
+      if tree == None or not is_number(value):
+        continue
+      elif value == value:
+        tree.query(value, found)
+      else:
+        evaluated.update(self.variable_rules[name])
+
+    matched = set()
+    checks = self.checks
+    for index in found:
+      rule_id, intervals, names = checks[index]
+      if rule_id in evaluated:
+        continue
+      elif intervals and not all(interval_contains(interval, variables.get(name)) for name, interval in intervals):
+        continue
+      elif names and not all(is_number(value) and value == value for value in map(variables.get, names)):
+        evaluated.add(rule_id)
+      else:
+        matched.add(rule_id)
+
+    for rule_id in evaluated:
+      if self.expression(rule_id).evaluate(variables) is True:
+        matched.add(rule_id)
+
+    return matched
+
+  def stats(self):
+    return {
+      'rules': len(self.texts),
+      'indexed': len(self.rule_variables),
+      'fallback': len(self.fallback),
+      'clauses': len(self.clauses)
+    }
+
+# Formula Sheet #
+
+variable_token_types = (TokenType.NUMBER_VAR, TokenType.STRING_VAR, TokenType.ARRAY_VAR)
+
+# Formulas that only differ in their variable names, like one formula filled
+# down a column, have the same shape: their tokens with every variable
+# replaced by a placeholder numbered in order of first appearance.
+def formula_shape(tokens):
+  placeholders = {}
+  shape = []
+  for token in tokens:
+    if token.type in variable_token_types and token.value not in important_numbers:
+      placeholder = placeholders.setdefault(token.value, f'{token.value[0]}{len(placeholders)}')
+      shape.append((token.type, placeholder))
+    else:
+      shape.append((token.type, token.value))
+  return tuple(shape), placeholders
+
+def same_value(value_a, value_b):
+  return type(value_a) == type(value_b) and value_a == value_b
+
+# Cells are #name variables holding either a value or a formula over other
+# cells. Every formula keeps the names it reads and every cell the formulas
+# that read it, so a change only recomputes the formulas downstream of it, in
+# topological order, and stops where a recomputed value did not change. A
+# formula that fails holds its exception as the value.
+class FormulaSheet:
+  def __init__(self, formulas=None, values=None, lexer=FastLexer, parser=PrattParser):
+    self.lexer = lexer
+    self.parser = parser
+    self.shapes = {}
+    self.values = dict(values) if values != None else {}
+    self.formulas = {}
+    self.dependents = {}
+    self.evaluations = 0
+
+    if formulas:
+      for name, text in formulas.items():
+        self.formulas[name] = self.compile(text)
+        self.values.pop(name, None)
+      for name, (function, names) in self.formulas.items():
+        for dependency in names:
+          self.dependents.setdefault(dependency, []).append(name)
+      self.recalculate()
+
+  def __getitem__(self, name):
+    return self.values[name]
+
+  def compile(self, text):
+    shape, placeholders = formula_shape(self.lexer(text).generate_tokens())
+    expression = self.shapes.get(shape)
+
+    if expression == None:
+      tree = self.parser([Token(token_type, value) for token_type, value in shape]).parse()
+      if tree_depth(tree) <= closure_depth_limit:
+        tree = Optimizer().optimize(tree)
+      expression = compile_tree(tree, text)
+      self.shapes[shape] = expression
+
+    names = {placeholder: name for name, placeholder in placeholders.items()}
+    return expression.function, tuple(names[placeholder] for placeholder in expression.variable_names)
+
+  def evaluate(self, name):
+    function, names = self.formulas[name]
+    values = self.values
+    self.evaluations += 1
+    try:
+      return function([values.get(dependency, dependency) for dependency in names])
+    except Exception as error:
+      return error
+
+  def store(self, name, value, changed):
+    if not same_value(self.values.get(name, name), value):
+      self.values[name] = value
+      changed.add(name)
+
+  def set_formula(self, name, text):
+    formula = self.compile(text)
+    self.check_cycle(name, formula[1])
+
+    if name in self.formulas:
+      self.remove_formula(name)
+    self.formulas[name] = formula
+    for dependency in formula[1]:
+      self.dependents.setdefault(dependency, []).append(name)
+
+    changed = set()
+    self.store(name, self.evaluate(name), changed)
+    self.recompute(self.downstream(changed), changed)
+    return changed
+
+  def set_value(self, name, value):
+    return self.update({name: value})
+
+  # Sets the values of several cells at once and returns the names of every
+  # cell whose value changed.
+  def update(self, values):
+    changed = set()
+    for name, value in values.items():
+      if name in self.formulas:
+        self.remove_formula(name)
+      self.store(name, value, changed)
+
+    self.recompute(self.downstream(changed), changed)
+    return changed
+
+  def remove_formula(self, name):
+    for dependency in self.formulas.pop(name)[1]:
+      self.dependents[dependency].remove(name)
+
+  def check_cycle(self, name, names):
+    parents = {dependency: name for dependency in names}
+    pending = list(names)
+
+    while pending:
+      cell = pending.pop()
+      if cell == name:
+        cycle = [name]
+        cell = parents[name]
+        while cell != name:
+          cycle.append(cell)
+          cell = parents[cell]
+        cycle.append(name)
+        raise Exception(f"Cycle in formula sheet: {' -> '.join(reversed(cycle))}")
+
+      if cell in self.formulas:
+        for dependency in self.formulas[cell][1]:
+          if dependency not in parents:
+            parents[dependency] = cell
+            pending.append(dependency)
+
+  def downstream(self, names):
+    dirty = set()
+    pending = list(names)
+    while pending:
+      for dependent in self.dependents.get(pending.pop(), ()):
+        if dependent not in dirty:
+          dirty.add(dependent)
+          pending.append(dependent)
+    return dirty
+
+  def recalculate(self):
+    return self.recompute(self.formulas, set(), True)
+
+  # Kahn's algorithm over the dirty formulas: a formula is ready once none of
+  # the dirty formulas it reads are still waiting. Without force, a formula
+  # is only evaluated again when something it reads changed.
+  def recompute(self, dirty, changed, force=False):
+    formulas = self.formulas
+    waiting = {}
+    ready = []
+
+    for name in dirty:
+      count = sum(1 for dependency in formulas[name][1] if dependency in dirty)
+      if count:
+        waiting[name] = count
+      else:
+        ready.append(name)
+
+    while ready:
+      name = ready.pop()
+      if force or any(dependency in changed for dependency in formulas[name][1]):
+        self.store(name, self.evaluate(name), changed)
+
+      for dependent in self.dependents.get(name, ()):
+        if dependent in waiting:
+          waiting[dependent] -= 1
+          if waiting[dependent] == 0:
+            del waiting[dependent]
+            ready.append(dependent)
+
+    if waiting:
+      raise Exception(f"Cycle in formula sheet: {' -> '.join(self.find_cycle(waiting))}")
+    return changed
+
+  # Every formula left waiting reads another one that is waiting, so
+  # following those reads from any of them runs into a cycle.
+  def find_cycle(self, waiting):
+    path = [next(iter(waiting))]
+    seen = {path[0]: 0}
+    while True:
+      cell = next(dependency for dependency in self.formulas[path[-1]][1] if dependency in waiting)
+      if cell in seen:
+        return path[seen[cell]:] + [cell]
+      seen[cell] = len(path)
+      path.append(cell)
+
+# Parallel Evaluation #
+
+@dataclass
+class ParallelResult:
+  results: list
+  workers: dict
+
+  def report(self):
+    lines = [f"{'worker':>10} {'items':>12} {'seconds':>10} {'items/s':>12}"]
+    for pid, stats in sorted(self.workers.items()):
+      per_second = stats['items'] / stats['seconds'] if stats['seconds'] else 0
+      lines.append(f"{pid:>10} {stats['items']:>12} {stats['seconds']:>10.3f} {per_second:>12.0f}")
+    return '\n'.join(lines)
+
+def evaluate_or_error(function, *args):
+  try:
+    return function(*args)
+  except Exception as error:
+    return error
+
+def evaluate_text_chunk(texts):
+  start = time.perf_counter()
+  results = [evaluate_or_error(expression_cache.evaluate, text) for text in texts]
+  return os.getpid(), len(texts), time.perf_counter() - start, results
+
+# Trees of deep expressions are too deep to pickle, so workers get the text
+# and compile it once through their own cache.
+def evaluate_bindings_chunk(text, bindings):
+  start = time.perf_counter()
+  expression = expression_cache.get(text)
+  results = [evaluate_or_error(expression.evaluate, variables) for variables in bindings]
+  return os.getpid(), len(bindings), time.perf_counter() - start, results
+
+# Workers that are spawned rather than forked start with no functions.
+def install_functions(functions):
+  user_functions.update(functions)
+
+def run_parallel(function, chunks, workers):
+  workers = workers or os.cpu_count()
+  results = []
+  worker_stats = {}
+
+  def collect(future):
+    pid, items, seconds, chunk_results = future.result()
+    stats = worker_stats.setdefault(pid, {'items': 0, 'seconds': 0.0})
+    stats['items'] += items
+    stats['seconds'] += seconds
+    results.extend(chunk_results)
+
+  with ProcessPoolExecutor(workers, initializer=install_functions, initargs=(dict(user_functions),)) as executor:
+    pending = deque()
+    for chunk in chunks:
+      pending.append(executor.submit(function, *chunk))
+      if len(pending) >= workers * 2:
+        collect(pending.popleft())
+    while pending:
+      collect(pending.popleft())
+
+  return ParallelResult(results, worker_stats)
+
+def chunked(items, chunk_size):
+  items = iter(items)
+  while True:
+    chunk = list(islice(items, chunk_size))
+    if not chunk:
+      return
+    yield chunk
+
+def evaluate_parallel(texts, workers=None, chunk_size=1000):
+  chunks = ((chunk,) for chunk in chunked(texts, chunk_size))
+  return run_parallel(evaluate_text_chunk, chunks, workers)
+
+def evaluate_parallel_bindings(text, bindings, workers=None, chunk_size=1000):
+  # Syntax errors are raised here, before any worker starts.
+  expression_cache.get(text)
+  chunks = ((text, chunk) for chunk in chunked(bindings, chunk_size))
+  return run_parallel(evaluate_bindings_chunk, chunks, workers)
+
+# Profiling #
+
+# Times every visit_* call, including the visits of its children. Only used
+# by Profile, so the plain Interpreter pays nothing for it. Recursive visits
+# go through dispatch as well, and a visit the walk runs again after one of
+# its children is counted once, timed from its first start.
+class ProfilingInterpreter(Interpreter):
+  def __init__(self, profile, variables=None, numbers=float_numbers):
+    super().__init__(variables, numbers)
+    self.visit_calls = profile.visit_calls
+    self.visit_seconds = profile.visit_seconds
+    self.started = {}
+
+  def visit(self, node):
+    if self.results != None or self.depth >= interpreter_depth_limit:
+      return super().visit(node)
+
+    self.depth += 1
+    try:
+      return self.dispatch(node)
+    finally:
+      self.depth -= 1
+
+  def dispatch(self, node):
+    method_name = f'visit_{type(node).__name__}'
+    start = self.started.pop(id(node), None)
+    if start == None:
+      start = time.perf_counter()
+    try:
+      return getattr(self, method_name)(node)
+    except PendingVisit:
+      self.started[id(node)] = start
+      start = None
+      raise
+    finally:
+      if start != None:
+        self.visit_seconds[method_name] = self.visit_seconds.get(method_name, 0.0) + time.perf_counter() - start
+        self.visit_calls[method_name] = self.visit_calls.get(method_name, 0) + 1
+
+class Profile:
+  def __init__(self, lexer=FastLexer, parser=PrattParser, numbers=float_numbers):
+    self.lexer = lexer
+    self.parser = parser
+    self.numbers = numbers
+    self.expressions = 0
+    self.stage_calls = {'lex': 0, 'parse': 0, 'interpret': 0}
+    self.stage_seconds = {'lex': 0.0, 'parse': 0.0, 'interpret': 0.0}
+    self.token_counts = {}
+    self.node_counts = {}
+    self.visit_calls = {}
+    self.visit_seconds = {}
+
+  def timed(self, stage, function, *args):
+    start = time.perf_counter()
+    try:
+      return function(*args)
+    finally:
+      self.stage_seconds[stage] += time.perf_counter() - start
+      self.stage_calls[stage] += 1
+
+  def count_nodes(self, tree):
+    pending = [tree]
+    while pending:
+      node = pending.pop()
+      node_name = type(node).__name__
+      self.node_counts[node_name] = self.node_counts.get(node_name, 0) + 1
+      pending.extend(child_nodes(node))
+
+  def evaluate(self, text, variables=None):
+    self.expressions += 1
+    tokens = self.timed('lex', lambda: list(self.lexer(text, self.numbers.parse).generate_tokens()))
+    for token in tokens:
+      self.token_counts[token.type.name] = self.token_counts.get(token.type.name, 0) + 1
+
+    tree = self.timed('parse', lambda: self.parser(tokens).parse())
+    if tree == None:
+      return None
+
+    self.count_nodes(tree)
+    with self.numbers.context():
+      return result_value(self.timed('interpret', ProfilingInterpreter(self, variables, self.numbers).visit, tree))
+
+  def to_dict(self):
+    return {
+      'expressions': self.expressions,
+      'stages': {stage: {'calls': self.stage_calls[stage], 'seconds': self.stage_seconds[stage]} for stage in self.stage_seconds},
+      'tokens': dict(self.token_counts),
+      'nodes': dict(self.node_counts),
+      'visits': {name: {'calls': self.visit_calls[name], 'seconds': self.visit_seconds[name]} for name in self.visit_calls}
+    }
+
+  def to_json(self):
+    return json.dumps(self.to_dict(), indent=2)
+
+  def summary(self):
+    lines = [f'{self.expressions} expressions', '', f"{'stage':24} {'calls':>10} {'total ms':>12} {'mean us':>10}"]
+    for stage, seconds in self.stage_seconds.items():
+      calls = self.stage_calls[stage]
+      lines.append(f'{stage:24} {calls:10} {seconds * 1000:12.3f} {seconds / max(calls, 1) * 1000000:10.2f}')
+
+    lines += ['', f"{'token':24} {'count':>10}"]
+    lines += [f'{name:24} {count:10}' for name, count in sorted(self.token_counts.items(), key=lambda item: -item[1])]
+    lines += ['', f"{'node':24} {'count':>10}"]
+    lines += [f'{name:24} {count:10}' for name, count in sorted(self.node_counts.items(), key=lambda item: -item[1])]
+    lines += ['', f"{'visit method':24} {'calls':>10} {'cumulative ms':>14}"]
+    for name, seconds in sorted(self.visit_seconds.items(), key=lambda item: -item[1]):
+      lines.append(f'{name:24} {self.visit_calls[name]:10} {seconds * 1000:14.3f}')
+
+    return '\n'.join(lines)
+
+# Server #
+
+def evaluate_line(line, evaluate_text=evaluate):
+  try:
+    value = evaluate_text(line.rstrip('\r\n'))
+    return '' if value == None else f'{value}'
+  except Exception as error:
+    return f'Error: {error}'
+
+def evaluate_lines(lines):
+  return ''.join([f"{evaluate_line(line.decode(errors='replace'))}\n" for line in lines]).encode()
+
+# Every request is one expression ending in a newline and every response is
+# one line, in request order. Clients may pipeline requests without waiting:
+# whatever has arrived is evaluated as one batch, and nothing more is read
+# until its responses have drained, so slow readers get backpressure instead
+# of an ever growing write buffer. Batches are evaluated on the executor, so
+# a slow batch never stops the event loop from serving other connections.
+async def serve_connection(reader, writer, read_size=65536, line_limit=1024 * 1024, executor=None):
+  loop = asyncio.get_running_loop()
+  pending = b''
+
+  try:
+    while True:
+      chunk = await reader.read(read_size)
+      if not chunk:
+        break
+
+      lines = (pending + chunk).split(b'\n')
+      pending = lines.pop()
+      too_long = len(pending) > line_limit
+      for index, line in enumerate(lines):
+        if len(line) > line_limit:
+          del lines[index:]
+          too_long = True
+          break
+
+      if lines:
+        writer.write(await loop.run_in_executor(executor, evaluate_lines, lines))
+        await writer.drain()
+
+      if too_long:
+        writer.write(b'Error: Line too long\n')
+        await writer.drain()
+        pending = b''
+        break
+
+    if pending:
+      writer.write(await loop.run_in_executor(executor, evaluate_lines, [pending]))
+      await writer.drain()
+  except ConnectionError:
+    pass
+  finally:
+    writer.close()
+    try:
+      await writer.wait_closed()
+    except ConnectionError:
+      pass
+
+async def serve(host='127.0.0.1', port=7341, path=None):
+  # The caches and memos are shared by every connection and are not thread
+  # safe, so all evaluation happens on one thread.
+  with ThreadPoolExecutor(1) as executor:
+    handle = partial(serve_connection, executor=executor)
+    if path != None:
+      server = await asyncio.start_unix_server(handle, path)
+    else:
+      server = await asyncio.start_server(handle, host, port)
+
+    address = path if path != None else f'{host}:{port}'
+    print(f'McFly is serving on {address}', file=sys.stderr, flush=True)
+
+    async with server:
+      await server.serve_forever()
+
 # Run #
 
-while True:
-  text = input("Enter a math function: ")
-  lexer = Lexer(text)
-  tokens = lexer.generate_tokens()
-  parser = Parser(tokens)
-  tree = parser.parse()
-  if not tree: continue
-  interpreter = Interpreter()
-  value = interpreter.visit(tree)
-  print(tree)
-  print(value)
\ No newline at end of file
+def run():
+  while True:
+    text = input("Enter a math function: ")
+    lexer = FastLexer(text)
+    tokens = lexer.generate_tokens()
+    parser = PrattParser(tokens)
+    tree = parser.parse()
+    if not tree: continue
+    interpreter = Interpreter()
+    value = interpreter.visit(tree)
+    print(tree)
+    print(value)
+
+# Most lines of a file are only seen once, and interpreting a line costs
+# less than compiling it. Streams compile a line once it repeats.
+stream_tier_threshold = 1
+
+def evaluate_stream(lines, output, batch_size=1000, evaluate_text=None):
+  if evaluate_text == None:
+    evaluate_text = ExpressionCache(threshold=stream_tier_threshold).evaluate
+  results = []
+
+  for line in lines:
+    results.append(evaluate_line(line, evaluate_text))
+
+    if len(results) >= batch_size:
+      output.write('\n'.join(results) + '\n')
+      results.clear()
+
+  if results:
+    output.write('\n'.join(results) + '\n')
+
+def main(args=None):
+  arg_parser = argparse.ArgumentParser(description='McFly')
+  arg_parser.add_argument('--file', help='evaluate one expression per line of FILE (- for stdin) instead of starting the prompt')
+  arg_parser.add_argument('--profile', action='store_true', help='with --file, time every stage and visit_* method and print a summary to stderr')
+  arg_parser.add_argument('--profile-json', metavar='PATH', help='with --file, write the profile as JSON to PATH')
+  arg_parser.add_argument('--numbers', choices=['float', 'fraction', 'decimal'], default='float', help='with --file, the numbers backend for non-integer values')
+  arg_parser.add_argument('--precision', type=int, help='significant digits of decimal numbers and of irrational fraction results')
+  arg_parser.add_argument('--serve', metavar='[HOST:]PORT', help='answer expression lines over TCP instead of starting the prompt')
+  arg_parser.add_argument('--unix', metavar='PATH', help='answer expression lines over a Unix socket at PATH')
+  arg_parser.add_argument('--tier-threshold', type=int, metavar='N', help='interpret every expression until it ran N times, then compile it')
+  options = arg_parser.parse_args(args)
+
+  # Profiles and the fraction and decimal backends always interpret.
+  if options.tier_threshold != None and (options.profile or options.profile_json or options.numbers != 'float'):
+    arg_parser.error('--tier-threshold can not be used with --profile, --profile-json or --numbers fraction|decimal')
+
+  if options.tier_threshold != None:
+    expression_cache.threshold = options.tier_threshold
+
+  if options.serve != None or options.unix != None:
+    host, _, port = (options.serve or '').rpartition(':')
+    try:
+      asyncio.run(serve(host or '127.0.0.1', int(port or 7341), options.unix))
+    except KeyboardInterrupt:
+      pass
+  elif options.file == None:
+    run()
+  else:
+    numbers = float_numbers
+    if options.numbers == 'fraction':
+      numbers = FractionNumbers(options.precision or 50)
+    elif options.numbers == 'decimal':
+      numbers = DecimalNumbers(options.precision or 28)
+
+    profile = Profile(numbers=numbers) if options.profile or options.profile_json else None
+    if profile != None:
+      evaluate_text = profile.evaluate
+    elif numbers != float_numbers:
+      evaluate_text = lambda text: interpret(text, numbers=numbers)
+    else:
+      threshold = stream_tier_threshold if options.tier_threshold == None else options.tier_threshold
+      evaluate_text = ExpressionCache(threshold=threshold).evaluate
+
+    if options.file == '-':
+      evaluate_stream(sys.stdin, sys.stdout, evaluate_text=evaluate_text)
+    else:
+      with open(options.file, buffering=1024 * 1024) as lines:
+        evaluate_stream(lines, sys.stdout, evaluate_text=evaluate_text)
+
+    if options.profile:
+      print(profile.summary(), file=sys.stderr)
+    if options.profile_json:
+      with open(options.profile_json, 'w') as file:
+        file.write(profile.to_json())
+
+if __name__ == '__main__':
+  main()
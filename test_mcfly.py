@@ -0,0 +1,567 @@
+import asyncio
+from functools import partial
+import io
+import json
+import math
+import multiprocessing
+import pickle
+import random
+
+import pytest
+
+import mcfly
+
+binary_operators = ['+', '-', '*', '/', '===', '>', '<', '>=', '<=', '!=', '!==', '==', 'and', 'or', 'xor', 'nand', 'nor', 'avg']
+prefix_operators = ['-', '+', 'num?', 'int?', 'not', 'sq', 'sqrt', 'abs', 'ceil', 'floor', 'even?', 'str?', 'float?', 'odd?']
+atoms = ['1', '2', '0', '7', '2.5', '0.0', '4.0', '#pi', '#e', '#x', '$s', '@a', '"x"', 'True', 'False', 'fun', 'if', 'sum', 'hello']
+
+def random_expression(generator, depth=0):
+  choice = generator.random()
+  if depth > 4 or choice < 0.3:
+    return generator.choice(atoms)
+  elif choice < 0.5:
+    return f'{generator.choice(prefix_operators)} {random_expression(generator, depth + 1)}'
+  elif choice < 0.6:
+    return f'({random_expression(generator, depth + 1)})'
+  elif choice < 0.68:
+    return f'if ({random_expression(generator, depth + 1)}) ({random_expression(generator, depth + 1)}) ({random_expression(generator, depth + 1)})'
+  return f'{random_expression(generator, depth + 1)} {generator.choice(binary_operators)} {random_expression(generator, depth + 1)}'
+
+def random_expressions(seed, count):
+  generator = random.Random(seed)
+  return [random_expression(generator) for _ in range(count)]
+
+# Results and errors of two ways of doing the same thing, in a form that
+# compares equal when they agree. Python's own errors name whatever object
+# they failed on, so only their type is compared.
+def outcome(function, *args):
+  try:
+    value = function(*args)
+  except Exception as error:
+    return 'error', type(error).__name__, str(error) if type(error) in (Exception, mcfly.NoValueError) else None
+  if isinstance(value, float) and math.isnan(value):
+    return 'value', 'nan'
+  return 'value', type(value).__name__, value
+
+@pytest.fixture
+def functions():
+  saved = dict(mcfly.user_functions)
+  yield mcfly.define_function
+  mcfly.user_functions.clear()
+  mcfly.user_functions.update(saved)
+  mcfly.expression_cache.clear()
+
+# Fast Lexer #
+
+def token_list(lexer, text):
+  return [repr(token) for token in lexer(text).generate_tokens()]
+
+def test_fast_lexer_matches_lexer():
+  generator = random.Random(1)
+  characters = list(' \t\n0123456789.#$@"+-*/()=<>!?_xzTF\ré') + list(mcfly.keyword_tokens) * 3
+  texts = [''.join(generator.choice(characters) for _ in range(generator.randint(0, 30))) for _ in range(3000)]
+  texts += random_expressions(1, 1000)
+  for text in texts:
+    assert outcome(token_list, mcfly.FastLexer, text) == outcome(token_list, mcfly.Lexer, text), text
+
+# Pratt Parser #
+
+def parse_with(parser, text):
+  return parser(mcfly.Lexer(text).generate_tokens()).parse()
+
+def test_pratt_parser_matches_parser():
+  generator = random.Random(2)
+  for text in random_expressions(2, 3000):
+    if generator.random() < 0.1:
+      text = text[:generator.randint(0, len(text))]
+    pratt = outcome(parse_with, mcfly.PrattParser, text)
+    legacy = outcome(parse_with, mcfly.Parser, text)
+    assert pratt[0] == legacy[0], text
+    if pratt[0] == 'value':
+      assert pratt == legacy, text
+
+# Incremental Parsing #
+
+def full_parse(text):
+  try:
+    return mcfly.PrattParser(list(mcfly.FastLexer(text).generate_tokens())).parse(), None
+  except Exception as error:
+    return None, str(error)
+
+def incremental_result(parsed):
+  return parsed.tree, None if parsed.error == None else str(parsed.error)
+
+def test_incremental_parse_of_words_the_legacy_lexer_drops():
+  for text in ('no', '1 no 2', '1 + no', '(no) * 2', '(1=) 2.5"o'):
+    assert incremental_result(mcfly.parse_incremental(text)) == full_parse(text)
+  parsed = mcfly.parse_incremental('(1 + 2) * no').edit(10, 2, '3')
+  assert incremental_result(parsed) == full_parse('(1 + 2) * 3')
+
+def test_incremental_parse_counts_the_groups_it_reused():
+  parsed = mcfly.parse_incremental('((1+2)*(3+4)) + (5)')
+  parsed = parsed.edit(17, 1, '6')
+  assert str(parsed.tree) == '(((1+2)*(3+4))+6)'
+  assert parsed.reused_groups == 1
+
+def test_incremental_parse_after_random_edits_matches_full_parse():
+  generator = random.Random(11)
+  pieces = ['1', '(', ')', '+', ' ', 'and', 'no', '"', '#x', '2.5', '.', '=', 'sq ', '(1+2)', '*', '-', 'or', 'fun ']
+  for text in random_expressions(11, 300):
+    parsed = mcfly.parse_incremental(text)
+    for _ in range(5):
+      offset = generator.randint(0, len(text))
+      deleted = generator.randint(0, min(3, len(text) - offset))
+      inserted = ''.join(generator.choice(pieces) for _ in range(generator.randint(0, 2)))
+      parsed = parsed.edit(offset, deleted, inserted)
+      text = text[:offset] + inserted + text[offset + deleted:]
+      assert incremental_result(parsed) == full_parse(text), text
+
+# Numbers #
+
+def test_decimal_division_of_numbers_wider_than_the_precision():
+  numbers = mcfly.DecimalNumbers()
+  assert mcfly.interpret('100000000000000000000000000000000 / 4', numbers=numbers) == 25 * 10**30
+  assert mcfly.interpret('100000000000000000000000000000000 / 3', numbers=numbers) == 33333333333333333333333333330000
+  assert mcfly.interpret('ceil (100000000000000000000000000000000.0 / 3)', numbers=numbers) == 33333333333333333333333333330000
+
+def test_fraction_division_stays_exact():
+  numbers = mcfly.FractionNumbers()
+  assert mcfly.interpret('100000000000000000000000000000000 / 3', numbers=numbers) == mcfly.Fraction(10**32, 3)
+  assert mcfly.interpret('9 / 3', numbers=numbers) == 3
+
+# Type Inference #
+
+def test_type_errors():
+  assert mcfly.compile('1 + "abc"').type_errors == ('Type error in (1+"abc"): int and str operands',)
+  assert mcfly.compile('sq True').type_errors == ('Type error in sq True: True has no value to use',)
+  assert mcfly.compile('1 + not True').type_errors == ('Type error in (1+False): False has no value to use',)
+  assert mcfly.compile('(1 > 0) and 2', optimizer=None).type_errors == ('Type error in (1>0) and 2: operands must be True or False',)
+  assert mcfly.compile('1 + 2').type_errors == ()
+
+def test_declared_type_errors():
+  assert mcfly.compile('#x + 1', types={'#x': str}).type_errors == ('Type error in (#x+1): str and int operands',)
+  assert mcfly.compile('#x + 1', types={'#x': int}).type_errors == ()
+  assert mcfly.compile('#x + 1').type_errors == ()
+
+  inference = mcfly.TypeInference({'$s': str, '#x': float})
+  tree = mcfly.PrattParser(mcfly.FastLexer('($s + 1) * (#x - 2)').generate_tokens()).parse()
+  assert inference.infer(tree) == None
+  assert inference.errors == ['Type error in ($s+1): str and int operands']
+
+def test_type_errors_name_deep_nodes():
+  text = '+'.join(['1'] * deep_size) + ' + "abc"'
+  assert mcfly.compile(text).type_errors == ('Type error in AddNode nested too deep to show: int and str operands',)
+
+# Optimizer #
+
+def optimized(text):
+  return mcfly.Optimizer().optimize(mcfly.PrattParser(mcfly.FastLexer(text).generate_tokens()).parse())
+
+def test_optimizer_folds_constants():
+  assert optimized('1 + 2 * 3') == mcfly.IntNode(7)
+  assert optimized('6 / 3') == mcfly.IntNode(2)
+  assert optimized('7 / 2') == mcfly.FloatNode(3.5)
+  assert optimized('1.5 * 2') == mcfly.FloatNode(3.0)
+  assert optimized('abs -2.5') == mcfly.FloatNode(2.5)
+  assert optimized('#pi * 2') == mcfly.FloatNode(math.pi * 2)
+  assert optimized('#x + 1 * 2') == mcfly.AddNode(mcfly.NumberSignNode('#x'), mcfly.IntNode(2))
+  assert isinstance(optimized('str? "ab"'), mcfly.TrueNode)
+  assert isinstance(optimized('if (1 > 0) 2 3'), mcfly.IntNode)
+
+def test_optimizer_keeps_what_it_can_not_fold():
+  # Strings stay as they are, and so do operations that fail or give a
+  # complex number, so they still fail or give None at run time.
+  for text in ('"ab"', '1 + "ab"', '1 / 0', '2 > #x'):
+    tree = mcfly.PrattParser(mcfly.FastLexer(text).generate_tokens()).parse()
+    assert optimized(text) == tree
+  assert optimized('sqrt -1') == mcfly.SquareRootNode(mcfly.IntNode(-1))
+
+# Bytecode #
+
+def deep_shapes(size):
+  return {
+    'operator chain': ('+'.join(['1'] * size), size),
+    'nested parentheses': ('(' * size + '2.5' + ')' * size, 2.5),
+    'prefix chain': ('- ' * (size * 2) + '3', 3),
+    'right nested sums': ('(' * size + '1' + '+1)' * size, size + 1),
+    'nested variables': ('(' * size + '#x' + ' * 1)' * size, 7),
+    'boolean chain': (' and '.join(['#x > 1'] * size), True),
+    'not chain': ('not ' * size + '(#x > 1)', True),
+    'nested conditionals': ('if (#x > 1) (' * size + '#x' + ') (0)' * size, 7)
+  }
+
+deep_size = 5000
+deep_inputs = deep_shapes(deep_size)
+
+# The quicker shapes again at the size of the largest inputs.
+stress_size = 100000
+stress_inputs = {name: shape for name, shape in deep_shapes(stress_size).items()
+  if name in ('operator chain', 'nested parentheses', 'prefix chain', 'right nested sums', 'not chain')}
+
+@pytest.mark.parametrize('name', deep_inputs)
+def test_deep_inputs(name):
+  text, expected = deep_inputs[name]
+  variables = {'#x': 7}
+  assert mcfly.interpret(text, variables) == expected
+  assert mcfly.evaluate(text, variables=variables) == expected
+  expression = mcfly.compile(text)
+  assert expression.evaluate(variables) == expected
+  assert expression.interpret(variables) == expected
+  assert mcfly.compile_bytecode(text).evaluate(variables) == expected
+  tiered = mcfly.TieredExpression(text, 1)
+  assert [tiered.evaluate(variables) for _ in range(3)] == [expected] * 3
+  assert mcfly.parse_incremental(text).expression().evaluate(variables) == expected
+
+@pytest.mark.parametrize('name', stress_inputs)
+def test_stress_inputs(name):
+  text, expected = stress_inputs[name]
+  variables = {'#x': 7}
+  assert mcfly.interpret(text, variables) == expected
+  assert mcfly.compile(text).interpret(variables) == expected
+  assert mcfly.compile_bytecode(text).evaluate(variables) == expected
+
+@pytest.mark.parametrize('backend, sum_output', [('decimal', f'{deep_size // 10}.0'), ('fraction', f'{deep_size // 10}')])
+def test_deep_inputs_with_exact_numbers(backend, sum_output, tmp_path, capsys):
+  numbers = mcfly.DecimalNumbers() if backend == 'decimal' else mcfly.FractionNumbers()
+  for text, expected in deep_inputs.values():
+    assert mcfly.interpret(text, {'#x': 7}, numbers=numbers) == expected
+  assert mcfly.interpret('+'.join(['0.1'] * deep_size), numbers=numbers) == deep_size // 10
+
+  path = tmp_path / 'lines.txt'
+  path.write_text('+'.join(['0.1'] * deep_size) + '\n' + deep_inputs['right nested sums'][0] + '\n')
+  mcfly.main(['--file', str(path), '--numbers', backend])
+  assert capsys.readouterr().out == f'{sum_output}\n{deep_size + 1}\n'
+
+def test_deep_inputs_with_type_errors():
+  text = '+'.join(['#x'] * deep_size) + ' > 5'
+  expression = mcfly.compile(text)
+  assert expression.type_errors == ('Type error in AddNode nested too deep to show: (#x>5) has no value to use',)
+  assert outcome(expression.evaluate, {'#x': 1}) == outcome(mcfly.compile_bytecode(text).evaluate, {'#x': 1})
+
+def test_deep_function_bodies(functions):
+  functions('deep', ['#x'], '+'.join(['#x'] * deep_size))
+  assert mcfly.evaluate('1 + fun deep 2') == 2 * deep_size + 1
+  assert mcfly.compile_bytecode('fun deep #y').evaluate({'#y': 3}) == 3 * deep_size
+
+def test_every_path_raises_no_value_error(functions, tmp_path):
+  functions('twice', ['#x'], '#x * 2')
+  texts = ['sq (1 > 0)', '(True + 1) * 2', '($s + 1) * 2', 'fun twice ($s + 1)', '1 + not True']
+  path = tmp_path / 'catalog.bin'
+  mcfly.write_catalog(path, texts)
+  catalog = mcfly.BytecodeCatalog(path)
+  variables = {'$s': 'ab'}
+  for text in texts:
+    for evaluate in (
+      lambda: mcfly.interpret(text, variables),
+      lambda: mcfly.compile(text).evaluate(variables),
+      lambda: mcfly.compile(text, optimizer=None).evaluate(variables),
+      lambda: mcfly.compile_bytecode(text).evaluate(variables),
+      lambda: catalog.evaluate(text, variables)
+    ):
+      with pytest.raises(mcfly.NoValueError, match='no value to use'):
+        evaluate()
+
+# Bytecode Catalog #
+
+def test_catalog_rejects_a_redefined_function(functions, tmp_path):
+  path = tmp_path / 'catalog.bin'
+  functions('g', ['#x'], '#x * 2')
+  mcfly.write_catalog(path, ['fun g 2 + 1'])
+  assert mcfly.BytecodeCatalog(path).evaluate('fun g 2 + 1') == 5
+  functions('g', ['#x', '#y'], '#x * #y')
+  with pytest.raises(Exception, match='fun g was defined again'):
+    mcfly.BytecodeCatalog(path).evaluate('fun g 2 + 1')
+
+@pytest.mark.parametrize('field, value, message', [
+  ('version', mcfly.catalog_version - 1, 'Stale bytecode catalog format'),
+  ('checksum', mcfly.opcode_checksum() ^ 1, 'Stale bytecode catalog format'),
+  ('magic', b'NOTMCFLY', 'Not a McFly bytecode catalog')
+])
+def test_catalog_rejects_a_tampered_header(tmp_path, field, value, message):
+  path = tmp_path / 'catalog.bin'
+  mcfly.write_catalog(path, ['1 + 2'])
+  data = path.read_bytes()
+  header = dict(zip(('magic', 'version', 'checksum', 'count'), mcfly.catalog_header.unpack_from(data)))
+  assert mcfly.BytecodeCatalog(path).evaluate('1 + 2') == 3
+
+  header[field] = value
+  path.write_bytes(mcfly.catalog_header.pack(*header.values()) + data[mcfly.catalog_header.size:])
+  with pytest.raises(Exception, match=message):
+    mcfly.BytecodeCatalog(path)
+
+def test_catalog_rejects_a_truncated_file(tmp_path):
+  path = tmp_path / 'catalog.bin'
+  for data in (b'', b'MCFLYBC'):
+    path.write_bytes(data)
+    with pytest.raises(Exception, match='Not a McFly bytecode catalog'):
+      mcfly.BytecodeCatalog(path)
+
+# Tiered Execution #
+
+def test_tiers_agree_on_nan_comparisons():
+  nan = float('nan')
+  for text in ('#a > 2', 'not (#a > 2)', '#a <= 2 or 1 == 1', 'if (#a >= #b) 1 2', '#a == #b', '#a != #b'):
+    variables = {'#a': nan, '#b': 1.5}
+    interpreted = mcfly.interpret(text, variables)
+    assert mcfly.compile(text).evaluate(variables) == interpreted
+    assert mcfly.compile(text, types={'#a': float, '#b': float}).evaluate(variables) == interpreted
+    assert mcfly.compile_bytecode(text).evaluate(variables) == interpreted
+    expression = mcfly.TieredExpression(text, 2)
+    assert [expression.evaluate(variables) for _ in range(4)] == [interpreted] * 4
+    assert expression.tier == 'compiled'
+  assert mcfly.interpret('not (#a > 2)', {'#a': nan}) == None
+
+def test_tiered_expression_compiles_at_the_threshold():
+  expression = mcfly.TieredExpression('#x * 2', 3)
+  assert [expression.evaluate({'#x': x}) for x in range(3)] == [0, 2, 4]
+  assert expression.stats() == {'tier': 'interpreter', 'threshold': 3, 'calls': 3, 'interpreted_calls': 3, 'compiled_calls': 0}
+  assert [expression.evaluate({'#x': x}) for x in range(3, 5)] == [6, 8]
+  assert expression.stats() == {'tier': 'compiled', 'threshold': 3, 'calls': 5, 'interpreted_calls': 3, 'compiled_calls': 2}
+
+  assert mcfly.TieredExpression('1 + 1', 0).tier == 'compiled'
+  assert mcfly.TieredExpression(deep_inputs['operator chain'][0], 3).tier == 'compiled'
+
+  cache = mcfly.ExpressionCache(threshold=2)
+  for _ in range(3):
+    assert cache.evaluate('2 * 3') == 6
+  assert cache.tiers() == {'2 * 3': {'tier': 'compiled', 'threshold': 2, 'calls': 3, 'interpreted_calls': 2, 'compiled_calls': 1}}
+
+def test_evaluation_paths_agree():
+  generator = random.Random(3)
+  for text in random_expressions(3, 2000):
+    try:
+      expression = mcfly.compile(text)
+    except Exception:
+      continue
+    unoptimized = mcfly.compile(text, optimizer=None)
+    bytecode = mcfly.compile_bytecode(text)
+    tiered = mcfly.TieredExpression(text, 1)
+    variables = {
+      '#x': generator.choice([0, 3, -2, 2.5, 4.0, float('nan')]),
+      '$s': generator.choice(['ab', 7]),
+      '@a': generator.choice([1.5, 'q'])
+    }
+
+    interpreted = outcome(mcfly.interpret, text, variables)
+    assert outcome(expression.evaluate, variables) == interpreted, text
+    assert outcome(unoptimized.evaluate, variables) == interpreted, text
+    assert outcome(bytecode.evaluate, variables) == interpreted, text
+    assert [outcome(tiered.evaluate, variables) for _ in range(3)] == [interpreted] * 3, text
+
+# Expression Cache #
+
+def test_evaluate_keeps_lexer_and_parser_positional():
+  assert mcfly.evaluate('3 + 4 * 2', mcfly.Lexer) == 11
+  assert mcfly.evaluate('3 + 4 * 2', mcfly.Lexer, mcfly.Parser) == 11
+  assert mcfly.evaluate('#x * 2', mcfly.Lexer, variables={'#x': 4}) == 8
+
+def test_expression_cache_counts_hits_misses_and_evictions():
+  cache = mcfly.ExpressionCache(capacity=2)
+  assert cache.evaluate('1 + 1') == 2
+  assert cache.evaluate('2 * 3') == 6
+  assert cache.evaluate('1 + 1') == 2
+  assert cache.stats() == {'size': 2, 'capacity': 2, 'hits': 1, 'misses': 2, 'evictions': 0}
+
+  # '2 * 3' was used least recently, so it goes first.
+  assert cache.evaluate('#x - 1', {'#x': 5}) == 4
+  assert list(cache.expressions) == ['1 + 1', '#x - 1']
+  assert cache.evaluate('2 * 3') == 6
+  assert list(cache.expressions) == ['#x - 1', '2 * 3']
+  assert cache.stats() == {'size': 2, 'capacity': 2, 'hits': 1, 'misses': 4, 'evictions': 2}
+
+  expression = cache.get('#x - 1')
+  assert cache.get('#x - 1') is expression
+  assert cache.stats()['hits'] == 3
+
+# User Functions #
+
+def test_user_function_pickles_without_the_registry(functions):
+  functions('sq', ['#x'], '#x * #x')
+  functions('bigsq', ['#x'], '(fun sq #x) + 1000', memo_size=4)
+  tree = mcfly.expression_cache.get('fun bigsq #x').tree
+  mcfly.user_functions.clear()
+  copy = pickle.loads(pickle.dumps(tree))
+  assert copy.function.memo_size == 4
+  assert mcfly.compile_tree(copy).evaluate({'#x': 3}) == 1009
+  assert mcfly.user_functions == {}
+
+def test_parallel_bindings_with_spawned_workers(functions, monkeypatch):
+  functions('sq', ['#x'], '#x * #x')
+  functions('bigsq', ['#x'], '(fun sq #x) + 1000')
+  context = multiprocessing.get_context('spawn')
+  monkeypatch.setattr(mcfly, 'ProcessPoolExecutor', partial(mcfly.ProcessPoolExecutor, mp_context=context))
+  result = mcfly.evaluate_parallel_bindings('fun bigsq #x', [{'#x': x} for x in range(4)], workers=2, chunk_size=2)
+  assert sorted(result.results) == [1000, 1001, 1004, 1009]
+  result = mcfly.evaluate_parallel(['fun sq 3', 'fun bigsq 2'], workers=2, chunk_size=1)
+  assert sorted(result.results) == [9, 1004]
+
+# Batch Evaluation #
+
+def test_batch_conditional_only_evaluates_chosen_rows():
+  numpy = pytest.importorskip('numpy')
+  column = mcfly.evaluate_batch('if (#x != 0) (1/#x) 0', {'#x': numpy.array([0, 2, 4])})
+  assert column.tolist() == [0, 0.5, 0.25]
+
+def test_batch_short_circuit_only_evaluates_undecided_rows():
+  numpy = pytest.importorskip('numpy')
+  variables = {'#x': numpy.array([0, 2, 4])}
+  assert mcfly.evaluate_batch('#x != 0 and (1/#x) > 0', variables).tolist() == [False, True, True]
+  assert mcfly.evaluate_batch('#x == 0 or (1/#x) > 0', variables).tolist() == [True, True, True]
+  assert mcfly.evaluate_batch('#x == 0 nor (1/#x) > 1', variables).tolist() == [False, True, True]
+
+def test_batch_rejects_nan_in_ordering_comparisons():
+  numpy = pytest.importorskip('numpy')
+  variables = {'#a': numpy.array([float('nan'), 3.0])}
+  assert mcfly.evaluate_batch('#a == 3', variables).tolist() == [False, True]
+  with pytest.raises(Exception, match='NaN'):
+    mcfly.evaluate_batch('#a > 2', variables)
+
+# Rule Index #
+
+def brute_force_match(rules, variables):
+  return {rule_id for rule_id, text in enumerate(rules) if mcfly.compile(text).evaluate(variables) is True}
+
+def test_rule_index_matches_infinite_values():
+  rules = ['#b >= 2', '#b > 2', '#b < 2', '#b <= 2', '#b != 2', '#b == 2', '2 < #b']
+  index = mcfly.RuleIndex(rules)
+  for value in (float('inf'), float('-inf'), 2, 2.5, -3):
+    assert index.match({'#b': value}) == brute_force_match(rules, {'#b': value})
+
+def test_rule_index_with_only_infinite_bounds():
+  huge = '1' + '0' * 400 + '.0'
+  rules = [f'#x > {huge}', f'#x >= {huge}', f'#x == {huge}', f'#x < -{huge}', f'#x != {huge}']
+  index = mcfly.RuleIndex(rules)
+  for value in (float('inf'), float('-inf'), 0, 5.5):
+    assert index.match({'#x': value}) == brute_force_match(rules, {'#x': value})
+
+# Formula Sheet #
+
+def test_formula_sheet_rejects_cycles():
+  sheet = mcfly.FormulaSheet({'#b': '#a * 2', '#c': '#b + 1'}, {'#a': 1})
+  with pytest.raises(Exception, match='Cycle in formula sheet: #a -> #c -> #b -> #a'):
+    sheet.set_formula('#a', '#c - 1')
+  with pytest.raises(Exception, match='Cycle in formula sheet: #f -> #f'):
+    sheet.set_formula('#f', '#f + 1')
+  assert sheet.formulas.keys() == {'#b', '#c'}
+  assert sheet.set_value('#a', 2) == {'#a', '#b', '#c'}
+  assert sheet['#c'] == 5
+
+  with pytest.raises(Exception, match='Cycle in formula sheet: #p -> #q -> #p'):
+    mcfly.FormulaSheet({'#p': '#q + 1', '#q': '#p + 1'})
+
+def test_formula_sheet_recomputes_downstream_cells():
+  sheet = mcfly.FormulaSheet({'#b': '#a * 2', '#c': '#b + 1', '#y': '#x + 1'}, {'#a': 1, '#x': 5})
+  assert sheet.evaluations == 3
+  assert sheet.set_value('#a', 2) == {'#a', '#b', '#c'}
+  assert (sheet['#b'], sheet['#c'], sheet['#y']) == (4, 5, 6)
+  assert sheet.evaluations == 5
+  assert sheet.set_value('#a', 2) == set()
+  assert sheet.evaluations == 5
+
+def test_formula_sheet_stops_at_unchanged_values():
+  sheet = mcfly.FormulaSheet({'#b': '#a - #a', '#c': '#b + 1'}, {'#a': 1})
+  evaluations = sheet.evaluations
+  assert sheet.set_value('#a', 3) == {'#a'}
+  assert sheet.evaluations == evaluations + 1
+  assert sheet['#c'] == 1
+
+def test_formula_sheet_replaces_a_formula_with_a_value():
+  sheet = mcfly.FormulaSheet({'#b': '#a * 2', '#c': '#b + 1'}, {'#a': 1})
+  assert sheet.set_value('#b', 10) == {'#b', '#c'}
+  assert sheet.formulas.keys() == {'#c'}
+  assert sheet.dependents['#a'] == []
+  assert sheet.set_value('#a', 7) == {'#a'}
+  assert (sheet['#b'], sheet['#c']) == (10, 11)
+
+def test_formula_sheet_shares_functions_between_shapes():
+  sheet = mcfly.FormulaSheet({'#b': '#a * 2', '#c': '#x * 2', '#d': '#a * 3'}, {'#a': 1, '#x': 5})
+  assert len(sheet.shapes) == 2
+  assert sheet.formulas['#b'][0] is sheet.formulas['#c'][0]
+  assert sheet.formulas['#b'][0] is not sheet.formulas['#d'][0]
+  assert (sheet['#b'], sheet['#c'], sheet['#d']) == (2, 10, 3)
+
+def test_formula_sheet_keeps_errors_as_values():
+  sheet = mcfly.FormulaSheet({'#b': '#a / 0'}, {'#a': 1})
+  assert isinstance(sheet['#b'], Exception)
+  assert str(sheet['#b']) == 'Runtime math error'
+  assert sheet.set_formula('#b', '#a / 2') == {'#b'}
+  assert sheet['#b'] == 0.5
+
+# Parallel Evaluation #
+
+def test_parallel_bindings_of_a_deep_expression():
+  text = '+'.join(['#x'] * 5000)
+  result = mcfly.evaluate_parallel_bindings(text, [{'#x': x} for x in range(4)], workers=2, chunk_size=2)
+  assert sorted(result.results) == [0, 5000, 10000, 15000]
+
+# Profiling #
+
+def test_profile_counts_every_stage():
+  profile = mcfly.Profile()
+  assert profile.evaluate('(1 + 2) * 3') == 9
+  assert profile.evaluate('#x > 1', {'#x': 2}) == True
+  assert profile.evaluate('') == None
+  counts = profile.to_dict()
+  assert counts['expressions'] == 3
+  assert {stage: counts['stages'][stage]['calls'] for stage in counts['stages']} == {'lex': 3, 'parse': 3, 'interpret': 2}
+  assert counts['tokens'] == {'LPAREN': 1, 'INTEGER': 4, 'PLUS': 1, 'RPAREN': 1, 'MULTIPLY': 1, 'NUMBER_VAR': 1, 'GT': 1}
+  assert counts['nodes'] == {'MultiplyNode': 1, 'AddNode': 1, 'IntNode': 4, 'GreaterThanNode': 1, 'NumberSignNode': 1}
+  assert {name: visits['calls'] for name, visits in counts['visits'].items()} == {
+    'visit_MultiplyNode': 1, 'visit_AddNode': 1, 'visit_IntNode': 4, 'visit_GreaterThanNode': 1, 'visit_NumberSignNode': 1}
+  assert json.loads(profile.to_json()) == counts
+
+@pytest.mark.parametrize('name', ['operator chain', 'not chain', 'boolean chain'])
+def test_profile_walks_deep_inputs(name):
+  text, expected = deep_inputs[name]
+  profile = mcfly.Profile()
+  assert profile.evaluate(text, {'#x': 7}) == expected
+  visits = json.loads(profile.to_json())['visits']
+  assert {method[len('visit_'):]: visits[method]['calls'] for method in visits} == profile.node_counts
+  assert all(visits[method]['seconds'] >= 0 for method in visits)
+
+# Server #
+
+def serve_requests(data, **options):
+  async def exchange():
+    server = await asyncio.start_server(partial(mcfly.serve_connection, **options), '127.0.0.1', 0)
+    async with server:
+      reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+      writer.write(data)
+      writer.write_eof()
+      response = await reader.read()
+      writer.close()
+      await writer.wait_closed()
+      return response
+  return asyncio.run(exchange())
+
+def test_server_answers_pipelined_lines_in_order():
+  assert serve_requests(b'1+1\n2*3\n\n#pi > 3\n4/0') == b'2\n6\n\nTrue\nError: Runtime math error\n'
+
+def test_server_limits_every_line():
+  response = serve_requests(b'1+1\n' + b'1+' * 20 + b'1\n2+2\n', line_limit=16)
+  assert response == b'2\nError: Line too long\n'
+
+# Run #
+
+def test_profile_uses_the_numbers_backend(tmp_path, capsys):
+  path = tmp_path / 'lines.txt'
+  path.write_text('1/3\n100000000000000000000000000000000 / 3\n')
+  mcfly.main(['--file', str(path), '--numbers', 'fraction', '--profile'])
+  output = capsys.readouterr()
+  assert output.out == '1/3\n100000000000000000000000000000000/3\n'
+  assert output.err.startswith('2 expressions')
+
+def test_streams_compile_only_repeated_lines():
+  lines = ['1 + 2\n', 'sq 3\n', '1 + 2\n', '1 / 0\n', '\n', '1 / 0\n']
+  output = io.StringIO()
+  mcfly.evaluate_stream(lines, output)
+  assert output.getvalue() == '3\n9\n3\nError: Runtime math error\n\nError: Runtime math error\n'
+
+  cache = mcfly.ExpressionCache(threshold=mcfly.stream_tier_threshold)
+  mcfly.evaluate_stream(lines, io.StringIO(), evaluate_text=cache.evaluate)
+  assert {text: stats['tier'] for text, stats in cache.tiers().items()} == {
+    '1 + 2': 'compiled', 'sq 3': 'interpreter', '1 / 0': 'compiled', '': 'interpreter'}
+
+def test_tier_threshold_is_rejected_where_it_does_nothing(tmp_path):
+  with pytest.raises(SystemExit):
+    mcfly.main(['--file', str(tmp_path / 'lines.txt'), '--numbers', 'decimal', '--tier-threshold', '3'])